@@ -22,6 +22,7 @@ migrate = Migrate(render_as_batch=True)
 csrf = CSRFProtect()
 socketio = SocketIO()
 
+
 def create_app(config_class=DevelopmentConfig):
     
     app = Flask(__name__, instance_relative_config=True)
@@ -57,11 +58,18 @@ def create_app(config_class=DevelopmentConfig):
             UPLOAD_FOLDER = os.path.join(app.instance_path, 'uploads'),
             DRAWING_UPLOAD_FOLDER = os.path.join(app.instance_path, 'drawings')
         )
+        if app.config.get('QR_DISK_CACHE'):
+            app.config.setdefault('QR_CACHE_FOLDER', os.path.join(app.instance_path, 'qr_cache'))
+        app.config.setdefault('AUDIT_ARCHIVE_FOLDER', os.path.join(app.instance_path, 'audit_archive'))
         if not os.path.exists(app.config['UPLOAD_FOLDER']):
             os.makedirs(app.config['UPLOAD_FOLDER'])
         if not os.path.exists(app.config['DRAWING_UPLOAD_FOLDER']):
             os.makedirs(app.config['DRAWING_UPLOAD_FOLDER'])
 
+        from .services import qr_service, audit_service
+        qr_service.init_app(app)
+        audit_service.init_app(app)
+
         # --- РЕГИСТРАЦИЯ БЛЮПРИНТОВ ---
         from .main.routes import main as main_blueprint
         app.register_blueprint(main_blueprint)
@@ -106,6 +114,14 @@ def create_app(config_class=DevelopmentConfig):
         # --- Регистрация CLI команд ---
         from . import commands
         app.cli.add_command(commands.seed_command)
+        app.cli.add_command(commands.rebuild_progress_command)
+        app.cli.add_command(commands.rebuild_closure_command)
+        app.cli.add_command(commands.build_drawing_renditions_command)
+        app.cli.add_command(commands.sweep_drawings_command)
+        app.cli.add_command(commands.qr_bench_command)
+        app.cli.add_command(commands.purge_qr_cache_command)
+        app.cli.add_command(commands.audit_archive_command)
+        app.cli.add_command(commands.rebuild_search_index_command)
 
     # Возвращаем оба объекта для использования в run.py
     return app, socketio
\ No newline at end of file
@@ -59,6 +59,8 @@ class EditPartForm(FlaskForm):
     name = StringField('Наименование', validators=[DataRequired(), Length(max=150)])
     material = StringField('Материал', validators=[DataRequired(), Length(max=150)])
     size = StringField('Размер', validators=[Optional(), Length(max=100)])
+    parent_id = StringField('Входит в состав (обозначение родителя, пусто — корневая деталь)',
+                            validators=[Optional(), Length(max=100)])
     
     drawing = FileField('Заменить чертеж (необязательно)', validators=[
         Optional(),
@@ -94,6 +96,9 @@ class FileUploadForm(FlaskForm):
         FileRequired(),
         FileAllowed(['xlsx', 'xls', 'csv'], 'Только файлы Excel (.xlsx, .xls) или CSV (.csv)!')
     ])
+    dry_run = BooleanField('Только проверить файл (скачать отчет без импорта)')
+    update_existing = BooleanField('Обновлять существующие детали (наименование, материал, размер, кол-во, маршрут)')
+    indent_hierarchy = BooleanField('Строить состав по отступу наименования (если нет колонок «Поз.» и «Уровень»)')
     submit = SubmitField('Загрузить и импортировать')
 
 
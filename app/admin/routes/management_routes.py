@@ -2,8 +2,10 @@
 
 from flask import Blueprint, render_template, request, flash, redirect, url_for
 from flask_login import login_required, current_user
-from app.models.models import db, Part, AuditLog, RouteTemplate, RouteStage, Stage, Permission
+from app.models.models import (db, Part, RouteTemplate, RouteStage, Stage,
+                               PartStageProgress, Permission)
 from app.admin.forms import PartForm, FileUploadForm, StageDictionaryForm, RouteTemplateForm
+from app.services import route_service, audit_service
 
 management_bp = Blueprint('management', __name__)
 
@@ -36,7 +38,7 @@ def add_stage():
     form = StageDictionaryForm()
     if form.validate_on_submit():
         stage_name = form.name.data.strip()
-        if Stage.query.filter(Stage.name.ilike(stage_name)).first():
+        if Stage.query.filter(Stage.name_lower == stage_name.lower()).first():
             flash('Этап с таким названием уже существует.', 'error')
         else:
             new_stage = Stage(name=stage_name)
@@ -53,6 +55,7 @@ def delete_stage(stage_id):
         flash('Нельзя удалить этап, так как он используется в одном или нескольких маршрутах.', 'error')
     else:
         stage_name = stage.name
+        PartStageProgress.query.filter_by(stage_id=stage_id).delete()
         db.session.delete(stage)
         db.session.commit()
         flash(f'Этап "{stage_name}" удален из справочника.', 'success')
@@ -75,16 +78,20 @@ def add_route():
                 if current_default:
                     current_default.is_default = False
             
-            new_template = RouteTemplate(name=form.name.data, is_default=form.is_default.data)
+            new_template = RouteTemplate(
+                name=form.name.data, is_default=form.is_default.data,
+                operations_signature=route_service.signature_for_stage_ids(form.stages.data)
+            )
             db.session.add(new_template)
             for i, stage_id in enumerate(form.stages.data):
                 route_stage = RouteStage(template=new_template, stage_id=stage_id, order=i)
                 db.session.add(route_stage)
 
-            log_entry = AuditLog(user_id=current_user.id, action="Управление маршрутами", details=f"Создан новый маршрут '{new_template.name}'.", category='management')
-            db.session.add(log_entry)
+            audit_service.record(user_id=current_user.id, action="Управление маршрутами", details=f"Создан новый маршрут '{new_template.name}'.", category='management',
+                                 payload={'event': 'route_created'})
             
             db.session.commit()
+            route_service.invalidate_memo()
             
             flash('Новый технологический маршрут успешно создан.', 'success')
             return redirect(url_for('admin.management.list_routes'))
@@ -110,16 +117,18 @@ def edit_route(route_id):
 
             template.name = form.name.data
             template.is_default = form.is_default.data
+            template.operations_signature = route_service.signature_for_stage_ids(form.stages.data)
             
             RouteStage.query.filter_by(template_id=template.id).delete()
             for i, stage_id in enumerate(form.stages.data):
                 route_stage = RouteStage(template=template, stage_id=stage_id, order=i)
                 db.session.add(route_stage)
 
-            log_entry = AuditLog(user_id=current_user.id, action="Управление маршрутами", details=f"Изменен маршрут '{template.name}'.", category='management')
-            db.session.add(log_entry)
+            audit_service.record(user_id=current_user.id, action="Управление маршрутами", details=f"Изменен маршрут '{template.name}'.", category='management',
+                                 payload={'event': 'route_updated', 'route': template.id})
             
             db.session.commit()
+            route_service.invalidate_memo()
             
             flash('Маршрут успешно обновлен.', 'success')
             return redirect(url_for('admin.management.list_routes'))
@@ -139,8 +148,9 @@ def delete_route(route_id):
     else:
         template_name = template.name
         db.session.delete(template)
-        log_entry = AuditLog(user_id=current_user.id, action="Управление маршрутами", details=f"Удален маршрут '{template_name}'.", category='management')
-        db.session.add(log_entry)
+        audit_service.record(user_id=current_user.id, action="Управление маршрутами", details=f"Удален маршрут '{template_name}'.", category='management',
+                             payload={'event': 'route_deleted', 'route': route_id})
         db.session.commit()
+        route_service.invalidate_memo()
         flash(f'Маршрут "{template_name}" успешно удален.', 'success')
     return redirect(url_for('admin.management.list_routes'))
\ No newline at end of file
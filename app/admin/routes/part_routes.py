@@ -1,28 +1,69 @@
 # app/admin/routes/part_routes.py
 
-from flask import (Blueprint, render_template, request, flash, redirect, url_for,
-                   current_app, send_file, send_from_directory)
+import mimetypes
+import os
+from io import BytesIO
+from urllib.parse import quote as url_quote
+
+from flask import (Blueprint, render_template, request, flash, redirect, url_for, abort,
+                   current_app, send_file, stream_template, stream_with_context)
 from flask_login import login_required, current_user
 from sqlalchemy.exc import IntegrityError
+from werkzeug.http import http_date, is_resource_modified
+from werkzeug.security import safe_join
 
 from app import db
 from app.models.models import Part, RouteTemplate, Permission
-from app.utils import generate_qr_code, create_safe_file_name
+from app.utils import generate_qr_code, create_safe_file_name, to_safe_key
 from app.admin.forms import (PartForm, EditPartForm, FileUploadForm, ChangeRouteForm,
                              ConfirmForm, ChangeResponsibleForm, AddChildPartForm)
-from app.services import part_service
+from app.services import part_service, import_service, qr_service, qr_engine, label_service, drawing_service
 from app.admin.utils import permission_required
 
 part_bp = Blueprint('part', __name__)
 
 
+# Файлы хранилища по содержимому не меняются: браузер хранит их год без перепроверки
+DRAWING_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
 @part_bp.route('/drawings/<path:filename>')
 @login_required
 def serve_drawing(filename):
-    """Отдает файл чертежа из защищенной папки."""
-    return send_from_directory(
-        current_app.config['DRAWING_UPLOAD_FOLDER'], filename
-    )
+    """
+    Отдает файл чертежа из защищенной папки. Поддерживаются условные запросы
+    (ETag, Last-Modified) и диапазоны (Range). Файлы хранилища по содержимому
+    кэшируются как неизменяемые, с ETag, равным имени. В режиме DRAWING_SENDFILE
+    приложение только проверяет доступ и кэш, а байты отдает фронтовой прокси.
+    """
+    path = safe_join(current_app.config['DRAWING_UPLOAD_FOLDER'], filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    stat = os.stat(path)
+    immutable = drawing_service.is_content_addressed(filename)
+    etag = filename if immutable else f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+    sendfile_mode = current_app.config.get('DRAWING_SENDFILE')
+    if not sendfile_mode:
+        response = send_file(path, etag=etag, last_modified=stat.st_mtime, conditional=True)
+    elif not is_resource_modified(request.environ, etag=etag, last_modified=http_date(stat.st_mtime)):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        if sendfile_mode == 'x-accel':
+            response.headers['X-Accel-Redirect'] = current_app.config['DRAWING_ACCEL_PREFIX'] + url_quote(filename)
+        else:
+            response.headers['X-Sendfile'] = path
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+
+    response.cache_control.private = True
+    if immutable:
+        response.cache_control.max_age = DRAWING_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
 
 
 @part_bp.route('/add_single_part', methods=['POST'])
@@ -56,14 +97,29 @@ def add_single_part():
 @part_bp.route('/upload_excel', methods=['POST'])
 @permission_required(Permission.ADD_PARTS)
 def upload_excel():
-    """Обрабатывает загрузку и импорт деталей из Excel-файла."""
+    """
+    Обрабатывает загрузку и импорт деталей из Excel-файла.
+    В режиме пробного импорта возвращает CSV-отчет, ничего не записывая в БД.
+    """
     form = FileUploadForm()
     if form.validate_on_submit():
         try:
-            added, skipped = part_service.import_parts_from_excel(
-                form.file.data, current_user, current_app.config
+            if form.dry_run.data:
+                _, report = import_service.build_dry_run_report(form.file.data)
+                report_name = create_safe_file_name(f"import_check_{form.file.data.filename}.csv")
+                return send_file(report, mimetype='text/csv', as_attachment=True, download_name=report_name)
+
+            stats = part_service.import_parts_from_excel(
+                form.file.data, current_user, current_app.config,
+                update_existing=form.update_existing.data,
+                indent_hierarchy=form.indent_hierarchy.data
             )
-            flash(f"Импорт завершен. Добавлено: {added}, пропущено дубликатов: {skipped}.", 'success')
+            message = f"Импорт завершен. Добавлено: {stats.added}, пропущено дубликатов: {stats.skipped}."
+            if form.update_existing.data:
+                message = f"Импорт завершен. Добавлено: {stats.added}, обновлено: {stats.updated}, без изменений или пропущено: {stats.skipped}."
+            flash(message, 'success')
+            if stats.errors:
+                flash(f"Строк с ошибками: {stats.errors}. " + " ".join(stats.error_messages), 'error')
         except ValueError as e:
             flash(f"Ошибка валидации: {e}", 'error')
         except Exception as e:
@@ -95,6 +151,7 @@ def edit_part(part_id):
             flash(f"Данные для детали {part_id} успешно обновлены.", 'success')
             return redirect(url_for('main.history', part_id=part_id))
         except Exception as e:
+            db.session.rollback()
             flash(f"Произошла ошибка при обновлении: {e}", "error")
             current_app.logger.error(f"Error updating part {part_id}: {e}", exc_info=True)
 
@@ -128,7 +185,8 @@ def generate_single_qr(part_id):
         if qr_img_bytes:
             part_service.log_qr_generation(part_id, current_user)
             safe_filename = create_safe_file_name(f"part_{part_id}_qr.png")
-            return send_file(qr_img_bytes, mimetype='image/png', as_attachment=True, download_name=safe_filename)
+            return send_file(qr_img_bytes, mimetype='image/png', as_attachment=True, download_name=safe_filename,
+                             etag=qr_service.etag_for(part_id))
         else:
             flash(f'Не удалось создать QR-код для детали {part_id}.', 'error')
     else:
@@ -137,6 +195,30 @@ def generate_single_qr(part_id):
     return redirect(url_for('main.dashboard'))
 
 
+@part_bp.route('/qr/<path:part_id>')
+@permission_required(Permission.GENERATE_QR)
+def qr_image(part_id):
+    """
+    Отдает QR-код детали для встраивания в страницу. Ответ кэшируется браузером
+    и перепроверяется по ETag: при совпадении сразу отдается 304 без отрисовки.
+    Параметры строки запроса: format (png/svg), ec (L/M/Q/H), box, border, compact.
+    """
+    try:
+        options = qr_engine.parse_options(request.args)
+    except ValueError as e:
+        abort(400, description=str(e))
+    etag = qr_service.etag_for(part_id, **options)
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        image = qr_service.get_qr(part_id, **options)
+        response = send_file(BytesIO(image.data), mimetype=image.mimetype, etag=False)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['QR_MAX_AGE']
+    return response
+
+
 @part_bp.route('/qr_print_preview', methods=['POST'])
 @permission_required(Permission.GENERATE_QR)
 def qr_print_preview():
@@ -147,7 +229,45 @@ def qr_print_preview():
         return redirect(url_for('main.dashboard'))
 
     parts_for_print = part_service.get_parts_for_printing(part_ids)
-    return render_template('qr_print_preview.html', parts_for_print=parts_for_print)
+    # Страница отдается по частям: печать большой пачки этикеток начинается сразу
+    return stream_template('qr_print_preview.html', parts_for_print=parts_for_print)
+
+
+@part_bp.route('/qr_export', methods=['POST'])
+@permission_required(Permission.GENERATE_QR)
+def qr_export():
+    """
+    Потоково выгружает QR-коды изделия (поле product) или выбранных деталей:
+    ZIP-архив PNG/SVG или PDF с листами этикеток. Только POST с CSRF-токеном:
+    выгрузка пишется в журнал аудита.
+    """
+    export_format = request.form.get('format', 'png')
+    try:
+        if export_format not in label_service.EXPORT_FORMATS:
+            raise ValueError(f'Неизвестный формат выгрузки: {export_format}.')
+        # Формат выгрузки разобран выше, остальное — параметры отрисовки QR-кода
+        options = qr_engine.parse_options({name: value for name, value in request.form.items() if name != 'format'})
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('main.dashboard'))
+
+    product = request.form.get('product')
+    parts = label_service.get_parts(product=product, part_ids=request.form.getlist('part_ids'))
+    if not parts:
+        flash('Не найдено ни одной детали для выгрузки QR-кодов.', 'error')
+        return redirect(url_for('main.dashboard'))
+
+    part_service.log_qr_export(len(parts), export_format, current_user, product)
+    download_name = f"qr_{to_safe_key(product) if product else 'selected'}"
+    if export_format == 'pdf':
+        body, mimetype, download_name = label_service.stream_pdf(parts, **options), 'application/pdf', f"{download_name}.pdf"
+    else:
+        body = label_service.stream_zip([part.part_id for part in parts], export_format, **options)
+        mimetype, download_name = 'application/zip', f"{download_name}_{export_format}.zip"
+
+    response = current_app.response_class(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    return response
 
 
 @part_bp.route('/change_route/<path:part_id>', methods=['GET', 'POST'])
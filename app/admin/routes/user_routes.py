@@ -1,32 +1,85 @@
 
 # app/admin/routes/user_routes.py
 
-from flask import Blueprint, render_template, request, flash, redirect, url_for
+from datetime import datetime
+
+from flask import Blueprint, render_template, request, flash, redirect, url_for, abort
 from flask_login import login_user, logout_user, login_required, current_user
 from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 
-from app.models.models import db, User, AuditLog, Role, Permission
+from app.models.models import db, User, Role, Permission
 from app.admin.forms import LoginForm, AddUserForm, EditUserForm, RoleForm
 from app.admin.utils import admin_required, permission_required
+from app.services import audit_service, audit_archive_service, search_service
 
 user_bp = Blueprint('user', __name__)
 
+def _render_log(template, categories):
+    """
+    Страница журнала: keyset-пагинация «к более старым» (?cursor=), фильтр по ключам
+    payload (?event=...) и примерное общее число записей. С ?q= — полнотекстовый поиск
+    по действию и подробностям с учетом тех же фильтров, записи по убыванию релевантности.
+    """
+    cursor = request.args.get('cursor') or None
+    query = request.args.get('q', '').strip()
+    try:
+        filters = audit_service.parse_payload_filter(request.args)
+        if query:
+            logs, next_cursor = search_service.search(
+                query, scopes=('audit',), categories=categories, payload=filters,
+                cursor=cursor, limit=audit_service.LOG_PAGE_SIZE
+            )
+        else:
+            logs, next_cursor = audit_service.get_log_page(categories, cursor=cursor, payload=filters)
+    except ValueError:
+        abort(400)
+    total, approximate = (None, False) if query else audit_service.estimate_count(categories, filters)
+    link_args = dict(filters, q=query) if query else filters
+    return render_template(template, logs=logs, cursor=cursor, next_cursor=next_cursor,
+                           total=total, approximate=approximate, filters=filters, events=audit_service.EVENTS,
+                           query=query, link_args=link_args)
+
 @user_bp.route('/audit_log')
 @permission_required(Permission.VIEW_AUDIT_LOG)
 def audit_log():
-    page = request.args.get('page', 1, type=int)
-    logs = AuditLog.query.options(joinedload(AuditLog.user)).filter_by(category='part').order_by(AuditLog.timestamp.desc()).paginate(page=page, per_page=25)
-    return render_template('audit_log.html', logs=logs)
+    return _render_log('audit_log.html', audit_service.PART_CATEGORIES)
 
 @user_bp.route('/user_log')
 @permission_required(Permission.VIEW_AUDIT_LOG)
 def user_log():
-    page = request.args.get('page', 1, type=int)
-    user_logs = AuditLog.query.options(joinedload(AuditLog.user)).filter(
-        AuditLog.category.in_(['auth', 'management'])
-    ).order_by(AuditLog.timestamp.desc()).paginate(page=page, per_page=25)
-    return render_template('user_log.html', logs=user_logs)
+    return _render_log('user_log.html', audit_service.USER_CATEGORIES)
+
+@user_bp.route('/audit_log/archive')
+@permission_required(Permission.VIEW_AUDIT_LOG)
+def audit_archive():
+    """Поиск по архивам журнала (flask audit-archive): файлы читаются только при заданных условиях."""
+    month = request.args.get('month') or None
+    filters = {
+        'query': request.args.get('q') or None,
+        'part_id': request.args.get('part_id') or None,
+        'category': request.args.get('category') or None,
+    }
+    searched = bool(month or any(filters.values()))
+    entries = []
+    if searched:
+        date_from = date_to = None
+        if month:
+            try:
+                date_from = datetime.strptime(month, '%Y-%m')
+            except ValueError:
+                abort(400)
+            date_to = audit_archive_service.add_months(date_from, 1)
+        entries = audit_archive_service.search_archive(date_from=date_from, date_to=date_to, **filters)
+        user_ids = {entry['user_id'] for entry in entries}
+        usernames = dict(db.session.execute(
+            db.select(User.id, User.username).where(User.id.in_(user_ids))
+        ).all()) if user_ids else {}
+        for entry in entries:
+            entry['username'] = usernames.get(entry['user_id'])
+    return render_template('audit_archive.html', archives=audit_archive_service.list_archives(),
+                           entries=entries, searched=searched, month=month,
+                           limit=audit_archive_service.SEARCH_DEFAULT_LIMIT)
 
 @user_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -38,8 +91,8 @@ def login():
         user = User.query.filter_by(username=form.username.data).first()
         if user and user.check_password(form.password.data):
             login_user(user)
-            log_entry = AuditLog(user_id=user.id, action="Вход в систему", details=f"Пользователь '{user.username}' вошел в систему.", category='auth')
-            db.session.add(log_entry)
+            audit_service.record(user_id=user.id, action="Вход в систему", details=f"Пользователь '{user.username}' вошел в систему.", category='auth',
+                                 payload={'event': 'login'})
             db.session.commit()
             flash('Вы успешно вошли в систему!', 'success')
             return redirect(url_for('main.dashboard'))
@@ -50,8 +103,8 @@ def login():
 @user_bp.route('/logout')
 @login_required
 def logout():
-    log_entry = AuditLog(user_id=current_user.id, action="Выход из системы", details=f"Пользователь '{current_user.username}' вышел из системы.", category='auth')
-    db.session.add(log_entry)
+    audit_service.record(user_id=current_user.id, action="Выход из системы", details=f"Пользователь '{current_user.username}' вышел из системы.", category='auth',
+                         payload={'event': 'logout'})
     db.session.commit()
     logout_user()
     flash('Вы вышли из системы.', 'success')
@@ -71,8 +124,8 @@ def add_role():
         permissions_sum = sum(form.permissions.data)
         new_role = Role(name=form.name.data, permissions=permissions_sum)
         db.session.add(new_role)
-        log_entry = AuditLog(user_id=current_user.id, action="Управление ролями", details=f"Создана новая роль '{new_role.name}'.", category='management')
-        db.session.add(log_entry)
+        audit_service.record(user_id=current_user.id, action="Управление ролями", details=f"Создана новая роль '{new_role.name}'.", category='management',
+                             payload={'event': 'role_created'})
         db.session.commit()
         flash(f'Роль "{new_role.name}" успешно создана.', 'success')
         return redirect(url_for('admin.user.list_roles'))
@@ -88,8 +141,8 @@ def edit_role(role_id):
     if form.validate_on_submit():
         role.name = form.name.data
         role.permissions = sum(form.permissions.data)
-        log_entry = AuditLog(user_id=current_user.id, action="Управление ролями", details=f"Изменена роль '{role.name}'.", category='management')
-        db.session.add(log_entry)
+        audit_service.record(user_id=current_user.id, action="Управление ролями", details=f"Изменена роль '{role.name}'.", category='management',
+                             payload={'event': 'role_updated', 'role': role.id})
         db.session.commit()
         flash(f'Роль "{role.name}" успешно обновлена.', 'success')
         return redirect(url_for('admin.user.list_roles'))
@@ -108,8 +161,8 @@ def delete_role(role_id):
     else:
         role_name = role.name
         db.session.delete(role)
-        log_entry = AuditLog(user_id=current_user.id, action="Управление ролями", details=f"Удалена роль '{role_name}'.", category='management')
-        db.session.add(log_entry)
+        audit_service.record(user_id=current_user.id, action="Управление ролями", details=f"Удалена роль '{role_name}'.", category='management',
+                             payload={'event': 'role_deleted', 'role': role_id})
         db.session.commit()
         flash(f'Роль "{role_name}" успешно удалена.', 'success')
     return redirect(url_for('admin.user.list_roles'))
@@ -134,8 +187,8 @@ def add_user():
             )
             new_user.set_password(form.password.data)
             db.session.add(new_user)
-            log_entry = AuditLog(user_id=current_user.id, action="Управление пользователями", details=f"Создан новый пользователь '{new_user.username}'.", category='management')
-            db.session.add(log_entry)
+            audit_service.record(user_id=current_user.id, action="Управление пользователями", details=f"Создан новый пользователь '{new_user.username}'.", category='management',
+                                 payload={'event': 'user_created'})
             db.session.commit()
             flash(f'Пользователь {new_user.username} успешно создан.', 'success')
             return redirect(url_for('admin.user.list_users'))
@@ -155,8 +208,8 @@ def edit_user(user_id):
             user.role = form.role.data
             if form.password.data:
                 user.set_password(form.password.data)
-            log_entry = AuditLog(user_id=current_user.id, action="Управление пользователями", details=f"Изменены данные пользователя '{user.username}'.", category='management')
-            db.session.add(log_entry)
+            audit_service.record(user_id=current_user.id, action="Управление пользователями", details=f"Изменены данные пользователя '{user.username}'.", category='management',
+                                 payload={'event': 'user_updated', 'user': user.id})
             db.session.commit()
             flash(f'Данные пользователя {user.username} обновлены.', 'success')
             return redirect(url_for('admin.user.list_users'))
@@ -189,8 +242,8 @@ def delete_user(user_id):
             return redirect(url_for('admin.user.list_users'))
     # --- КОНЕЦ ФИНАЛЬНОГО ИСПРАВЛЕНИЯ ---
 
-    log_entry = AuditLog(user_id=current_user.id, action="Управление пользователями", details=f"Удален пользователь '{username_deleted}'.", category='management')
-    db.session.add(log_entry)
+    audit_service.record(user_id=current_user.id, action="Управление пользователями", details=f"Удален пользователь '{username_deleted}'.", category='management',
+                         payload={'event': 'user_deleted', 'user': user_id})
     db.session.delete(user_to_delete)
     db.session.commit()
     flash(f'Пользователь {username_deleted} удален.', 'success')
@@ -39,4 +39,141 @@ def seed_command():
         click.secho("\nВАЖНО: Этот пароль отображается только один раз. Сохраните его в надежном месте.", fg="yellow")
         click.echo("------------------------------------")
     else:
-        click.echo("Пользователи уже существуют. Пропуск создания администратора.")
\ No newline at end of file
+        click.echo("Пользователи уже существуют. Пропуск создания администратора.")
+
+@click.command('rebuild-progress')
+@with_appcontext
+def rebuild_progress_command():
+    """
+    Перестраивает материализованный прогресс деталей по этапам
+    (таблица PartStageProgress) из истории статусов.
+    """
+    from .services import progress_service
+
+    click.echo("Пересчет прогресса по этапам из истории статусов...")
+    rows_count = progress_service.rebuild_stage_progress()
+    click.secho(f"Готово. Записей прогресса: {rows_count}.", fg="green")
+
+
+@click.command('rebuild-closure')
+@with_appcontext
+def rebuild_closure_command():
+    """
+    Перестраивает таблицу замыкания иерархии деталей (PartClosure)
+    по полю Parts.parent_id.
+    """
+    from .services import hierarchy_service
+
+    click.echo("Перестройка таблицы замыкания иерархии деталей...")
+    rows_count = hierarchy_service.rebuild_closure()
+    click.secho(f"Готово. Строк замыкания: {rows_count}.", fg="green")
+
+
+@click.command('build-drawing-renditions')
+@with_appcontext
+def build_drawing_renditions_command():
+    """
+    Создает уменьшенные копии (WebP) для уже загруженных чертежей,
+    у которых их еще нет.
+    """
+    from .services import drawing_service
+
+    click.echo("Создание уменьшенных копий чертежей...")
+    parts_count = drawing_service.build_missing_renditions()
+    click.secho(f"Готово. Обработано чертежей: {parts_count}.", fg="green")
+
+
+@click.command('sweep-drawings')
+@click.option('--grace-hours', default=1.0, show_default=True,
+              help='Не трогать файлы, освобожденные или созданные позже этого срока.')
+@click.option('--dry-run', is_flag=True, help='Только показать, сколько будет удалено.')
+@with_appcontext
+def sweep_drawings_command(grace_hours, dry_run):
+    """
+    Удаляет из хранилища чертежи, на которые не ссылается ни одна деталь,
+    и файлы в папке чертежей, которых нет в хранилище.
+    """
+    from datetime import timedelta
+    from .services import drawing_service
+
+    result = drawing_service.sweep(grace=timedelta(hours=grace_hours), dry_run=dry_run)
+    prefix = "Будет удалено" if dry_run else "Удалено"
+    click.secho(f"{prefix}: записей хранилища {result['blobs']}, файлов {result['files']}.", fg="green")
+
+
+@click.command('qr-bench')
+@click.option('--count', default=200, show_default=True, help='Сколько кодов рисовать в каждом режиме.')
+@click.option('--part-id', default='ИЗД-001.02.003', show_default=True, help='Обозначение детали для кодирования.')
+@with_appcontext
+def qr_bench_command(count, part_id):
+    """
+    Сравнивает время генерации и размер QR-кодов по режимам:
+    PNG/SVG, полный/компактный URL, уровни коррекции ошибок L/M/Q/H.
+    """
+    from .services import qr_service
+
+    click.echo(f"{'Формат':<7}{'URL':<12}{'Коррекция':<11}{'Версия':>7}{'мс/код':>10}{'Байт':>9}")
+    for row in qr_service.benchmark(part_id, count):
+        url_kind = 'компактный' if row['compact'] else 'полный'
+        click.echo(f"{row['format']:<7}{url_kind:<12}{row['error_correction']:<11}"
+                   f"{row['version']:>7}{row['ms']:>10.2f}{row['bytes']:>9}")
+
+
+@click.command('purge-qr-cache')
+@click.option('--older-than-days', type=click.FloatRange(min=0), default=None,
+              help='Удалять только коды, не использованные дольше этого срока (по умолчанию — все).')
+@with_appcontext
+def purge_qr_cache_command(older_than_days):
+    """
+    Очищает дисковый кэш QR-кодов (instance/qr_cache). Коды, которые
+    понадобятся снова, будут нарисованы заново при первом запросе.
+    """
+    import os
+    from datetime import timedelta
+    from flask import current_app
+    from .services import qr_service
+
+    folder = current_app.config.get('QR_CACHE_FOLDER') or os.path.join(current_app.instance_path, 'qr_cache')
+    max_age = timedelta(days=older_than_days) if older_than_days is not None else None
+    removed = qr_service.purge_disk_cache(folder, max_age)
+    click.secho(f"Готово. Удалено файлов кэша QR-кодов: {removed}.", fg="green")
+
+
+@click.command('audit-archive')
+@click.option('--months', default=12, show_default=True,
+              help='Сколько последних полных месяцев журнала оставить в БД.')
+@with_appcontext
+def audit_archive_command(months):
+    """
+    Выгружает журнал аудита старше --months месяцев в сжатые файлы JSONL
+    (instance/audit_archive/audit-ГГГГ-ММ.jsonl.gz) и удаляет его из БД.
+    В PostgreSQL заодно создает месячные секции AuditLogs на ближайшие месяцы.
+    """
+    from .services import audit_archive_service
+
+    for month in audit_archive_service.ensure_partitions():
+        click.echo(f"Создана секция журнала за {month:%Y-%m}.")
+    try:
+        results = audit_archive_service.archive(months)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--months')
+    for result in results:
+        click.echo(f"{result['month']:%Y-%m}: записей {result['rows']}"
+                   + (f" -> {result['file']}" if result['file'] else ""))
+    total = sum(result['rows'] for result in results)
+    click.secho(f"Готово. В архив перенесено записей: {total}.", fg="green")
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """
+    Перестраивает зеркало полнотекстового поиска FTS5 (SQLite) по журналу аудита
+    и примечаниям. В PostgreSQL поиск идет по GIN-индексам, перестраивать нечего.
+    """
+    from .services import search_service
+
+    if search_service.rebuild_index():
+        click.secho("Индекс полнотекстового поиска перестроен.", fg="green")
+    else:
+        click.echo("Индексы поиска поддерживает PostgreSQL, перестраивать нечего.")
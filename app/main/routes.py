@@ -1,21 +1,15 @@
 # app/main/routes.py
 
 from flask import (Blueprint, render_template, jsonify, request, redirect,
-                   url_for, flash, current_app)
-from sqlalchemy import func
-from sqlalchemy.orm import joinedload 
-
+                   url_for, flash, current_app, abort)
 from datetime import datetime, timezone
-# --- НАЧАЛО ИЗМЕНЕНИЯ 1: Импортируем defaultdict ---
-from collections import Counter, defaultdict
-# --- КОНЕЦ ИЗМЕНЕНИЯ 1 ---
 
 from app import db, socketio
 from flask_login import current_user, login_required
-from app.models.models import (Part, StatusHistory, AuditLog, RouteTemplate,
+from app.models.models import (Part, StatusHistory,
                                RouteStage, Stage, PartNote, Permission)
 from app.admin.forms import ConfirmStageQuantityForm, AddNoteForm, AddChildPartForm
-from app.services import query_service
+from app.services import query_service, progress_service, hierarchy_service, qr_engine, audit_service, search_service
 from app.utils import to_safe_key
 
 main = Blueprint('main', __name__)
@@ -35,17 +29,13 @@ def dashboard():
     Главная страница (панель мониторинга).
     Отображает сводную информацию по всем изделиям.
     """
-    # Запрос выбирает только "корневые" детали (у которых нет родителя)
-    product_progress_query = db.session.query(
-        Part.product_designation,
-        func.count(Part.part_id).label('total_parts'),
-        func.sum(Part.quantity_total).label('total_quantity'),
-        func.sum(Part.quantity_completed).label('completed_quantity')
-    ).filter(Part.parent_id.is_(None)).group_by(Part.product_designation).all()
+    # Партии — корневые детали, прогресс — по всему составу их сборок (из кэша AssemblyProgress)
+    product_progress_query = progress_service.get_product_assembly_summary()
 
     products = [{
         'product_designation': row.product_designation,
         'total_parts': row.total_parts,
+        'assembly_parts': row.assembly_parts or 0,
         'total_possible_stages': row.total_quantity or 0,
         'total_completed_stages': row.completed_quantity or 0
     } for row in product_progress_query]
@@ -53,48 +43,59 @@ def dashboard():
     return render_template('dashboard.html', products=products)
 
 
+def _serialize_assembly(assembly):
+    """Сводный прогресс сборки для JSON; None для деталей без состава."""
+    if assembly is None or assembly.part_count <= 1:
+        return None
+    return {
+        'part_count': assembly.part_count,
+        'quantity_total': assembly.quantity_total,
+        'quantity_completed': assembly.quantity_completed
+    }
+
+
 @main.route('/api/parts/<path:product_designation>')
 def api_parts_for_product(product_designation):
     """
-    API-эндпоинт для динамической загрузки списка деталей для изделия.
+    API-эндпоинт для постраничной загрузки списка деталей изделия.
+
+    Параметры запроса: cursor, limit, sort (part_id|name|material|status|date_added),
+    order (asc|desc) и фильтры status, responsible (id или 'none'), material, q.
     """
-    parts_query = Part.query.options(
-        joinedload(Part.route_template).joinedload(RouteTemplate.stages).joinedload(RouteStage.stage),
-        joinedload(Part.responsible)
-    ).filter(
-        Part.product_designation == product_designation,
-        Part.parent_id.is_(None)
-    ).order_by(Part.part_id.asc())
+    filters = {key: request.args.get(key, '').strip()
+               for key in ('status', 'responsible', 'material', 'q')}
+    try:
+        parts, next_cursor, total = query_service.get_parts_page(
+            product_designation,
+            filters=filters,
+            sort=request.args.get('sort', 'part_id'),
+            descending=request.args.get('order') == 'desc',
+            cursor=request.args.get('cursor') or None,
+            limit=request.args.get('limit', query_service.PARTS_PAGE_DEFAULT_LIMIT, type=int)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    progress_map = progress_service.get_progress_map([part.part_id for part in parts])
+    assembly_map = progress_service.get_assembly_progress_map([part.part_id for part in parts])
 
     parts_list = []
-    for part in parts_query:
-        # --- НАЧАЛО ИЗМЕНЕНИЯ 2: Полностью переработана логика расчета статусов ---
+    for part in parts:
+        # Статусы этапов читаются из материализованной таблицы PartStageProgress,
+        # а не пересчитываются по всей истории детали на каждый запрос.
         route_stages_data = []
         if part.route_template:
-            # Суммируем фактическое количество выполненных изделий по каждому этапу
-            completed_quantities = defaultdict(int)
-            for h in part.history:
-                completed_quantities[h.status] += h.quantity
-
+            part_progress = progress_map.get(part.part_id, {})
             ordered_stages = sorted(part.route_template.stages, key=lambda s: s.order)
-            
-            for rs in ordered_stages:
-                stage_name = rs.stage.name
-                qty_done = completed_quantities.get(stage_name, 0)
-                status = 'pending' # По умолчанию - не начат
-
-                if qty_done >= part.quantity_total:
-                    status = 'completed' # Выполнен, если сделано >= общего кол-ва
-                elif qty_done > 0:
-                    status = 'in_progress' # В процессе, если сделано > 0, но < общего
 
+            for rs in ordered_stages:
+                progress = part_progress.get(rs.stage_id)
                 route_stages_data.append({
-                    'name': stage_name, 
-                    'status': status,
-                    'qty_done': qty_done
+                    'name': rs.stage.name,
+                    'status': progress.status if progress else progress_service.STATUS_PENDING,
+                    'qty_done': progress.qty_done if progress else 0
                 })
-        # --- КОНЕЦ ИЗМЕНЕНИЯ 2 ---
-        
+
         parts_list.append({
             'part_id': part.part_id,
             'name': part.name,
@@ -103,11 +104,14 @@ def api_parts_for_product(product_designation):
             'creation_date': part.date_added.strftime('%Y-%m-%d'),
             'quantity_completed': part.quantity_completed,
             'quantity_total': part.quantity_total,
+            'assembly': _serialize_assembly(assembly_map.get(part.part_id)),
             'history_url': url_for('main.history', part_id=part.part_id),
             'route_stages': route_stages_data,
             'delete_url': url_for('admin.part.delete_part', part_id=part.part_id),
             'edit_url': url_for('admin.part.edit_part', part_id=part.part_id),
             'qr_url': url_for('admin.part.generate_single_qr', part_id=part.part_id),
+            # Миниатюра появляется, когда фоновая задача создаст копию чертежа
+            'drawing_thumb_url': url_for('admin.part.serve_drawing', filename=part.drawing_thumb_filename) if part.drawing_thumb_filename else None,
             'responsible_user': part.responsible.username if part.responsible else 'Не назначен'
         })
 
@@ -119,14 +123,104 @@ def api_parts_for_product(product_designation):
             'can_generate_qr': current_user.can(Permission.GENERATE_QR)
         }
 
-    return jsonify({'parts': parts_list, 'permissions': permissions})
+    return jsonify({
+        'parts': parts_list,
+        'permissions': permissions,
+        'next_cursor': next_cursor,
+        'total': total
+    })
+
+
+# Отдельный префикс: обозначение изделия в /api/parts/<path:...> может само оканчиваться на '/tree'
+@main.route('/api/part-tree/<path:part_id>')
+def api_part_tree(part_id):
+    """API-эндпоинт: весь состав детали, загруженный одним рекурсивным запросом."""
+    part_tree = query_service.get_part_subtree(part_id)
+    if part_tree is None:
+        return jsonify({'error': f"Деталь {part_id} не найдена."}), 404
+    return jsonify(query_service.serialize_part_tree(part_tree))
+
+
+# Отдельный префикс по той же причине, что и у /api/part-tree
+@main.route('/api/part-history/<path:part_id>')
+def api_part_history(part_id):
+    """
+    API-эндпоинт для подгрузки ленты истории детали при прокрутке.
+    Параметры запроса: cursor, limit и необязательный фильтр записей аудита
+    по ключам payload (event, route_new, stage, ...). Вместе с данными отдается
+    готовая разметка записей (та же, что на странице истории).
+    """
+    db.get_or_404(Part, part_id)
+    try:
+        entries, next_cursor = query_service.get_history_page(
+            part_id,
+            cursor=request.args.get('cursor') or None,
+            limit=request.args.get('limit', query_service.HISTORY_PAGE_DEFAULT_LIMIT, type=int),
+            payload=audit_service.parse_payload_filter(request.args)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'entries': [query_service.serialize_history_entry(entry) for entry in entries],
+        'html': render_template('_history_entries.html', entries=entries),
+        'next_cursor': next_cursor
+    })
+
+
+@main.route('/api/search')
+@login_required
+def api_search():
+    """
+    Полнотекстовый поиск по журналу аудита и примечаниям к деталям, по убыванию релевантности.
+    Параметры запроса: q, scope (audit, note или all), part_id, cursor, limit и фильтр
+    записей аудита по ключам payload. Записи журнала ищутся только при праве его просмотра.
+    """
+    scope = request.args.get('scope', 'all')
+    scopes = search_service.SCOPES if scope == 'all' else (scope,)
+    if 'audit' in scopes and not current_user.can(Permission.VIEW_AUDIT_LOG):
+        if scope == 'audit':
+            abort(403)
+        scopes = tuple(s for s in scopes if s != 'audit')
+    try:
+        entries, next_cursor = search_service.search(
+            request.args.get('q', ''),
+            scopes=scopes,
+            part_id=request.args.get('part_id') or None,
+            payload=audit_service.parse_payload_filter(request.args),
+            cursor=request.args.get('cursor') or None,
+            limit=request.args.get('limit', search_service.SEARCH_PAGE_DEFAULT_LIMIT, type=int)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'results': [query_service.serialize_history_entry(entry) for entry in entries],
+        'next_cursor': next_cursor
+    })
 
 
 @main.route('/history/<path:part_id>')
 def history(part_id):
-    """Страница с полной историей одной детали."""
+    """
+    Страница истории одной детали: первая страница ленты, остальное подгружается при прокрутке.
+    С ?q= вместо ленты показываются найденные примечания детали (по релевантности, ?cursor=).
+    """
     part = db.get_or_404(Part, part_id)
-    combined_history = query_service.get_combined_history(part)
+    query = request.args.get('q', '').strip()
+    if query:
+        try:
+            combined_history, search_cursor = search_service.search(
+                query, scopes=('note',), part_id=part.part_id, cursor=request.args.get('cursor') or None
+            )
+        except ValueError:
+            abort(400)
+        history_cursor = None
+    else:
+        combined_history, history_cursor = query_service.get_history_page(part.part_id)
+        search_cursor = None
+    part_tree = query_service.get_part_subtree(part.part_id)
+    ancestors = hierarchy_service.get_ancestors(part.part_id)
     note_form = AddNoteForm()
     child_form = AddChildPartForm()
 
@@ -138,8 +232,9 @@ def history(part_id):
         note_form.stage.query = db.session.query(Stage).filter_by(id=-1)
 
     return render_template(
-        'history.html', part=part, combined_history=combined_history,
-        note_form=note_form, child_form=child_form
+        'history.html', part=part, combined_history=combined_history, history_cursor=history_cursor,
+        query=query, search_cursor=search_cursor,
+        part_tree=part_tree, ancestors=ancestors, note_form=note_form, child_form=child_form
     )
 
 
@@ -151,19 +246,16 @@ def select_stage(part_id):
         flash('Ошибка: Этой детали не присвоен технологический маршрут.', 'error')
         return redirect(url_for('main.dashboard'))
 
-    # --- НАЧАЛО ИЗМЕНЕНИЯ 3: Исправлена логика определения следующего этапа ---
-    completed_quantities = defaultdict(int)
-    for h in part.history:
-        completed_quantities[h.status] += h.quantity
-        
+    part_progress = progress_service.get_progress_map([part.part_id]).get(part.part_id, {})
+
     ordered_stages = sorted(part.route_template.stages, key=lambda s: s.order)
     next_stage_obj = None
     for rs in ordered_stages:
         # Ищем первый этап, на котором выполнено меньше, чем общее количество
-        if completed_quantities.get(rs.stage.name, 0) < part.quantity_total:
+        progress = part_progress.get(rs.stage_id)
+        if (progress.qty_done if progress else 0) < part.quantity_total:
             next_stage_obj = rs.stage
             break
-    # --- КОНЕЦ ИЗМЕНЕНИЯ 3 ---
 
     form = ConfirmStageQuantityForm()
     if next_stage_obj and form.quantity.data is None:
@@ -175,6 +267,17 @@ def select_stage(part_id):
     )
 
 
+@main.route(f'/{qr_engine.COMPACT_PATH}/<token>')
+@main.route(f'/{qr_engine.COMPACT_PATH.lower()}/<token>')
+def scan_compact(token):
+    """Компактный адрес из QR-кода (/S/<токен>): перенаправляет на страницу сканирования."""
+    try:
+        part_id = qr_engine.decode_token(token)
+    except ValueError:
+        abort(404)
+    return redirect(url_for('main.select_stage', part_id=part_id))
+
+
 @main.route('/confirm_stage/<path:part_id>/<int:stage_id>', methods=['POST'])
 def confirm_stage(part_id, stage_id):
     """Обрабатывает подтверждение завершения этапа."""
@@ -186,7 +289,7 @@ def confirm_stage(part_id, stage_id):
         quantity_done = form.quantity.data
         
         # --- НАЧАЛО ИЗМЕНЕНИЯ 4: Более точная проверка остатка ---
-        completed_on_this_stage = db.session.query(func.sum(StatusHistory.quantity)).filter_by(part_id=part.part_id, status=stage.name).scalar() or 0
+        completed_on_this_stage = progress_service.get_stage_qty_done(part, stage)
         remaining_on_stage = part.quantity_total - completed_on_this_stage
         
         if quantity_done > remaining_on_stage:
@@ -206,6 +309,8 @@ def confirm_stage(part_id, stage_id):
             quantity=quantity_done
         )
         db.session.add(new_history)
+        progress_service.apply_stage_completion(part, stage, quantity_done, part.last_update)
+        progress_service.invalidate_assembly_progress([part.part_id])
         db.session.commit()
 
         # Отправляем событие на обновление дашборда
@@ -259,11 +364,11 @@ def add_note(part_id):
         db.session.add(new_note)
 
         log_details = f"К детали '{part.part_id}' добавлено примечание."
-        log_entry = AuditLog(
+        audit_service.record(
             user_id=current_user.id, action="Добавлено примечание",
-            details=log_details, category='part', part_id=part.part_id
+            details=log_details, category='part', part_id=part.part_id,
+            payload={'event': 'note_added', 'stage': stage_obj.name if stage_obj else None}
         )
-        db.session.add(log_entry)
         db.session.commit()
         flash('Примечание успешно добавлено.', 'success')
     else:
@@ -285,11 +390,11 @@ def edit_note(note_id):
     if new_text and new_text.strip():
         note.text = new_text
         log_details = f"В детали '{note.part_id}' изменено примечание (ID: {note.id})."
-        log_entry = AuditLog(
+        audit_service.record(
             user_id=current_user.id, action="Изменено примечание",
-            details=log_details, category='management', part_id=note.part_id
+            details=log_details, category='management', part_id=note.part_id,
+            payload={'event': 'note_edited', 'note': note.id}
         )
-        db.session.add(log_entry)
         db.session.commit()
         # --- НАЧАЛО ИЗМЕНЕНИЯ 5: Возвращаем JSON вместо редиректа ---
         return jsonify({'status': 'success', 'message': 'Примечание обновлено.', 'new_text': new_text})
@@ -311,11 +416,11 @@ def delete_note(note_id):
 
     part_id = note.part_id
     log_details = f"В детали '{part_id}' удалено примечание (ID: {note.id})."
-    log_entry = AuditLog(
+    audit_service.record(
         user_id=current_user.id, action="Удалено примечание",
-        details=log_details, category='management', part_id=part_id
+        details=log_details, category='management', part_id=part_id,
+        payload={'event': 'note_deleted', 'note': note.id}
     )
-    db.session.add(log_entry)
 
     db.session.delete(note)
     db.session.commit()
@@ -2,6 +2,9 @@
 
 from app import db
 from datetime import datetime, timezone
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import validates
+from app.services.sql_utils import json_text
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin, AnonymousUserMixin
 
@@ -9,6 +12,14 @@ class Stage(db.Model):
     __tablename__ = 'Stages'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
+    # Название в нижнем регистре (str.lower(), с кириллицей) для поиска этапа без учета регистра.
+    # Хранится колонкой, а не индексом lower(name): lower() в SQLite меняет регистр только у ASCII
+    name_lower = db.Column(db.String(100), nullable=False, index=True)
+
+    @validates('name')
+    def _fill_name_lower(self, key, name):
+        self.name_lower = name.lower()
+        return name
 
 class RouteStage(db.Model):
     __tablename__ = 'RouteStages'
@@ -23,6 +34,8 @@ class RouteTemplate(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
     is_default = db.Column(db.Boolean, default=False)
+    # SHA-256 упорядоченного списка этапов в нижнем регистре (route_service.operations_signature)
+    operations_signature = db.Column(db.String(64), nullable=True, index=True)
     stages = db.relationship('RouteStage', backref='template', cascade="all, delete-orphan")
 
 class Permission:
@@ -127,6 +140,10 @@ class AnonymousUser(AnonymousUserMixin):
 
 class Part(db.Model):
     __tablename__ = 'Parts'
+    __table_args__ = (
+        # Keyset-пагинация деталей изделия: WHERE product_designation = ? AND part_id > ?
+        db.Index('ix_Parts_product_designation_part_id', 'product_designation', 'part_id'),
+    )
     # Основные идентификаторы
     part_id = db.Column(db.String, primary_key=True) # Обозначение
     product_designation = db.Column(db.String, nullable=False) # Изделие, к которому относится (например, "Наборка №3")
@@ -146,7 +163,10 @@ class Part(db.Model):
     quantity_completed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Дополнительная информация
-    drawing_filename = db.Column(db.String(255), nullable=True)
+    drawing_filename = db.Column(db.String(255), nullable=True, index=True) # Файл в DrawingBlobs
+    # Уменьшенные копии чертежа (WebP), создаются в фоне после загрузки
+    drawing_thumb_filename = db.Column(db.String(255), nullable=True)
+    drawing_medium_filename = db.Column(db.String(255), nullable=True)
     
     # Связи
     route_template_id = db.Column(db.Integer, db.ForeignKey('RouteTemplates.id'), nullable=True)
@@ -167,9 +187,48 @@ class Part(db.Model):
     # История и примечания (каскадное удаление)
     history = db.relationship('StatusHistory', backref='part', lazy=True, cascade="all, delete-orphan")
     notes = db.relationship('PartNote', backref='part', lazy=True, cascade="all, delete-orphan")
+    stage_progress = db.relationship('PartStageProgress', backref='part', lazy=True, cascade="all, delete-orphan")
+
+    def drawing_rendition(self, size):
+        """Имя файла копии чертежа ('thumb' или 'medium'); пока копия не готова — оригинал."""
+        renditions = {'thumb': self.drawing_thumb_filename, 'medium': self.drawing_medium_filename}
+        return renditions.get(size) or self.drawing_filename
+
+class DrawingBlob(db.Model):
+    """
+    Файл чертежа в хранилище по содержимому: имя — sha256 содержимого и расширение,
+    поэтому одинаковые чертежи разных деталей хранятся одним файлом.
+    ref_count — сколько деталей ссылается на файл; файлы без ссылок удаляет
+    команда `flask sweep-drawings`, а не запрос удаления детали.
+    """
+    __tablename__ = 'DrawingBlobs'
+    filename = db.Column(db.String(255), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=True) # Неизвестен для чертежей, загруженных до хранилища
+    ref_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Время последнего изменения счетчика: недавно освобожденные файлы уборка не трогает
+    updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc),
+                           onupdate=lambda: datetime.now(timezone.utc))
+
+class PartClosure(db.Model):
+    """
+    Таблица замыкания иерархии деталей: каждая пара (предок, потомок)
+    с расстоянием между ними. Каждая деталь — предок самой себя с depth = 0.
+    """
+    __tablename__ = 'PartClosure'
+    __table_args__ = (
+        # Поиск предков: WHERE descendant_id = ? ORDER BY depth
+        db.Index('ix_PartClosure_descendant_id_depth', 'descendant_id', 'depth'),
+    )
+    ancestor_id = db.Column(db.String, db.ForeignKey('Parts.part_id'), primary_key=True)
+    descendant_id = db.Column(db.String, db.ForeignKey('Parts.part_id'), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
 
 class StatusHistory(db.Model):
     __tablename__ = 'StatusHistory'
+    __table_args__ = (
+        # Лента истории детали: WHERE part_id = ? ORDER BY timestamp DESC LIMIT ?
+        db.Index('ix_StatusHistory_part_id_timestamp', 'part_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     part_id = db.Column(db.String, db.ForeignKey('Parts.part_id'), nullable=False)
     status = db.Column(db.String, nullable=False)
@@ -177,20 +236,68 @@ class StatusHistory(db.Model):
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     quantity = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
+class PartStageProgress(db.Model):
+    """
+    Материализованный прогресс детали по этапу (производная от StatusHistory).
+    Поддерживается в той же транзакции, что и подтверждение/отмена этапа.
+    """
+    __tablename__ = 'PartStageProgress'
+    part_id = db.Column(db.String, db.ForeignKey('Parts.part_id'), primary_key=True)
+    stage_id = db.Column(db.Integer, db.ForeignKey('Stages.id'), primary_key=True)
+    qty_done = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    status = db.Column(db.String(20), nullable=False, default='pending', server_default='pending')
+    last_timestamp = db.Column(db.DateTime, nullable=True)
+
+    stage = db.relationship('Stage')
+
+class AssemblyProgress(db.Model):
+    """
+    Кэш сводного прогресса сборки: суммы количеств по всему поддереву корневой детали.
+    Строка удаляется при изменении любого узла поддерева и пересчитывается
+    одним агрегирующим запросом при следующем чтении.
+    """
+    __tablename__ = 'AssemblyProgress'
+    root_id = db.Column(db.String, db.ForeignKey('Parts.part_id'), primary_key=True)
+    part_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    quantity_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    quantity_completed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
 class AuditLog(db.Model):
+    # В PostgreSQL таблица секционирована по месяцам timestamp (миграция b3f6a0c84d21),
+    # старые секции выгружает в архив flask audit-archive
     __tablename__ = 'AuditLogs'
+    __table_args__ = (
+        db.Index('ix_AuditLogs_part_id_timestamp', 'part_id', 'timestamp'),
+        # Журналы аудита и пользователей: WHERE category = ? ORDER BY timestamp DESC LIMIT ?
+        db.Index('ix_AuditLogs_category_timestamp', 'category', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     part_id = db.Column(db.String, nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
-    timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False, index=True)
     action = db.Column(db.String(100), nullable=False)
     details = db.Column(db.Text, nullable=True)
     category = db.Column(db.String(50), nullable=False, default='general', server_default='general')
+    # Структурированные данные действия ({'event': 'route_changed', 'route_old': 1, 'route_new': 2, ...})
+    # рядом с текстом details: по ним журналы фильтруются через индексы, а не LIKE
+    payload = db.Column(db.JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), 'postgresql'), nullable=True)
+
+# Лента событий одного вида (WHERE payload.event = ? ORDER BY timestamp DESC) — индекс по выражению;
+# остальные ключи в PostgreSQL ищутся через payload @> {...} по GIN-индексу
+db.Index('ix_AuditLogs_event_timestamp', json_text(AuditLog.__table__.c.payload, 'event'), AuditLog.__table__.c.timestamp)
+db.Index(
+    'ix_AuditLogs_payload', AuditLog.__table__.c.payload,
+    postgresql_using='gin', postgresql_ops={'payload': 'jsonb_path_ops'}
+).ddl_if(dialect='postgresql')
 
 class PartNote(db.Model):
     __tablename__ = 'PartNotes'
+    __table_args__ = (
+        db.Index('ix_PartNotes_part_id_timestamp', 'part_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    part_id = db.Column(db.String, db.ForeignKey('Parts.part_id'), nullable=False, index=True)
+    part_id = db.Column(db.String, db.ForeignKey('Parts.part_id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
     stage_id = db.Column(db.Integer, db.ForeignKey('Stages.id'), nullable=True)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
@@ -201,8 +308,11 @@ class PartNote(db.Model):
 
 class ResponsibleHistory(db.Model):
     __tablename__ = 'ResponsibleHistory'
+    __table_args__ = (
+        db.Index('ix_ResponsibleHistory_part_id_timestamp', 'part_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    part_id = db.Column(db.String, db.ForeignKey('Parts.part_id'), nullable=False, index=True)
+    part_id = db.Column(db.String, db.ForeignKey('Parts.part_id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=True, index=True)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
 
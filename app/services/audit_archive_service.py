@@ -0,0 +1,246 @@
+# app/services/audit_archive_service.py
+
+import gzip
+import json
+import os
+import re
+import shutil
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import delete, func, select
+
+from app import db
+from app.models.models import AuditLog
+
+# Сколько месяцев вперед держать готовые секции AuditLogs (PostgreSQL)
+PARTITION_MONTHS_AHEAD = 2
+# Секция, куда PostgreSQL кладет строки вне созданных месячных секций
+DEFAULT_PARTITION = 'AuditLogs_default'
+ARCHIVE_BATCH_SIZE = 1000
+SEARCH_DEFAULT_LIMIT = 200
+
+_PARTITION_RE = re.compile(r'AuditLogs_(\d{4})_(\d{2})')
+_ARCHIVE_RE = re.compile(r'audit-(\d{4})-(\d{2})\.jsonl\.gz')
+
+
+def month_start(value) -> datetime:
+    """Начало месяца, в который попадает value (без часового пояса, как в AuditLogs.timestamp)."""
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month, count) -> datetime:
+    """Начало месяца, отстоящего от month на count месяцев."""
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month) -> str:
+    return f"AuditLogs_{month:%Y_%m}"
+
+
+def archive_filename(month) -> str:
+    return f"audit-{month:%Y-%m}.jsonl.gz"
+
+
+def _current_month(now=None):
+    return month_start(now or datetime.now(timezone.utc))
+
+
+def _archive_folder(folder=None):
+    return folder or current_app.config['AUDIT_ARCHIVE_FOLDER']
+
+
+def is_partitioned() -> bool:
+    """True, если AuditLogs — секционированная таблица PostgreSQL (после миграции b3f6a0c84d21)."""
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return False
+    return db.session.scalar(db.text(
+        "SELECT count(*) FROM pg_partitioned_table WHERE partrelid = to_regclass('\"AuditLogs\"')"
+    )) > 0
+
+
+def list_partitions() -> dict:
+    """Месячные секции AuditLogs: {начало месяца: имя таблицы}. Вне PostgreSQL — пустой словарь."""
+    if not is_partitioned():
+        return {}
+    names = db.session.scalars(db.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('\"AuditLogs\"')"
+    ))
+    partitions = {}
+    for name in names:
+        match = _PARTITION_RE.fullmatch(name)
+        if match:
+            partitions[datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def _create_partition(month):
+    name, end = partition_name(month), add_months(month, 1)
+    bounds = f"'{month:%Y-%m-%d}'", f"'{end:%Y-%m-%d}'"
+    range_sql = f'"timestamp" >= {bounds[0]} AND "timestamp" < {bounds[1]}'
+    # Секция создается отдельной таблицей и присоединяется: строки этого месяца,
+    # успевшие попасть в секцию по умолчанию, переносятся в нее до присоединения
+    db.session.execute(db.text(f'CREATE TABLE "{name}" (LIKE "AuditLogs" INCLUDING DEFAULTS)'))
+    db.session.execute(db.text(f'INSERT INTO "{name}" SELECT * FROM "{DEFAULT_PARTITION}" WHERE {range_sql}'))
+    db.session.execute(db.text(f'DELETE FROM "{DEFAULT_PARTITION}" WHERE {range_sql}'))
+    db.session.execute(db.text(
+        f'ALTER TABLE "AuditLogs" ATTACH PARTITION "{name}" FOR VALUES FROM ({bounds[0]}) TO ({bounds[1]})'
+    ))
+
+
+def ensure_partitions(months_ahead=PARTITION_MONTHS_AHEAD, now=None) -> list:
+    """
+    Создает недостающие месячные секции AuditLogs с текущего месяца на months_ahead вперед.
+    Возвращает начала месяцев созданных секций. Вне PostgreSQL ничего не делает.
+    """
+    if not is_partitioned():
+        return []
+    existing = list_partitions()
+    current = _current_month(now)
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if month not in existing:
+            _create_partition(month)
+            created.append(month)
+    db.session.commit()
+    return created
+
+
+def _serialize(row) -> str:
+    entry = dict(row._mapping)
+    entry['timestamp'] = entry['timestamp'].isoformat()
+    return json.dumps(entry, ensure_ascii=False)
+
+
+def _export_month(month, folder) -> int:
+    """
+    Выгружает записи журнала за месяц в <folder>/audit-ГГГГ-ММ.jsonl.gz и возвращает их число.
+    Если архив месяца уже есть (записи, добавленные задним числом), выгрузка дописывается
+    к нему отдельным членом gzip: такой файл читается целиком как один поток.
+    """
+    table = AuditLog.__table__
+    rows = db.session.execute(
+        select(table)
+        .where(table.c.timestamp >= month, table.c.timestamp < add_months(month, 1))
+        .order_by(table.c.timestamp, table.c.id)
+        .execution_options(yield_per=ARCHIVE_BATCH_SIZE)
+    )
+    path = os.path.join(folder, archive_filename(month))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    count = 0
+    try:
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            for row in rows:
+                f.write(_serialize(row) + '\n')
+                count += 1
+        if not count:
+            return 0
+        if os.path.exists(path):
+            with open(path, 'ab') as target, open(tmp_path, 'rb') as source:
+                shutil.copyfileobj(source, target)
+        else:
+            os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return count
+
+
+def archive(months, folder=None, now=None) -> list:
+    """
+    Переносит журнал старше months полных месяцев в сжатые файлы JSONL (по файлу на месяц)
+    и удаляет его из БД. В PostgreSQL месячная секция после выгрузки отсоединяется
+    (DETACH PARTITION) и удаляется целиком, без построчного DELETE и раздувания таблицы;
+    в остальных СУБД и для строк секции по умолчанию записи удаляются по диапазону времени.
+    Каждый месяц фиксируется отдельно, поэтому прерванный архив продолжается с места остановки.
+
+    :return: [{'month', 'rows', 'file'}] по обработанным месяцам, от старых к новым.
+    """
+    if months < 1:
+        raise ValueError("Архивировать можно только журнал старше хотя бы одного месяца.")
+    folder = _archive_folder(folder)
+    os.makedirs(folder, exist_ok=True)
+    cutoff = add_months(_current_month(now), -months)
+
+    partitions = {month: name for month, name in list_partitions().items() if month < cutoff}
+    pending = set(partitions)
+    oldest = db.session.scalar(select(func.min(AuditLog.timestamp)).where(AuditLog.timestamp < cutoff))
+    if oldest is not None:
+        month = month_start(oldest)
+        while month < cutoff:
+            pending.add(month)
+            month = add_months(month, 1)
+
+    results = []
+    for month in sorted(pending):
+        count = _export_month(month, folder)
+        if month in partitions:
+            db.session.execute(db.text(f'ALTER TABLE "AuditLogs" DETACH PARTITION "{partitions[month]}"'))
+            db.session.execute(db.text(f'DROP TABLE "{partitions[month]}"'))
+        if count:
+            db.session.execute(
+                delete(AuditLog).where(AuditLog.timestamp >= month, AuditLog.timestamp < add_months(month, 1)),
+                execution_options={'synchronize_session': False}
+            )
+        db.session.commit()
+        if count or month in partitions:
+            results.append({'month': month, 'rows': count,
+                            'file': os.path.join(folder, archive_filename(month)) if count else None})
+    return results
+
+
+def list_archives(folder=None) -> list:
+    """Архивы журнала [(начало месяца, путь)] от новых к старым."""
+    folder = _archive_folder(folder)
+    if not os.path.isdir(folder):
+        return []
+    archives = []
+    for name in os.listdir(folder):
+        match = _ARCHIVE_RE.fullmatch(name)
+        if match:
+            archives.append((datetime(int(match.group(1)), int(match.group(2)), 1), os.path.join(folder, name)))
+    return sorted(archives, reverse=True)
+
+
+def search_archive(query=None, part_id=None, category=None, user_id=None,
+                   date_from=None, date_to=None, limit=SEARCH_DEFAULT_LIMIT, folder=None) -> list:
+    """
+    Ищет записи в архивах журнала по требованию: читает потоком только файлы месяцев,
+    пересекающихся с [date_from, date_to). query — подстрока действия или подробностей
+    без учета регистра, остальные фильтры — точное совпадение.
+
+    :return: не больше limit записей-словарей от новых к старым; timestamp — datetime.
+    """
+    needle = query.lower() if query else None
+    results = []
+    for month, path in list_archives(folder):
+        if date_to is not None and month >= date_to:
+            continue
+        if date_from is not None and add_months(month, 1) <= date_from:
+            break
+        matches = []
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if part_id and entry['part_id'] != part_id:
+                    continue
+                if category and entry['category'] != category:
+                    continue
+                if user_id is not None and entry['user_id'] != user_id:
+                    continue
+                if needle and needle not in f"{entry['action']}\n{entry['details'] or ''}".lower():
+                    continue
+                entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
+                if date_from is not None and entry['timestamp'] < date_from:
+                    continue
+                if date_to is not None and entry['timestamp'] >= date_to:
+                    continue
+                matches.append(entry)
+        matches.sort(key=lambda entry: (entry['timestamp'], entry['id']), reverse=True)
+        results.extend(matches[:limit - len(results)])
+        if len(results) >= limit:
+            break
+    return results
@@ -0,0 +1,303 @@
+# app/services/audit_service.py
+
+import atexit
+import json
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from flask import current_app, has_app_context
+from sqlalchemy import and_, event, func, insert, or_, select, union_all
+from sqlalchemy.orm import joinedload
+
+from app import db, socketio
+from app.models.models import AuditLog
+from app.services.query_service import decode_cursor, encode_cursor
+from app.services.sql_utils import bulk_insert, payload_conditions
+
+# Категории журналов: журнал аудита деталей и журнал действий пользователей
+PART_CATEGORIES = ('part',)
+USER_CATEGORIES = ('auth', 'management')
+
+LOG_PAGE_SIZE = 25
+
+# Виды действий (payload['event']) и их названия для фильтра журнала
+EVENTS = {
+    'part_created': 'Создание детали',
+    'part_edited': 'Редактирование детали',
+    'part_deleted': 'Удаление детали',
+    'route_changed': 'Смена маршрута',
+    'responsible_changed': 'Смена ответственного',
+    'stage_cancelled': 'Отмена этапа',
+    'child_added': 'Обновление состава',
+    'qr_generated': 'Генерация QR',
+    'qr_exported': 'Выгрузка QR',
+    'note_added': 'Добавлено примечание',
+    'note_edited': 'Изменено примечание',
+    'note_deleted': 'Удалено примечание',
+    'login': 'Вход в систему',
+    'logout': 'Выход из системы',
+    'role_created': 'Создание роли',
+    'role_updated': 'Изменение роли',
+    'role_deleted': 'Удаление роли',
+    'user_created': 'Создание пользователя',
+    'user_updated': 'Изменение пользователя',
+    'user_deleted': 'Удаление пользователя',
+    'route_created': 'Создание маршрута',
+    'route_updated': 'Изменение маршрута',
+    'route_deleted': 'Удаление маршрута',
+}
+# Ключи payload, по которым можно фильтровать журналы (?event=route_changed&route_new=5)
+PAYLOAD_FILTER_KEYS = ('event', 'route_old', 'route_new', 'responsible_old', 'responsible_new', 'stage', 'quantity')
+_INTEGER_PAYLOAD_KEYS = {'route_old', 'route_new', 'responsible_old', 'responsible_new', 'quantity'}
+
+
+def parse_payload_filter(args) -> dict:
+    """Фильтр по ключам payload из параметров запроса. ValueError, если id или количество не число."""
+    payload = {}
+    for key in PAYLOAD_FILTER_KEYS:
+        value = args.get(key)
+        if value:
+            try:
+                payload[key] = int(value) if key in _INTEGER_PAYLOAD_KEYS else value
+            except ValueError:
+                raise ValueError(f"Параметр {key} должен быть числом.")
+    return payload
+
+
+def _keyset_condition(last_timestamp, last_id):
+    """Записи строго старше курсора по ключу (timestamp, id)."""
+    return or_(
+        AuditLog.timestamp < last_timestamp,
+        and_(AuditLog.timestamp == last_timestamp, AuditLog.id < last_id)
+    )
+
+
+def get_log_page(categories, cursor=None, limit=LOG_PAGE_SIZE, payload=None):
+    """
+    Возвращает страницу журнала (записи категорий categories) от новых к старым.
+    payload — необязательный фильтр по ключам payload (см. sql_utils.payload_conditions).
+
+    Ключ пагинации — (timestamp, id): страница читает не больше limit + 1 строк
+    по индексу (category, timestamp) для каждой категории, без COUNT и OFFSET,
+    поэтому глубокие страницы открываются так же быстро, как первая.
+
+    :return: (logs, next_cursor) — next_cursor равен None на последней странице.
+    """
+    conditions = payload_conditions(AuditLog.payload, payload)
+    if cursor is not None:
+        try:
+            last_timestamp, last_id = decode_cursor(cursor)
+            conditions.append(_keyset_condition(datetime.fromisoformat(last_timestamp), int(last_id)))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Некорректный курсор: {e}")
+
+    # По одной ветви с LIMIT на категорию: каждая читается по своему диапазону индекса
+    branches = [
+        select(
+            select(AuditLog.id)
+            .where(AuditLog.category == category, *conditions)
+            .order_by(AuditLog.timestamp.desc(), AuditLog.id.desc())
+            .limit(limit + 1)
+            .subquery()
+        )
+        for category in categories
+    ]
+    page_ids = union_all(*branches) if len(branches) > 1 else branches[0]
+
+    logs = db.session.scalars(
+        select(AuditLog).options(joinedload(AuditLog.user))
+        .where(AuditLog.id.in_(page_ids))
+        .order_by(AuditLog.timestamp.desc(), AuditLog.id.desc())
+        .limit(limit + 1)
+    ).all()
+
+    next_cursor = None
+    if len(logs) > limit:
+        logs = logs[:limit]
+        next_cursor = encode_cursor([logs[-1].timestamp, logs[-1].id])
+    return logs, next_cursor
+
+
+def estimate_count(categories, payload=None):
+    """
+    Примерное число записей журнала. В PostgreSQL — оценка планировщика
+    по статистике таблицы (pg_class.reltuples и гистограмма category), без чтения
+    строк, поэтому время не зависит от размера журнала. В остальных СУБД — точный COUNT.
+
+    :return: (count, approximate)
+    """
+    query = select(AuditLog.id).where(AuditLog.category.in_(categories), *payload_conditions(AuditLog.payload, payload))
+    bind = db.session.get_bind()
+    if bind.dialect.name == 'postgresql':
+        compiled = query.compile(dialect=bind.dialect, compile_kwargs={'literal_binds': True})
+        plan = db.session.execute(db.text(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows']), True
+    return db.session.scalar(select(func.count()).select_from(query.subquery())), False
+
+
+# --- Запись в журнал и отложенная запись (write-behind) ---
+
+# Ключ в session.info: записи, ожидающие коммита транзакции обработчика
+_PENDING_KEY = 'audit_pending'
+
+
+class AuditBuffer:
+    """
+    Ограниченный буфер записей аудита в памяти процесса. Записи попадают в него
+    только после коммита транзакции обработчика и пишутся в БД многострочным
+    INSERT фоновой задачей: по достижении batch_size или раз в flush_interval секунд.
+    Если буфер переполнен, записи пишутся сразу в вызывающем потоке.
+    """
+
+    def __init__(self, app, max_size=10000, batch_size=200, flush_interval=2.0):
+        self.app = app
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._entries = deque()
+        self._lock = threading.Lock()
+        # Один писатель за раз: фоновая задача, переполнение и остановка не пишут одновременно
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put_many(self, rows):
+        """Добавляет записи в буфер; то, что не помещается, пишет сразу (синхронный запасной путь)."""
+        with self._lock:
+            free = self.max_size - len(self._entries)
+            accepted, overflow = rows[:max(free, 0)], rows[max(free, 0):]
+            self._entries.extend(accepted)
+            should_wake = len(self._entries) >= self.batch_size
+        if overflow:
+            self._write(overflow)
+        if should_wake:
+            self._wakeup.set()
+
+    def _take(self, count):
+        with self._lock:
+            return [self._entries.popleft() for _ in range(min(count, len(self._entries)))]
+
+    def _write(self, rows):
+        with self._write_lock, self.app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(insert(AuditLog.__table__), rows)
+
+    def flush(self) -> int:
+        """Пишет все накопленные записи пачками по batch_size. Возвращает число записанных."""
+        written = 0
+        while True:
+            batch = self._take(self.batch_size)
+            if not batch:
+                return written
+            try:
+                self._write(batch)
+            except Exception:
+                # Возвращаем пачку в начало буфера: следующая попытка запишет ее первой
+                with self._lock:
+                    self._entries.extendleft(reversed(batch))
+                raise
+            written += len(batch)
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.app.logger.error(f"Не удалось записать журнал аудита: {e}", exc_info=True)
+
+    def start(self):
+        """Запускает фоновую задачу записи (гринлет под eventlet, иначе поток)."""
+        if not self._running:
+            self._running = True
+            socketio.start_background_task(self._run)
+
+    def close(self):
+        """Останавливает фоновую задачу и дописывает остаток буфера."""
+        self._running = False
+        self._wakeup.set()
+        self.flush()
+
+
+def _get_buffer():
+    return current_app.extensions.get('audit_buffer') if has_app_context() else None
+
+
+def _after_commit(session):
+    rows = session.info.pop(_PENDING_KEY, None)
+    if rows:
+        buffer = _get_buffer()
+        if buffer is not None:
+            buffer.put_many(rows)
+
+
+def _after_rollback(session):
+    # Действие отменено — запись о нем не нужна
+    session.info.pop(_PENDING_KEY, None)
+
+
+def init_app(app):
+    """
+    Включает отложенную запись журнала, если задан AUDIT_WRITE_BEHIND:
+    создает буфер (AUDIT_BUFFER_SIZE, AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL),
+    запускает фоновую запись и дописывает буфер при остановке процесса.
+    """
+    if not app.config.get('AUDIT_WRITE_BEHIND'):
+        return
+    buffer = AuditBuffer(
+        app,
+        max_size=app.config.get('AUDIT_BUFFER_SIZE', 10000),
+        batch_size=app.config.get('AUDIT_BATCH_SIZE', 200),
+        flush_interval=app.config.get('AUDIT_FLUSH_INTERVAL', 2.0),
+    )
+    app.extensions['audit_buffer'] = buffer
+    if not event.contains(db.session, 'after_commit', _after_commit):
+        event.listen(db.session, 'after_commit', _after_commit)
+        event.listen(db.session, 'after_rollback', _after_rollback)
+    buffer.start()
+    atexit.register(buffer.close)
+
+
+def _row(user_id, action, details=None, category='general', part_id=None, payload=None, timestamp=None):
+    return {
+        'user_id': user_id, 'action': action, 'details': details, 'category': category,
+        'part_id': part_id, 'timestamp': timestamp or datetime.now(timezone.utc), 'payload': payload,
+    }
+
+
+def record(user_id, action, details=None, category='general', part_id=None, payload=None):
+    """
+    Добавляет запись в журнал аудита: текст для людей (details) и структурированные
+    данные для фильтров (payload, обычно с ключом 'event'). Без отложенной записи — в транзакцию
+    текущего обработчика, как раньше. С AUDIT_WRITE_BEHIND запись ждет коммита
+    транзакции и уходит в буфер, а не в INSERT на пути запроса; при откате отбрасывается.
+    Время действия фиксируется в момент вызова.
+    """
+    row = _row(user_id, action, details, category, part_id, payload)
+    if _get_buffer() is None:
+        db.session.add(AuditLog(**row))
+    else:
+        db.session.info.setdefault(_PENDING_KEY, []).append(row)
+
+
+def record_many(entries):
+    """
+    Добавляет в журнал пачку записей — словарей с аргументами record (и необязательным
+    timestamp). Без отложенной записи строки вставляются в транзакцию обработчика
+    одним массовым INSERT (COPY в PostgreSQL), с AUDIT_WRITE_BEHIND — как и record,
+    ждут коммита и уходят в буфер, а при откате отбрасываются.
+    """
+    rows = [_row(**entry) for entry in entries]
+    if not rows:
+        return
+    if _get_buffer() is None:
+        bulk_insert(AuditLog, rows)
+    else:
+        db.session.info.setdefault(_PENDING_KEY, []).extend(rows)
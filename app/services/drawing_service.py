@@ -0,0 +1,298 @@
+# app/services/drawing_service.py
+
+import hashlib
+import os
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from PIL import Image, ImageOps
+from sqlalchemy import delete, func, select, update
+from werkzeug.utils import secure_filename
+
+from app import db, socketio
+from app.models.models import Part, DrawingBlob
+from app.services import hierarchy_service, render_pool
+from app.services.sql_utils import dialect_insert
+
+# Уменьшенные копии чертежа: имя -> (наибольшая сторона в пикселях, качество WebP)
+RENDITIONS = {
+    'thumb': (320, 70),
+    'medium': (1600, 82),
+}
+RENDITION_FORMAT = 'webp'
+
+# Освобожденные файлы и файлы без записи моложе этого срока уборка не удаляет:
+# их может прямо сейчас подхватывать загрузка того же чертежа
+DEFAULT_SWEEP_GRACE = timedelta(hours=1)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Имя файла хранилища по содержимому: sha256, затем расширение оригинала или копии
+_CONTENT_NAME_RE = re.compile(r'[0-9a-f]{64}(\.(thumb|medium)\.webp|\.[a-z0-9]+)?')
+
+
+def is_content_addressed(filename) -> bool:
+    """
+    True, если имя выдано хранилищем по содержимому: такой файл никогда не меняется,
+    и имя само служит сильным ETag. Чертежи с прежними именами (<время>_<имя>) — False.
+    """
+    return _CONTENT_NAME_RE.fullmatch(filename) is not None
+
+
+def content_filename(file_storage) -> str:
+    """Имя файла в хранилище: sha256 загруженного содержимого и исходное расширение."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file_storage.stream.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file_storage.stream.seek(0)
+    extension = os.path.splitext(secure_filename(file_storage.filename or ''))[1].lower()
+    return f"{digest.hexdigest()}{extension}"
+
+
+def _write_atomically(path, write):
+    # Пишем во временный файл и атомарно переименовываем,
+    # чтобы параллельная загрузка того же чертежа не увидела недописанный файл
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def acquire(filename, size=None):
+    """Увеличивает счетчик ссылок на файл, создавая запись при первой ссылке. Коммит — за вызывающим кодом."""
+    stmt = dialect_insert(DrawingBlob).values(
+        filename=filename, size=size, ref_count=1, updated_at=datetime.now(timezone.utc)
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[DrawingBlob.filename],
+        set_={'ref_count': DrawingBlob.ref_count + 1, 'updated_at': stmt.excluded.updated_at}
+    ))
+
+
+def release(filenames):
+    """
+    Уменьшает счетчики ссылок (по одному на каждое вхождение имени). Файлы не удаляются:
+    это делает `flask sweep-drawings`. Коммит — за вызывающим кодом.
+    """
+    counts = Counter(name for name in filenames if name)
+    if counts:
+        blobs = DrawingBlob.__table__
+        db.session.execute(
+            update(blobs).where(blobs.c.filename == db.bindparam('name'))
+            .values(ref_count=blobs.c.ref_count - db.bindparam('count')),
+            [{'name': name, 'count': count} for name, count in counts.items()]
+        )
+
+
+def release_for_parts(part_ids):
+    """
+    Освобождает чертежи деталей и всех их потомков, удаляемых каскадом, одним запросом
+    по таблице замыкания. Вызывается до hierarchy_service.remove_subtrees.
+    """
+    part_ids = list(part_ids)
+    if not part_ids:
+        return
+    rows = db.session.execute(
+        select(Part.drawing_filename, func.count())
+        .where(Part.part_id.in_(hierarchy_service.subtree_ids_query(part_ids)), Part.drawing_filename.isnot(None))
+        .group_by(Part.drawing_filename)
+    ).all()
+    release(name for name, count in rows for _ in range(count))
+
+
+def save_original(file_storage, folder):
+    """
+    Сохраняет чертеж в хранилище по содержимому и возвращает имя файла.
+    Если такой чертеж уже загружен, файл не пишется повторно, а только
+    увеличивается счетчик ссылок. Изображения сохраняются со сжатием.
+    """
+    filename = content_filename(file_storage)
+    file_path = os.path.join(folder, filename)
+
+    if not os.path.exists(file_path):
+        def write(tmp_path):
+            try:
+                with Image.open(file_storage) as img:
+                    img.save(tmp_path, img.format, optimize=True, quality=85)
+            except Exception:
+                file_storage.stream.seek(0)
+                file_storage.save(tmp_path)
+        _write_atomically(file_path, write)
+
+    acquire(filename, os.path.getsize(file_path))
+    return filename
+
+
+def rendition_filename(filename, size) -> str:
+    """Имя уменьшенной копии: '<имя без расширения>.<size>.webp'."""
+    return f"{os.path.splitext(filename)[0]}.{size}.{RENDITION_FORMAT}"
+
+
+def make_renditions(folder, filename) -> dict:
+    """
+    Создает уменьшенные копии чертежа в формате WebP.
+    Возвращает {size: имя файла}; для файлов, которые не являются
+    изображениями, возвращает пустой словарь. Копии общего файла уже
+    могли быть созданы для другой детали — тогда они не перерисовываются.
+    Выполняется в процессе пула.
+    """
+    existing = {size: rendition_filename(filename, size) for size in RENDITIONS}
+    if all(os.path.exists(os.path.join(folder, name)) for name in existing.values()):
+        return existing
+    try:
+        with Image.open(os.path.join(folder, filename)) as source:
+            source = ImageOps.exif_transpose(source)
+            if source.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+            result = {}
+            # От большей копии к меньшей: каждая следующая уменьшается из предыдущей
+            for size, (max_side, quality) in sorted(RENDITIONS.items(), key=lambda item: -item[1][0]):
+                source.thumbnail((max_side, max_side), Image.LANCZOS)
+                name = rendition_filename(filename, size)
+                _write_atomically(
+                    os.path.join(folder, name),
+                    lambda path: source.save(path, RENDITION_FORMAT.upper(), quality=quality, method=4)
+                )
+                result[size] = name
+            return result
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return {}
+
+
+def _record_renditions(part_id, filename, renditions):
+    """Записывает имена копий, если у детали за это время не сменился чертеж."""
+    if not renditions:
+        return
+    db.session.execute(
+        update(Part)
+        .where(Part.part_id == part_id, Part.drawing_filename == filename)
+        .values(drawing_thumb_filename=renditions.get('thumb'), drawing_medium_filename=renditions.get('medium'))
+    )
+    db.session.commit()
+
+
+def _build_in_background(app, part_id, filename):
+    with app.app_context():
+        folder = app.config['DRAWING_UPLOAD_FOLDER']
+        try:
+            renditions = render_pool.run(make_renditions, folder, filename)
+            _record_renditions(part_id, filename, renditions)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Не удалось создать копии чертежа {filename}: {e}", exc_info=True)
+
+
+def schedule_renditions(part_id, filename):
+    """
+    Создает копии чертежа после коммита детали. По умолчанию — фоновой задачей
+    в пуле процессов (DRAWING_RENDITIONS_IN_BACKGROUND), не задерживая запрос;
+    пока копии не готовы, страницы показывают оригинал.
+    """
+    app = current_app._get_current_object()
+    if app.config.get('DRAWING_RENDITIONS_IN_BACKGROUND', True):
+        socketio.start_background_task(_build_in_background, app, part_id, filename)
+    else:
+        _record_renditions(part_id, filename, make_renditions(app.config['DRAWING_UPLOAD_FOLDER'], filename))
+
+
+def _blob_files(filename):
+    """Файл чертежа и его копии."""
+    return [filename] + [rendition_filename(filename, size) for size in RENDITIONS]
+
+
+def _remove_files(folder, filenames) -> int:
+    removed = 0
+    for filename in filenames:
+        try:
+            os.remove(os.path.join(folder, filename))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def recount_references():
+    """
+    Пересчитывает счетчики ссылок по таблице деталей и заводит записи для
+    чертежей, на которые ссылаются детали, но которых нет в хранилище.
+    Исправляет расхождения после сбоев или ручных правок БД.
+    """
+    referenced = select(Part.drawing_filename, func.count(), func.now()).where(
+        Part.drawing_filename.isnot(None)
+    ).group_by(Part.drawing_filename)
+    db.session.execute(
+        dialect_insert(DrawingBlob).on_conflict_do_nothing().from_select(
+            ['filename', 'ref_count', 'updated_at'], referenced
+        )
+    )
+    actual = (
+        select(func.count()).where(Part.drawing_filename == DrawingBlob.filename)
+        .correlate(DrawingBlob).scalar_subquery()
+    )
+    db.session.execute(
+        # updated_at не меняется: исправление счетчика не продлевает срок до уборки
+        update(DrawingBlob).where(DrawingBlob.ref_count != actual)
+        .values(ref_count=actual, updated_at=DrawingBlob.updated_at),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def sweep(grace=DEFAULT_SWEEP_GRACE, dry_run=False) -> dict:
+    """
+    Уборка хранилища чертежей: после пересчета ссылок удаляет записи и файлы
+    чертежей без ссылок, а также файлы в папке, которых нет в хранилище
+    (остатки прежней схемы имен, временные файлы). Не трогает ничего моложе grace.
+    Возвращает {'blobs': удалено записей, 'files': удалено файлов}.
+    """
+    folder = current_app.config['DRAWING_UPLOAD_FOLDER']
+    cutoff = datetime.now(timezone.utc) - grace
+
+    recount_references()
+    unreferenced = (DrawingBlob.ref_count <= 0, DrawingBlob.updated_at < cutoff)
+    released = db.session.scalars(select(DrawingBlob.filename).where(*unreferenced)).all()
+    if released:
+        # Условие повторяется: запись, которую за это время снова подхватила загрузка, остается
+        db.session.execute(
+            delete(DrawingBlob).where(DrawingBlob.filename.in_(released), *unreferenced),
+            execution_options={'synchronize_session': False}
+        )
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+    released_files = {name for filename in released for name in _blob_files(filename)}
+
+    # Одним проходом по папке: все, что не относится к живым записям хранилища.
+    # Живые записи читаются после удаления, поэтому повторно загруженный файл сохранится.
+    known = set()
+    for filename in db.session.scalars(select(DrawingBlob.filename)):
+        if not (dry_run and filename in released):
+            known.update(_blob_files(filename))
+    orphans = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name in known:
+                continue
+            if entry.name in released_files or datetime.fromtimestamp(entry.stat().st_mtime, timezone.utc) < cutoff:
+                orphans.append(entry.name)
+
+    removed = len(orphans) if dry_run else _remove_files(folder, orphans)
+    return {'blobs': len(released), 'files': removed}
+
+
+def build_missing_renditions() -> int:
+    """Создает копии для всех чертежей, у которых их еще нет. Возвращает число обработанных деталей."""
+    folder = current_app.config['DRAWING_UPLOAD_FOLDER']
+    rows = db.session.execute(
+        db.select(Part.part_id, Part.drawing_filename)
+        .where(Part.drawing_filename.isnot(None), Part.drawing_thumb_filename.is_(None))
+    ).all()
+    filenames = [filename for _, filename in rows]
+    for (part_id, filename), renditions in zip(rows, render_pool.map_tasks(make_renditions, [folder] * len(rows), filenames)):
+        _record_renditions(part_id, filename, renditions)
+    return len(rows)
@@ -0,0 +1,174 @@
+# app/services/hierarchy_service.py
+
+from sqlalchemy import select, insert, delete, func, literal, true
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.models.models import Part, PartClosure, AssemblyProgress
+from app.services import progress_service
+
+# Защита от зацикливания при перестройке по поврежденным parent_id
+MAX_HIERARCHY_DEPTH = 100
+
+
+def add_part(part_id, parent_id=None):
+    """
+    Регистрирует новую деталь в таблице замыкания: строка на саму себя
+    и по строке на каждого предка родителя (один INSERT ... SELECT).
+    Коммит выполняет вызывающий код.
+    """
+    # Деталь должна попасть в БД раньше строк замыкания, ссылающихся на нее
+    db.session.flush()
+    db.session.execute(insert(PartClosure).values(ancestor_id=part_id, descendant_id=part_id, depth=0))
+    if parent_id:
+        db.session.execute(
+            insert(PartClosure).from_select(
+                ['ancestor_id', 'descendant_id', 'depth'],
+                select(PartClosure.ancestor_id, literal(part_id), PartClosure.depth + 1)
+                .where(PartClosure.descendant_id == parent_id)
+            )
+        )
+
+
+def add_parts_bulk(items):
+    """
+    Массово регистрирует новые детали в таблице замыкания.
+
+    :param items: последовательность (part_id, parent_id) в порядке, где родитель
+                  идет раньше своих детей (или уже существует в БД).
+    :return: количество вставленных строк замыкания.
+
+    Предки уже существующих родителей читаются одним запросом, остальное
+    вычисляется в памяти и вставляется одним multi-row INSERT.
+    """
+    items = list(items)
+    if not items:
+        return 0
+
+    new_ids = {part_id for part_id, _ in items}
+    external_parents = {parent_id for _, parent_id in items if parent_id and parent_id not in new_ids}
+
+    ancestors = {}
+    if external_parents:
+        for row in db.session.execute(
+            select(PartClosure.descendant_id, PartClosure.ancestor_id, PartClosure.depth)
+            .where(PartClosure.descendant_id.in_(external_parents))
+        ):
+            ancestors.setdefault(row.descendant_id, []).append((row.ancestor_id, row.depth))
+
+    rows = []
+    for part_id, parent_id in items:
+        chain = [(part_id, 0)]
+        if parent_id:
+            chain.extend((ancestor_id, depth + 1) for ancestor_id, depth in ancestors.get(parent_id, []))
+        ancestors[part_id] = chain
+        rows.extend({'ancestor_id': a, 'descendant_id': part_id, 'depth': d} for a, d in chain)
+
+    db.session.flush()
+    db.session.execute(insert(PartClosure), rows)
+    return len(rows)
+
+
+def subtree_ids_query(part_ids):
+    """SELECT ID деталей поддеревьев (включая сами детали) для использования в подзапросах."""
+    return select(PartClosure.descendant_id).where(PartClosure.ancestor_id.in_(part_ids))
+
+
+def get_descendant_ids(part_id, include_self=False):
+    """Возвращает ID всех потомков детали одним индексным запросом."""
+    query = select(PartClosure.descendant_id).where(PartClosure.ancestor_id == part_id)
+    if not include_self:
+        query = query.where(PartClosure.depth > 0)
+    return db.session.scalars(query.order_by(PartClosure.depth)).all()
+
+
+def get_ancestors(part_id):
+    """Возвращает предков детали от корня к непосредственному родителю одним запросом."""
+    return Part.query.join(
+        PartClosure, PartClosure.ancestor_id == Part.part_id
+    ).filter(
+        PartClosure.descendant_id == part_id,
+        PartClosure.depth > 0
+    ).order_by(PartClosure.depth.desc()).all()
+
+
+def remove_subtrees(part_ids):
+    """
+    Удаляет строки замыкания для поддеревьев указанных деталей (включая их самих).
+    Вызывается перед удалением деталей; коммит выполняет вызывающий код.
+    """
+    part_ids = list(part_ids)
+    if not part_ids:
+        return
+    subtree_ids = subtree_ids_query(part_ids).scalar_subquery()
+    db.session.execute(
+        delete(PartClosure).where(PartClosure.descendant_id.in_(subtree_ids)),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def move_subtree(part, new_parent_id):
+    """
+    Переносит деталь вместе со всем ее поддеревом под нового родителя
+    (или делает корневой, если new_parent_id=None). Используется при смене
+    родителя в форме редактирования детали. Коммит выполняет вызывающий код.
+    """
+    if new_parent_id is not None and new_parent_id in get_descendant_ids(part.part_id, include_self=True):
+        raise ValueError("Нельзя переместить узел внутрь его собственного состава.")
+
+    # Сводный прогресс меняется и у старой, и у новой корневой сборки
+    progress_service.invalidate_assembly_progress([part.part_id] + ([new_parent_id] if new_parent_id else []))
+
+    subtree = select(PartClosure.descendant_id).where(PartClosure.ancestor_id == part.part_id)
+    # Старые предки поддерева — все строки, где предок лежит вне поддерева
+    db.session.execute(
+        delete(PartClosure).where(
+            PartClosure.descendant_id.in_(subtree.scalar_subquery()),
+            PartClosure.ancestor_id.notin_(subtree.scalar_subquery())
+        ),
+        execution_options={'synchronize_session': False}
+    )
+
+    if new_parent_id is not None:
+        supertree = aliased(PartClosure)
+        sub = aliased(PartClosure)
+        db.session.execute(
+            insert(PartClosure).from_select(
+                ['ancestor_id', 'descendant_id', 'depth'],
+                # Намеренное декартово произведение: предки нового родителя × узлы поддерева
+                select(supertree.ancestor_id, sub.descendant_id, supertree.depth + sub.depth + 1)
+                .select_from(supertree).join(sub, true())
+                .where(supertree.descendant_id == new_parent_id, sub.ancestor_id == part.part_id)
+            )
+        )
+
+    part.parent_id = new_parent_id
+
+
+def rebuild_closure() -> int:
+    """
+    Полностью перестраивает таблицу замыкания из Parts.parent_id
+    одним рекурсивным INSERT ... SELECT. Возвращает количество строк.
+    """
+    closure = select(
+        Part.part_id.label('ancestor_id'),
+        Part.part_id.label('descendant_id'),
+        literal(0).label('depth')
+    ).cte('closure', recursive=True)
+    closure = closure.union_all(
+        select(closure.c.ancestor_id, Part.part_id, closure.c.depth + 1)
+        .join(Part, Part.parent_id == closure.c.descendant_id)
+        .where(closure.c.depth < MAX_HIERARCHY_DEPTH)
+    )
+
+    db.session.execute(delete(PartClosure))
+    # Кэш сводного прогресса опирается на замыкание и пересчитается лениво
+    db.session.execute(delete(AssemblyProgress))
+    db.session.execute(
+        insert(PartClosure).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(closure.c.ancestor_id, closure.c.descendant_id, closure.c.depth)
+        )
+    )
+    db.session.commit()
+    return db.session.scalar(select(func.count()).select_from(PartClosure))
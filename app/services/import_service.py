@@ -0,0 +1,708 @@
+# app/services/import_service.py
+
+import csv
+import io
+from datetime import datetime, timezone
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import xlrd
+from sqlalchemy import insert, select
+
+from app import db, socketio
+from app.models.models import Part, RouteTemplate, RouteStage, Stage
+from app.services import audit_service, hierarchy_service, progress_service, route_service
+from app.services.sql_utils import bulk_insert, dialect_insert
+
+# Заголовки колонок файла импорта
+COL_PART_ID = "Обозначение"
+COL_NAME = "Наименование"
+COL_QUANTITY = "Кол-во"
+COL_MATERIAL = "Прим"
+COL_SIZE = "Размер"
+COL_OPERATIONS = "Операции"
+# Колонки иерархии спецификации (необязательные): позиция "1.2.3" или номер уровня
+COL_POSITION = "Поз."
+COL_LEVEL = "Уровень"
+
+# Поля, которые режим обновления переносит из файла в существующие детали: (поле, подпись в аудите)
+UPSERT_FIELDS = (
+    ('name', "Наименование"),
+    ('material', "Материал"),
+    ('size', "Размер"),
+    ('quantity_total', "Кол-во"),
+    ('route_template_id', "Маршрут"),
+)
+
+DEFAULT_MATERIAL = "Не указан"  # Заглушка, т.к. поле обязательное
+DEFAULT_STATUS = "На складе"
+
+# Размер пачки для запросов вида WHERE part_id IN (...)
+IN_QUERY_BATCH_SIZE = 1000
+# Строк в одной транзакции импорта, если IMPORT_CHUNK_SIZE не задан в конфигурации
+DEFAULT_CHUNK_SIZE = 1000
+# Сколько сообщений об ошибочных строках показывать пользователю
+MAX_REPORTED_ERRORS = 20
+
+
+def split_operations(operations_str: str) -> list:
+    """Разбивает строку операций 'Резка, Сверловка' на список названий этапов."""
+    if not operations_str:
+        return []
+    return [op.strip() for op in operations_str.split(',') if op.strip()]
+
+
+class RouteResolver:
+    """
+    Сопоставляет строки операций технологическим маршрутам без запросов на каждую строку.
+
+    Маршрут ищется по каноничной сигнатуре списка этапов (route_service): сначала
+    в мемо процесса, затем одним запросом по индексу. Этапы ищутся по индексу
+    name_lower; недостающие этапы и маршруты создаются пачкой.
+    """
+
+    def __init__(self):
+        self._stage_ids = {}      # название этапа в нижнем регистре -> ID
+        self._route_names = {}    # ID маршрута -> название (для аудита)
+        self._default_route_id = None
+        self._resolved = {}       # строка операций из файла -> ID маршрута
+
+    def _get_default_route_id(self):
+        if self._default_route_id is None:
+            default_route = RouteTemplate.query.filter_by(is_default=True).first()
+            if not default_route:
+                raise ValueError("Не найден маршрут по умолчанию для деталей без указания операций.")
+            self._default_route_id = default_route.id
+        return self._default_route_id
+
+    def _split_pending(self, operation_strings):
+        """
+        Разрешает по сигнатурам все строки, для которых маршрут уже существует.
+        Возвращает {строка операций: (сигнатура, этапы)} для остальных.
+        """
+        signatures = {}
+        for operations_str in set(operation_strings) - self._resolved.keys():
+            operations = split_operations(operations_str)
+            if not operations:
+                self._resolved[operations_str] = self._get_default_route_id()
+            else:
+                signatures[operations_str] = (route_service.operations_signature(operations), operations)
+
+        found = route_service.find_route_ids(sig for sig, _ in signatures.values())
+        pending = {}
+        for operations_str, (signature, operations) in signatures.items():
+            if signature in found:
+                self._resolved[operations_str] = found[signature]
+            else:
+                pending[operations_str] = (signature, operations)
+        return pending
+
+    def _load_stages(self, stage_names):
+        """Подгружает ID этапов по name_lower одним индексным запросом."""
+        keys = {name.lower() for name in stage_names} - self._stage_ids.keys()
+        if keys:
+            rows = db.session.execute(
+                select(Stage.id, Stage.name).where(Stage.name_lower.in_(keys)).order_by(Stage.id)
+            )
+            for stage_id, name in rows:
+                self._stage_ids.setdefault(name.lower(), stage_id)
+
+    def resolve_many(self, operation_strings) -> dict:
+        """
+        Возвращает {строка операций: route_template_id} для всех переданных строк,
+        создавая недостающие этапы и маршруты.
+        """
+        pending = self._split_pending(operation_strings)
+        if pending:
+            self._create_routes(pending)
+        return {ops: self._resolved[ops] for ops in operation_strings}
+
+    def plan(self, operation_strings):
+        """
+        Возвращает (новые маршруты, новые этапы), которые создал бы resolve_many
+        для этих строк, ничего не записывая в БД.
+        """
+        pending = self._split_pending(operation_strings)
+        self._load_stages(op for _, operations in pending.values() for op in operations)
+        new_routes = {}
+        new_stages = {}
+        for signature, operations in pending.values():
+            new_routes.setdefault(signature, " -> ".join(operations))
+            for op_name in operations:
+                if op_name.lower() not in self._stage_ids:
+                    new_stages.setdefault(op_name.lower(), op_name)
+        return sorted(new_routes.values()), sorted(new_stages.values())
+
+    def route_name(self, route_id) -> str:
+        """Возвращает название маршрута по ID (для записей аудита)."""
+        if route_id is None:
+            return "Не назначен"
+        if route_id not in self._route_names:
+            self._route_names[route_id] = db.session.get(RouteTemplate, route_id).name
+        return self._route_names[route_id]
+
+    def resolve(self, operations_str: str) -> int:
+        """Возвращает ID маршрута для одной строки операций."""
+        return self.resolve_many([operations_str])[operations_str]
+
+    def _create_routes(self, pending):
+        self._load_stages(op for _, operations in pending.values() for op in operations)
+        new_stages = {}
+        for _, operations in pending.values():
+            for op_name in operations:
+                key = op_name.lower()
+                if key not in self._stage_ids and key not in new_stages:
+                    new_stages[key] = Stage(name=op_name)
+        if new_stages:
+            db.session.add_all(new_stages.values())
+            db.session.flush()
+            self._stage_ids.update({key: stage.id for key, stage in new_stages.items()})
+
+        # Маршрут с таким же названием, но без сигнатуры (создан до ее появления) переиспользуется
+        by_signature = {}
+        for signature, operations in pending.values():
+            by_signature.setdefault(signature, operations)
+        names = {signature: " -> ".join(operations) for signature, operations in by_signature.items()}
+        same_name = {route.name: route for route in
+                     RouteTemplate.query.filter(RouteTemplate.name.in_(names.values()))}
+
+        new_routes = {}
+        route_ids = {}
+        for signature, name in names.items():
+            route = same_name.get(name)
+            if route is not None:
+                if route.operations_signature is None:
+                    route.operations_signature = signature
+                route_ids[signature] = route.id
+            else:
+                new_routes[signature] = RouteTemplate(name=name, is_default=False, operations_signature=signature)
+        db.session.add_all(new_routes.values())
+        db.session.flush()
+
+        route_stage_rows = []
+        for signature, route in new_routes.items():
+            route_ids[signature] = route.id
+            route_stage_rows.extend(
+                {'template_id': route.id, 'stage_id': self._stage_ids[op_name.lower()], 'order': i}
+                for i, op_name in enumerate(by_signature[signature])
+            )
+        if route_stage_rows:
+            db.session.execute(insert(RouteStage), route_stage_rows)
+
+        for signature, route_id in route_ids.items():
+            route_service.remember(signature, route_id)
+        for operations_str, (signature, _) in pending.items():
+            self._resolved[operations_str] = route_ids[signature]
+
+
+def get_existing_part_ids(part_ids) -> set:
+    """Возвращает подмножество part_ids, уже существующих в БД (пачками по IN)."""
+    part_ids = list(part_ids)
+    existing = set()
+    for start in range(0, len(part_ids), IN_QUERY_BATCH_SIZE):
+        batch = part_ids[start:start + IN_QUERY_BATCH_SIZE]
+        existing.update(db.session.scalars(select(Part.part_id).where(Part.part_id.in_(batch))))
+    return existing
+
+
+def _to_text(value) -> str:
+    """Приводит значение ячейки (CSV-строка или число/дата из Excel) к строке."""
+    if value is None:
+        return ''
+    # Excel хранит числа как float: 12345.0 -> '12345'
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def get_existing_parts(part_ids) -> dict:
+    """
+    Возвращает {part_id: строка с полями UPSERT_FIELDS} для уже существующих деталей
+    (пачками по IN), чтобы режим обновления мог найти изменившиеся значения.
+    """
+    part_ids = list(part_ids)
+    columns = [Part.part_id] + [getattr(Part, field) for field, _ in UPSERT_FIELDS]
+    existing = {}
+    for start in range(0, len(part_ids), IN_QUERY_BATCH_SIZE):
+        batch = part_ids[start:start + IN_QUERY_BATCH_SIZE]
+        for row in db.session.execute(select(*columns).where(Part.part_id.in_(batch))):
+            existing[row.part_id] = row
+    return existing
+
+
+def _cell(row, header_map, header) -> str:
+    index = header_map.get(header)
+    if index is None or index >= len(row):
+        return ''
+    return _to_text(row[index])
+
+
+def _parse_quantity(value: str) -> int:
+    try:
+        return int(value or 1)
+    except ValueError:
+        raise ValueError(f"некорректное количество '{value}'")
+
+
+def _is_valid_quantity(value: str) -> bool:
+    """Проверка количества для пробного импорта — тем же правилом, что при записи (_parse_quantity)."""
+    try:
+        _parse_quantity(value)
+    except ValueError:
+        return False
+    return True
+
+
+def row_depth(row, header_map, indent_hierarchy=False) -> int:
+    """
+    Определяет глубину строки в спецификации: по числу частей позиции ("1.2.3" -> 3)
+    или по колонке уровня. Отступ наименования пробелами учитывается, только если
+    он явно включен (indent_hierarchy): иначе случайные пробелы в начале ячейки
+    делали бы строки плоского файла потомками предыдущих.
+    У плоского файла без этих признаков все строки имеют глубину 0.
+    """
+    position = _cell(row, header_map, COL_POSITION)
+    if position:
+        return len([part for part in position.split('.') if part])
+
+    level = _cell(row, header_map, COL_LEVEL)
+    if level:
+        try:
+            return int(level)
+        except ValueError:
+            raise ValueError(f"некорректный уровень '{level}'")
+
+    if not indent_hierarchy:
+        return 0
+    index = header_map.get(COL_NAME)
+    raw_name = row[index] if index is not None and index < len(row) else None
+    if isinstance(raw_name, str):
+        return len(raw_name) - len(raw_name.lstrip())
+    return 0
+
+
+def parse_row(row, header_map):
+    """Преобразует строку файла в словарь полей детали или None, если строку нужно пропустить."""
+    part_id = _cell(row, header_map, COL_PART_ID)
+    name = _cell(row, header_map, COL_NAME)
+    if not part_id or not name:
+        return None
+    return {
+        'part_id': part_id,
+        'name': name,
+        'quantity_total': _parse_quantity(_cell(row, header_map, COL_QUANTITY)),
+        'size': _cell(row, header_map, COL_SIZE),
+        'material': _cell(row, header_map, COL_MATERIAL) or DEFAULT_MATERIAL,
+        'operations': _cell(row, header_map, COL_OPERATIONS),
+    }
+
+
+class ImportSection:
+    """Часть файла с одним изделием: CSV-файл целиком или один лист книги Excel."""
+
+    def __init__(self, title, product_designation, header_map, rows):
+        self.title = title
+        self.product_designation = product_designation
+        self.header_map = header_map
+        self.rows = rows  # итератор строк данных, начиная с 4-й строки
+
+
+def _read_section(rows, title, default_product):
+    """
+    Разбирает шапку секции: первая строка пропускается, вторая содержит обозначение
+    изделия (колонка B), третья — заголовки. Возвращает ImportSection или None,
+    если заголовков нет.
+    """
+    next(rows, None)
+    product_header_row = next(rows, None)
+    product_designation = default_product
+    if product_header_row and len(product_header_row) > 1 and _to_text(product_header_row[1]):
+        product_designation = _to_text(product_header_row[1])
+
+    headers = [_to_text(header) for header in (next(rows, None) or [])]
+    if COL_PART_ID not in headers:
+        return None
+    header_map = {header: i for i, header in enumerate(headers)}
+    return ImportSection(title, product_designation, header_map, rows)
+
+
+def read_csv(file_storage):
+    """
+    Читает CSV-файл импорта потоком: одна секция на весь файл.
+
+    Файл не считывается в память целиком: TextIOWrapper декодирует загруженный
+    поток по мере чтения строк csv.reader'ом.
+    """
+    stream = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+    section = _read_section(csv.reader(stream), '', "Без названия")
+    if section is not None:
+        yield section
+
+
+def read_xlsx(file_storage):
+    """
+    Читает книгу .xlsx в режиме read_only: строки листов читаются потоком,
+    память не зависит от размера книги. Каждый лист с заголовками — отдельное
+    изделие; если обозначение изделия не указано, используется имя листа.
+    """
+    workbook = openpyxl.load_workbook(file_storage.stream, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            section = _read_section(sheet.iter_rows(values_only=True), sheet.title, sheet.title)
+            if section is not None:
+                yield section
+    finally:
+        workbook.close()
+
+
+def read_xls(file_storage):
+    """
+    Читает книгу .xls через xlrd. Формат не поддерживает потоковое чтение,
+    поэтому листы загружаются по одному (on_demand) и выгружаются после обработки.
+    """
+    workbook = xlrd.open_workbook(file_contents=file_storage.stream.read(), on_demand=True)
+    try:
+        for sheet_index in range(workbook.nsheets):
+            sheet = workbook.sheet_by_index(sheet_index)
+            rows = (sheet.row_values(i) for i in range(sheet.nrows))
+            section = _read_section(rows, sheet.name, sheet.name)
+            if section is not None:
+                yield section
+            workbook.unload_sheet(sheet_index)
+    finally:
+        workbook.release_resources()
+
+
+READERS = {
+    'csv': read_csv,
+    'xlsx': read_xlsx,
+    'xls': read_xls,
+}
+
+
+def iter_sections(file_storage):
+    """Возвращает итератор секций файла импорта в зависимости от его расширения."""
+    extension = (file_storage.filename or '').rsplit('.', 1)[-1].lower()
+    reader = READERS.get(extension, read_csv)
+    found = False
+    for section in reader(file_storage):
+        found = True
+        yield section
+    if not found:
+        raise ValueError("Не найдены заголовки. Ожидается строка с 'Обозначение', 'Наименование' и т.д.")
+
+
+class ImportStats:
+    """Счетчики импорта, отправляемые клиентам в событии 'import_progress'."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.rows = 0
+        self.added = 0
+        self.updated = 0
+        self.skipped = 0
+        self.errors = 0
+        self.error_messages = []
+
+    def add_error(self, message):
+        self.errors += 1
+        if len(self.error_messages) < MAX_REPORTED_ERRORS:
+            self.error_messages.append(message)
+
+    def to_dict(self, done=False):
+        return {
+            'filename': self.filename,
+            'rows': self.rows,
+            'added': self.added,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'done': done,
+        }
+
+
+def _emit_progress(stats, done=False):
+    socketio.emit('import_progress', stats.to_dict(done))
+    # Отдаем управление, чтобы событие ушло клиентам, пока запрос еще выполняется
+    socketio.sleep(0)
+
+
+def _update_existing(items, existing, route_ids, resolver, stats, user, now):
+    """
+    Режим обновления: переносит изменившиеся поля в существующие детали одним
+    пакетным INSERT ... ON CONFLICT DO UPDATE и пишет по записи аудита на деталь.
+    Иерархия (parent_id) и изделие существующих деталей не меняются.
+    """
+    changed_rows = []
+    audit_rows = []
+    quantity_changed_ids = []
+    for item in items:
+        current = existing[item['part_id']]
+        values = {
+            'name': item['name'],
+            'material': item['material'],
+            'size': item['size'],
+            'quantity_total': item['quantity_total'],
+            'route_template_id': route_ids[item['operations']],
+        }
+        changes = []
+        for field, label in UPSERT_FIELDS:
+            old_value, new_value = getattr(current, field), values[field]
+            if (old_value or '') == (new_value or ''):
+                continue
+            if field == 'route_template_id':
+                old_value, new_value = resolver.route_name(old_value), resolver.route_name(new_value)
+            changes.append(f"{label}: '{old_value or ''}' -> '{new_value}'")
+        if not changes:
+            stats.skipped += 1
+            continue
+
+        if current.quantity_total != item['quantity_total']:
+            quantity_changed_ids.append(item['part_id'])
+        changed_rows.append(dict(values, part_id=item['part_id'],
+                                 product_designation=item['product_designation'], last_update=now))
+        audit_rows.append({
+            'part_id': item['part_id'],
+            'user_id': user.id,
+            'timestamp': now,
+            'action': "Редактирование",
+            'details': f"Обновлено импортом из файла {stats.filename}: " + "; ".join(changes),
+            'category': 'part',
+            'payload': {'event': 'part_edited', 'source': 'import'},
+        })
+
+    if not changed_rows:
+        return
+    stmt = dialect_insert(Part)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Part.part_id],
+        set_={field: stmt.excluded[field] for field in [f for f, _ in UPSERT_FIELDS] + ['last_update']}
+    )
+    db.session.execute(stmt, changed_rows)
+    audit_service.record_many(audit_rows)
+
+    # Статусы этапов и сводный прогресс сборок зависят от общего количества
+    progress_service.refresh_stage_statuses(quantity_changed_ids)
+    progress_service.invalidate_assembly_progress(quantity_changed_ids)
+    stats.updated += len(changed_rows)
+
+
+def _insert_chunk(items, resolver, stats, user, update_existing=False):
+    """Вставляет пачку разобранных строк: один IN-запрос, массовые INSERT и коммит."""
+    part_ids = [item['part_id'] for item in items]
+    existing = get_existing_parts(part_ids) if update_existing else dict.fromkeys(get_existing_part_ids(part_ids))
+    new_items = [item for item in items if item['part_id'] not in existing]
+    existing_items = [item for item in items if item['part_id'] in existing]
+
+    routed_items = new_items + existing_items if update_existing else new_items
+    route_ids = resolver.resolve_many([item['operations'] for item in routed_items])
+
+    now = datetime.now(timezone.utc)
+    part_rows = [{
+        'part_id': item['part_id'],
+        'product_designation': item['product_designation'],
+        'name': item['name'],
+        'material': item['material'],
+        'size': item['size'],
+        'quantity_total': item['quantity_total'],
+        'quantity_completed': 0,
+        'current_status': DEFAULT_STATUS,
+        'date_added': now,
+        'last_update': now,
+        'route_template_id': route_ids[item['operations']],
+        'parent_id': item['parent_id'],
+    } for item in new_items]
+    audit_rows = [{
+        'part_id': item['part_id'],
+        'user_id': user.id,
+        'timestamp': now,
+        'action': "Создание",
+        'details': f"Деталь импортирована из файла {stats.filename}.",
+        'category': 'part',
+        'payload': {'event': 'part_created', 'source': 'import'},
+    } for item in new_items]
+
+    bulk_insert(Part, part_rows)
+    audit_service.record_many(audit_rows)
+    # Пачка упорядочена как файл: родители всегда идут раньше своих потомков
+    hierarchy_service.add_parts_bulk((item['part_id'], item['parent_id']) for item in new_items)
+    # Узлы, добавленные в уже существующие сборки, меняют их сводный прогресс
+    progress_service.invalidate_assembly_progress(
+        [item['part_id'] for item in new_items if item['parent_id']]
+    )
+
+    if update_existing:
+        _update_existing(existing_items, existing, route_ids, resolver, stats, user, now)
+    else:
+        stats.skipped += len(existing_items)
+    db.session.commit()
+    stats.added += len(new_items)
+
+
+def _iter_items(file_storage, stats, indent_hierarchy=False):
+    """
+    Разбирает строки всех секций файла и выдает новые (не повторяющиеся в файле)
+    детали с заполненными product_designation и parent_id.
+    Пропуски и ошибки строк учитываются в stats.
+    """
+    seen_ids = set()
+    for section in iter_sections(file_storage):
+        location = f"Лист '{section.title}', строка" if section.title else "Строка"
+        path = []  # текущая ветка дерева: [(глубина, part_id)]
+        for line_number, row in enumerate(section.rows, start=4):
+            if not any(row): continue  # Пропускаем полностью пустые строки
+            stats.rows += 1
+            try:
+                depth = row_depth(row, section.header_map, indent_hierarchy)
+            except ValueError as e:
+                stats.add_error(f"{location} {line_number}: {e}.")
+                continue
+            while path and path[-1][0] >= depth:
+                path.pop()
+            parent_id = path[-1][1] if path else None
+
+            try:
+                item = parse_row(row, section.header_map)
+                if item is None:
+                    stats.skipped += 1
+            except ValueError as e:
+                stats.add_error(f"{location} {line_number}: {e}.")
+                item = None
+
+            if item is None:
+                # Деталь не создается: ее потомки привязываются к ближайшему предку
+                path.append((depth, parent_id))
+                continue
+            path.append((depth, item['part_id']))
+            if item['part_id'] in seen_ids:
+                stats.skipped += 1
+                continue
+            seen_ids.add(item['part_id'])
+            item['product_designation'] = section.product_designation
+            item['parent_id'] = parent_id
+            yield item
+
+
+def import_parts(file_storage, user, chunk_size=DEFAULT_CHUNK_SIZE, update_existing=False, indent_hierarchy=False):
+    """
+    Импортирует детали из файла (CSV, .xlsx, .xls) потоком, пачками по chunk_size строк.
+
+    Каждая пачка обрабатывается набором массовых операций (один IN-запрос на
+    существующие обозначения, разрешение маршрутов в памяти, массовая вставка
+    деталей, записей аудита и строк замыкания), фиксируется отдельным коммитом
+    и сопровождается событием 'import_progress'. Уже зафиксированные пачки
+    остаются в БД, если импорт прервется на середине файла.
+
+    Иерархия спецификации (позиция, уровень или, с indent_hierarchy=True, отступ
+    наименования, см. row_depth) строится
+    за один проход стеком текущей ветки: родителем строки становится ближайшая
+    предыдущая строка меньшей глубины, без поиска родителей в БД.
+
+    С update_existing=True существующие детали не пропускаются, а обновляются
+    (наименование, материал, размер, количество, маршрут), см. _update_existing.
+
+    Строки с некорректными значениями не прерывают импорт, а учитываются как ошибки.
+    Возвращает ImportStats.
+    """
+    stats = ImportStats(file_storage.filename)
+    resolver = RouteResolver()
+
+    chunk = []
+    try:
+        for item in _iter_items(file_storage, stats, indent_hierarchy):
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                _insert_chunk(chunk, resolver, stats, user, update_existing)
+                chunk = []
+                _emit_progress(stats)
+        if chunk:
+            _insert_chunk(chunk, resolver, stats, user, update_existing)
+    except Exception:
+        db.session.rollback()
+        # Маршруты, созданные в откаченной пачке, не должны остаться в мемо процесса
+        route_service.invalidate_memo()
+        raise
+
+    _emit_progress(stats, done=True)
+    return stats
+
+
+# Результаты строк в отчете пробного импорта
+DRY_RUN_NEW = "Будет добавлена"
+DRY_RUN_EXISTS = "Уже существует"
+DRY_RUN_DUPLICATE = "Дубликат в файле"
+DRY_RUN_INCOMPLETE = "Пропущена: нет обозначения или наименования"
+DRY_RUN_BAD_QUANTITY = "Ошибка: некорректное количество"
+DRY_RUN_COLUMNS = ['Раздел', 'Изделие', 'Строка', COL_PART_ID, COL_NAME, COL_QUANTITY, COL_OPERATIONS, 'Результат']
+
+
+def _section_frame(section):
+    """Загружает строки секции в DataFrame с колонками файла (все значения — строки)."""
+    raw = pd.DataFrame.from_records(list(section.rows))
+    frame = pd.DataFrame({
+        header: raw[index] if index in raw.columns else None
+        for header, index in section.header_map.items() if header
+    }, index=raw.index)
+    # Числа из Excel приводятся к тексту так же, как при импорте (1001.0 -> '1001')
+    frame = frame.astype(object).where(frame.notna(), None).map(_to_text)
+    frame['Строка'] = np.arange(4, len(frame) + 4)
+    frame['Изделие'] = section.product_designation
+    # Полностью пустые строки импорт пропускает, в отчет они тоже не попадают
+    data_columns = [column for column in frame.columns if column not in ('Строка', 'Изделие')]
+    return frame[frame[data_columns].ne('').any(axis=1)]
+
+
+def build_dry_run_report(file_storage):
+    """
+    Пробный импорт без записи в БД: загружает файл в DataFrame, проверяет
+    обязательные колонки и количество (тем же правилом, что импорт), находит дубликаты
+    в файле и в БД (IN-запросами по уникальным обозначениям) и перечисляет
+    маршруты и этапы, которые будут созданы.
+
+    Возвращает (сводка, CSV-отчет в BytesIO).
+    """
+    frames = []
+    for section in iter_sections(file_storage):
+        missing = [column for column in (COL_PART_ID, COL_NAME) if column not in section.header_map]
+        if missing:
+            raise ValueError(f"Нет обязательных колонок: {', '.join(missing)}.")
+        frames.append(_section_frame(section))
+    frame = pd.concat(frames, ignore_index=True)
+    for column in (COL_QUANTITY, COL_OPERATIONS):
+        if column not in frame.columns:
+            frame[column] = ''
+    frame[[COL_QUANTITY, COL_OPERATIONS]] = frame[[COL_QUANTITY, COL_OPERATIONS]].fillna('')
+
+    # Не pd.to_numeric: он пропускает '2.0' и '1e2', которые сам импорт отклоняет
+    bad_quantity = ~frame[COL_QUANTITY].map(_is_valid_quantity).astype(bool)
+    incomplete = frame[COL_PART_ID].eq('') | frame[COL_NAME].eq('')
+    duplicate = ~incomplete & frame[COL_PART_ID].duplicated(keep='first')
+    existing_ids = get_existing_part_ids(frame.loc[~incomplete, COL_PART_ID].unique())
+    exists = ~incomplete & frame[COL_PART_ID].isin(existing_ids)
+
+    frame['Результат'] = np.select(
+        [incomplete, bad_quantity, exists, duplicate],
+        [DRY_RUN_INCOMPLETE, DRY_RUN_BAD_QUANTITY, DRY_RUN_EXISTS, DRY_RUN_DUPLICATE],
+        default=DRY_RUN_NEW
+    )
+    frame['Раздел'] = 'Строка'
+
+    to_add = frame['Результат'].eq(DRY_RUN_NEW)
+    new_routes, new_stages = RouteResolver().plan(frame.loc[to_add, COL_OPERATIONS].unique())
+    extra = pd.DataFrame(
+        [{'Раздел': 'Новый маршрут', COL_OPERATIONS: name} for name in new_routes] +
+        [{'Раздел': 'Новый этап', COL_OPERATIONS: name} for name in new_stages],
+        columns=DRY_RUN_COLUMNS
+    )
+    report = pd.concat([frame[DRY_RUN_COLUMNS], extra], ignore_index=True)
+    report['Строка'] = report['Строка'].astype('Int64')
+
+    summary = frame['Результат'].value_counts().to_dict()
+    summary.update({'rows': len(frame), 'new_routes': len(new_routes), 'new_stages': len(new_stages)})
+
+    buffer = io.BytesIO()
+    # utf-8-sig, чтобы Excel правильно открыл кириллицу
+    buffer.write(report.to_csv(index=False).encode('utf-8-sig'))
+    buffer.seek(0)
+    return summary, buffer
@@ -0,0 +1,245 @@
+# app/services/label_service.py
+
+import io
+import zipfile
+import zlib
+from functools import lru_cache
+
+from flask import current_app
+from PIL import Image, ImageDraw, ImageFont
+from sqlalchemy import select
+
+from app import db
+from app.models.models import Part
+from app.services import qr_service, qr_engine, render_pool
+from app.utils import create_safe_file_name
+
+# Форматы массовой выгрузки: архив картинок или PDF-листы с этикетками
+EXPORT_FORMATS = ('png', 'svg', 'pdf')
+
+# Этикетка рисуется 1-битной картинкой этого размера (пиксели)
+LABEL_SIZE = (600, 250)
+LABEL_PADDING = 10
+# Лист A4 в пунктах и сетка этикеток на нем
+PAGE_SIZE = (595.28, 841.89)
+PAGE_MARGIN = 20
+LABEL_COLUMNS = 2
+LABEL_ROWS = 7
+
+
+def get_parts(product=None, part_ids=None):
+    """
+    Детали для выгрузки (part_id, name, product_designation): все детали изделия
+    и/или явно перечисленные, одним запросом, по порядку обозначений.
+    """
+    conditions = []
+    if product:
+        conditions.append(Part.product_designation == product)
+    if part_ids:
+        conditions.append(Part.part_id.in_(part_ids))
+    if not conditions:
+        return []
+    return db.session.execute(
+        select(Part.part_id, Part.name, Part.product_designation)
+        .where(db.or_(*conditions))
+        .order_by(Part.part_id)
+    ).all()
+
+
+class _StreamSink(io.RawIOBase):
+    """Несжимаемый поток для zipfile: копит записанное до очередной выдачи клиенту."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(part_ids, export_format='png', **options):
+    """
+    Потоково выдает ZIP-архив с QR-кодами деталей (PNG или SVG). Каждый файл
+    отдается клиенту сразу после записи, в памяти держится одна пачка кодов.
+    options — параметры отрисовки qr_engine (error_correction, box_size, border, compact).
+    """
+    # PNG уже сжат, повторно сжимаем только SVG
+    compression = zipfile.ZIP_DEFLATED if export_format == 'svg' else zipfile.ZIP_STORED
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, 'w', compression=compression) as archive:
+        for part_id, image in qr_service.iter_images(part_ids, format=export_format, **options):
+            archive.writestr(create_safe_file_name(f"part_{part_id}_qr.{export_format}"), image.data)
+            yield sink.drain()
+    yield sink.drain()
+
+
+@lru_cache(maxsize=4)
+def _load_font(font_path, size):
+    try:
+        return ImageFont.truetype(font_path, size)
+    except OSError:
+        # Шрифт не найден: встроенный шрифт Pillow (кириллица может не отобразиться)
+        return ImageFont.load_default(size=size)
+
+
+def _fit_text(draw, text, font, max_width):
+    if draw.textlength(text, font=font) <= max_width:
+        return text
+    while text and draw.textlength(text + '…', font=font) > max_width:
+        text = text[:-1]
+    return text + '…'
+
+
+def _render_label(args):
+    """
+    Рисует одну этикетку (QR-код и подписи) и возвращает (ширина, высота, данные),
+    где данные — упакованные построчно 1-битные пиксели, сжатые zlib, как их ждет PDF.
+    Выполняется в процессе пула.
+    """
+    url, error_correction, lines, font_path = args
+    width, height = LABEL_SIZE
+    label = Image.new('1', LABEL_SIZE, 1)
+
+    qr = qr_engine.make_qr(url, error_correction, border=0)
+    qr_side = height - 2 * LABEL_PADDING
+    # Целый размер модуля, чтобы модули не искажались при масштабировании
+    qr.box_size = max(1, qr_side // qr.modules_count)
+    qr_image = qr.make_image().get_image().convert('1')
+    offset = LABEL_PADDING + (qr_side - qr_image.size[1]) // 2
+    label.paste(qr_image, (offset, offset))
+
+    draw = ImageDraw.Draw(label)
+    text_x = qr_side + 3 * LABEL_PADDING
+    text_width = width - text_x - LABEL_PADDING
+    y = 2 * LABEL_PADDING
+    for text, size in zip(lines, (34, 28, 22)):
+        font = _load_font(font_path, size)
+        draw.text((text_x, y), _fit_text(draw, text or '', font, text_width), font=font, fill=0)
+        y += size + 2 * LABEL_PADDING
+
+    return width, height, zlib.compress(label.tobytes())
+
+
+class _PdfStream:
+    """
+    Минимальный потоковый писатель PDF: каждая страница выдается сразу после отрисовки,
+    в памяти остаются только смещения объектов для таблицы xref в конце файла.
+    """
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self):
+        self.offsets = {}
+        self.position = 0
+        self.page_ids = []
+        self._last_id = self.PAGES_ID
+
+    def _emit(self, data):
+        self.position += len(data)
+        return data
+
+    def _new_id(self):
+        self._last_id += 1
+        return self._last_id
+
+    def _object(self, obj_id, body):
+        self.offsets[obj_id] = self.position
+        return self._emit(b'%d 0 obj\n%s\nendobj\n' % (obj_id, body))
+
+    def _stream(self, obj_id, dictionary, data):
+        return self._object(obj_id, b'<< %s /Length %d >>\nstream\n%s\nendstream' % (dictionary, len(data), data))
+
+    def header(self):
+        return self._emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    @staticmethod
+    def _cell(index, width, height):
+        """Положение этикетки index на странице с сохранением пропорций."""
+        cell_width = (PAGE_SIZE[0] - 2 * PAGE_MARGIN) / LABEL_COLUMNS
+        cell_height = (PAGE_SIZE[1] - 2 * PAGE_MARGIN) / LABEL_ROWS
+        scale = min((cell_width - 4) / width, (cell_height - 4) / height)
+        row, column = divmod(index, LABEL_COLUMNS)
+        x = PAGE_MARGIN + column * cell_width + 2
+        y = PAGE_SIZE[1] - PAGE_MARGIN - (row + 1) * cell_height + 2
+        return x, y, width * scale, height * scale
+
+    def page(self, labels):
+        chunks, resources, content = [], [], []
+        for index, (width, height, data) in enumerate(labels):
+            image_id = self._new_id()
+            chunks.append(self._stream(
+                image_id,
+                b'/Type /XObject /Subtype /Image /Width %d /Height %d '
+                b'/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /FlateDecode' % (width, height),
+                data
+            ))
+            x, y, w, h = self._cell(index, width, height)
+            content.append(b'q %.2f 0 0 %.2f %.2f %.2f cm /L%d Do Q' % (w, h, x, y, index))
+            resources.append(b'/L%d %d 0 R' % (index, image_id))
+
+        content_id = self._new_id()
+        chunks.append(self._stream(content_id, b'/Filter /FlateDecode', zlib.compress(b'\n'.join(content))))
+        page_id = self._new_id()
+        chunks.append(self._object(page_id, (
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] '
+            b'/Resources << /XObject << %s >> >> /Contents %d 0 R >>'
+        ) % (self.PAGES_ID, PAGE_SIZE[0], PAGE_SIZE[1], b' '.join(resources), content_id)))
+        self.page_ids.append(page_id)
+        return b''.join(chunks)
+
+    def finish(self):
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in self.page_ids)
+        chunks = [
+            self._object(self.PAGES_ID, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.page_ids))),
+            self._object(self.CATALOG_ID, b'<< /Type /Catalog /Pages %d 0 R >>' % self.PAGES_ID),
+        ]
+        xref_offset = self.position
+        size = self._last_id + 1
+        xref = [b'xref\n0 %d\n0000000000 65535 f \n' % size]
+        xref.extend(b'%010d 00000 n \n' % self.offsets[obj_id] for obj_id in range(1, size))
+        chunks.append(b''.join(xref))
+        chunks.append(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, self.CATALOG_ID, xref_offset))
+        return b''.join(chunks)
+
+
+def stream_pdf(parts, **options):
+    """
+    Потоково выдает PDF с листами этикеток (QR-код, обозначение, наименование, изделие).
+    Этикетки рисуются постранично в пуле процессов (RENDER_WORKERS).
+    Из options учитываются error_correction и compact.
+    """
+    options = qr_service.resolve_options(options)
+    workers = render_pool.configured_workers()
+    font_path = current_app.config.get('QR_LABEL_FONT')
+    per_page = LABEL_COLUMNS * LABEL_ROWS
+    # Сколько страниц отдавать пулу за раз: пачка около RENDER_BATCH_SIZE этикеток
+    batch_size = max(1, qr_service.RENDER_BATCH_SIZE // per_page) * per_page
+
+    pdf = _PdfStream()
+    yield pdf.header()
+    for start in range(0, len(parts), batch_size):
+        tasks = [
+            (qr_service.scan_url(part.part_id, options['compact']), options['error_correction'],
+             (part.part_id, part.name, part.product_designation), font_path)
+            for part in parts[start:start + batch_size]
+        ]
+        if workers > 1 and len(tasks) > 1:
+            labels = list(render_pool.get_pool(workers).map(_render_label, tasks, chunksize=qr_service.RENDER_CHUNK_SIZE))
+        else:
+            labels = [_render_label(task) for task in tasks]
+        for page_start in range(0, len(labels), per_page):
+            yield pdf.page(labels[page_start:page_start + per_page])
+    yield pdf.finish()
@@ -1,17 +1,11 @@
 
 # app/services/part_service.py
 
-import os
-import csv
-import io
-from datetime import datetime, timezone
-from werkzeug.utils import secure_filename
-from PIL import Image
-
 from app import db, socketio
-from app.models.models import (Part, AuditLog, RouteTemplate, ResponsibleHistory,
-                               User, StatusHistory, Stage, RouteStage)
-from app.utils import generate_qr_code_as_base64
+from app.models.models import (Part, ResponsibleHistory,
+                               User, StatusHistory)
+from app.services import (progress_service, hierarchy_service, import_service, qr_service, drawing_service,
+                          audit_service)
 
 
 def _send_websocket_notification(event_type: str, message: str, part_id: str = None):
@@ -25,19 +19,10 @@ def _send_websocket_notification(event_type: str, message: str, part_id: str = N
 def save_part_drawing(file_storage, config):
     """
     Безопасно сохраняет файл чертежа, сжимая его, и возвращает уникальное имя.
+    Уменьшенные копии создаются отдельно (drawing_service.schedule_renditions).
+    Одинаковые чертежи хранятся одним файлом (drawing_service.save_original).
     """
-    filename = secure_filename(file_storage.filename)
-    unique_filename = f"{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}_{filename}"
-    file_path = os.path.join(config['DRAWING_UPLOAD_FOLDER'], unique_filename)
-
-    try:
-        img = Image.open(file_storage)
-        img.save(file_path, optimize=True, quality=85)
-        return unique_filename
-    except Exception:
-        file_storage.seek(0)
-        file_storage.save(file_path)
-        return unique_filename
+    return drawing_service.save_original(file_storage, config['DRAWING_UPLOAD_FOLDER'])
 
 
 def create_single_part(form, user, config):
@@ -59,10 +44,13 @@ def create_single_part(form, user, config):
         quantity_total=form.quantity_total.data
     )
     db.session.add(new_part)
+    hierarchy_service.add_part(new_part.part_id)
     
-    log_entry = AuditLog(part_id=new_part.part_id, user_id=user.id, action="Создание", details="Деталь создана вручную.", category='part')
-    db.session.add(log_entry)
+    audit_service.record(part_id=new_part.part_id, user_id=user.id, action="Создание", details="Деталь создана вручную.", category='part',
+                         payload={'event': 'part_created'})
     db.session.commit()
+    if drawing_filename:
+        drawing_service.schedule_renditions(new_part.part_id, drawing_filename)
     
     _send_websocket_notification(
         'part_created',
@@ -71,170 +59,111 @@ def create_single_part(form, user, config):
     )
 
 
-def import_parts_from_excel(file_storage, user, config):
+def import_parts_from_excel(file_storage, user, config, update_existing=False, indent_hierarchy=False):
     """
     Обрабатывает загруженный Excel/CSV файл с иерархической структурой
     для массового импорта изделий и их составных частей.
+    Сам импорт выполняется потоком, пачками по IMPORT_CHUNK_SIZE строк,
+    массовыми операциями в import_service. Возвращает import_service.ImportStats.
     """
-    added_count = 0
-    skipped_count = 0
-    current_product_designation = "Без названия"
-    
-    # Читаем файл как текст и декодируем
-    content = file_storage.read().decode('utf-8')
-    reader = csv.reader(io.StringIO(content))
-    
-    # Пропускаем первые 2 строки заголовка файла
-    next(reader, None)
-    product_header_row = next(reader, None)
-    if product_header_row and len(product_header_row) > 1 and product_header_row[1]:
-        current_product_designation = product_header_row[1]
-
-    headers_row = next(reader, None)
-    if not headers_row or "Обозначение" not in headers_row:
-        raise ValueError("Не найдены заголовки. Ожидается строка с 'Обозначение', 'Наименование' и т.д.")
-        
-    header_map = {header: i for i, header in enumerate(headers_row)}
-
-    for row in reader:
-        if not any(row): continue # Пропускаем полностью пустые строки
-
-        part_id = row[header_map.get("Обозначение")].strip()
-        name = row[header_map.get("Наименование")].strip()
-
-        if not part_id or not name:
-            skipped_count += 1
-            continue
-
-        if db.session.get(Part, part_id):
-            skipped_count += 1
-            continue
-            
-        material = row[header_map.get("Прим", "")].strip()
-        if not material:
-            material = "Не указан" # Заглушка, т.к. поле обязательное
-
-        operations_str = row[header_map.get("Операции", "")].strip()
-        route_template_id = _get_or_create_route_from_operations(operations_str).id
-
-        new_part = Part(
-            part_id=part_id,
-            product_designation=current_product_designation,
-            name=name,
-            quantity_total=int(row[header_map.get("Кол-во")] or 1),
-            size=row[header_map.get("Размер", "")].strip(),
-            material=material,
-            route_template_id=route_template_id
-        )
-        db.session.add(new_part)
-        
-        log_entry = AuditLog(
-            part_id=part_id, user_id=user.id, action="Создание",
-            details=f"Деталь импортирована из файла {file_storage.filename}.",
-            category='part'
-        )
-        db.session.add(log_entry)
-        added_count += 1
+    stats = import_service.import_parts(
+        file_storage, user,
+        chunk_size=config.get('IMPORT_CHUNK_SIZE', import_service.DEFAULT_CHUNK_SIZE),
+        update_existing=update_existing,
+        indent_hierarchy=indent_hierarchy
+    )
 
-    db.session.commit()
-    
     _send_websocket_notification(
         'import_finished',
-        f"Пользователь {user.username} импортировал {added_count} новых деталей."
+        f"Пользователь {user.username} импортировал {stats.added} новых деталей"
+        f" и обновил {stats.updated}."
     )
-    
-    return added_count, skipped_count
 
+    return stats
 
-def _get_or_create_route_from_operations(operations_str: str) -> RouteTemplate:
-    """
-    Находит существующий маршрут по строке операций или создает новый.
-    Также создает недостающие этапы в справочнике.
-    """
-    if not operations_str:
-        default_route = RouteTemplate.query.filter_by(is_default=True).first()
-        if not default_route:
-            raise ValueError("Не найден маршрут по умолчанию для деталей без указания операций.")
-        return default_route
-
-    # Создаем каноничное имя для маршрута
-    operations = [op.strip() for op in operations_str.split(',')]
-    route_name = " -> ".join(operations)
-    
-    route = RouteTemplate.query.filter_by(name=route_name).first()
-    if route:
-        return route
-
-    # Создаем новый маршрут
-    new_route = RouteTemplate(name=route_name, is_default=False)
-    db.session.add(new_route)
-    
-    for i, op_name in enumerate(operations):
-        stage = Stage.query.filter(Stage.name.ilike(op_name)).first()
-        if not stage:
-            stage = Stage(name=op_name)
-            db.session.add(stage)
-        
-        # Предварительно коммитим, чтобы получить ID
-        db.session.flush()
-
-        route_stage = RouteStage(template_id=new_route.id, stage_id=stage.id, order=i)
-        db.session.add(route_stage)
-
-    return new_route
 
 def update_part_from_form(part, form, user, config):
     """
     Обновляет данные детали на основе формы, обрабатывает чертеж и логирует.
     """
     changes = []
+    changed_fields = []
     if part.product_designation != form.product_designation.data:
         changes.append(f"Изделие: '{part.product_designation}' -> '{form.product_designation.data}'")
+        changed_fields.append('product_designation')
         part.product_designation = form.product_designation.data
     
     # Предполагается, что в EditPartForm добавлены поля name, material, size
     if hasattr(form, 'name') and part.name != form.name.data:
         changes.append(f"Наименование: '{part.name}' -> '{form.name.data}'")
+        changed_fields.append('name')
         part.name = form.name.data
 
     if hasattr(form, 'material') and part.material != form.material.data:
         changes.append(f"Материал: '{part.material}' -> '{form.material.data}'")
+        changed_fields.append('material')
         part.material = form.material.data
 
     if hasattr(form, 'size') and part.size != form.size.data:
         changes.append(f"Размер: '{part.size}' -> '{form.size.data}'")
+        changed_fields.append('size')
         part.size = form.size.data
 
+    new_parent_id = part.parent_id
+    if hasattr(form, 'parent_id'):
+        new_parent_id = (form.parent_id.data or '').strip() or None
+    if new_parent_id != part.parent_id:
+        changes.append(f"Состав: '{part.parent_id or 'корневая'}' -> '{new_parent_id or 'корневая'}'")
+        changed_fields.append('parent_id')
+        _move_to_parent(part, new_parent_id)
+
+    new_drawing = None
     if form.drawing.data:
-        if part.drawing_filename:
-            old_file_path = os.path.join(config['DRAWING_UPLOAD_FOLDER'], part.drawing_filename)
-            if os.path.exists(old_file_path): os.remove(old_file_path)
-        
-        part.drawing_filename = save_part_drawing(form.drawing.data, config)
+        drawing_service.release([part.drawing_filename])
+        new_drawing = part.drawing_filename = save_part_drawing(form.drawing.data, config)
+        part.drawing_thumb_filename = part.drawing_medium_filename = None
         changes.append("Обновлен чертеж.")
+        changed_fields.append('drawing')
 
     if changes:
         log_details = "; ".join(changes)
-        log_entry = AuditLog(part_id=part.part_id, user_id=user.id, action="Редактирование", details=log_details, category='part')
-        db.session.add(log_entry)
+        audit_service.record(part_id=part.part_id, user_id=user.id, action="Редактирование", details=log_details, category='part',
+                             payload={'event': 'part_edited', 'fields': changed_fields})
         db.session.commit()
+        if new_drawing:
+            drawing_service.schedule_renditions(part.part_id, new_drawing)
         _send_websocket_notification(
             'part_updated',
             f"Пользователь {user.username} обновил данные детали {part.part_id}",
             part.part_id
         )
 
+def _move_to_parent(part, new_parent_id):
+    """
+    Переносит деталь со всем составом под другого родителя того же изделия
+    (None — делает корневой): таблица замыкания и кэш сводного прогресса
+    старой и новой сборки обновляются в hierarchy_service.move_subtree.
+    """
+    if new_parent_id is not None:
+        new_parent = db.session.get(Part, new_parent_id)
+        if new_parent is None:
+            raise ValueError(f"Родительская деталь с ID {new_parent_id} не найдена.")
+        if new_parent.product_designation != part.product_designation:
+            raise ValueError("Перенести узел можно только в состав того же изделия.")
+    hierarchy_service.move_subtree(part, new_parent_id)
+
 def delete_single_part(part, user, config):
     """
-    Удаляет одну деталь, связанный чертеж и создает запись в логе.
+    Удаляет одну деталь, освобождает ее чертеж и создает запись в логе.
+    Файл чертежа удаляется позже уборкой хранилища, если на него больше никто не ссылается.
     """
     part_id = part.part_id
-    if part.drawing_filename:
-        file_path = os.path.join(config['DRAWING_UPLOAD_FOLDER'], part.drawing_filename)
-        if os.path.exists(file_path): os.remove(file_path)
+    drawing_service.release_for_parts([part_id])
             
-    log_entry = AuditLog(part_id=part_id, user_id=user.id, action="Удаление", details=f"Деталь '{part_id}' и вся ее история были удалены.", category='part')
-    db.session.add(log_entry)
+    audit_service.record(part_id=part_id, user_id=user.id, action="Удаление", details=f"Деталь '{part_id}' и вся ее история были удалены.", category='part',
+                         payload={'event': 'part_deleted'})
+    progress_service.invalidate_assembly_progress([part_id])
+    hierarchy_service.remove_subtrees([part_id])
     db.session.delete(part)
     db.session.commit()
     
@@ -248,11 +177,12 @@ def change_part_route(part, new_route, user):
     """Меняет технологический маршрут для детали и логирует действие."""
     if part.route_template_id != new_route.id:
         old_route_name = part.route_template.name if part.route_template else "Не назначен"
+        old_route_id = part.route_template_id
         part.route_template_id = new_route.id
         
         log_details = f"Маршрут изменен с '{old_route_name}' на '{new_route.name}'."
-        log_entry = AuditLog(part_id=part.part_id, user_id=user.id, action="Редактирование", details=log_details, category='part')
-        db.session.add(log_entry)
+        audit_service.record(part_id=part.part_id, user_id=user.id, action="Редактирование", details=log_details, category='part',
+                             payload={'event': 'route_changed', 'route_old': old_route_id, 'route_new': new_route.id})
         db.session.commit()
         
         _send_websocket_notification(
@@ -276,8 +206,9 @@ def change_responsible_user(part, new_user, current_user):
         db.session.add(ResponsibleHistory(part_id=part.part_id, user_id=new_responsible_id))
         
         log_details = f"Ответственный изменен с '{old_user_name}' на '{new_user_name}'."
-        log_entry = AuditLog(part_id=part.part_id, user_id=current_user.id, action="Смена ответственного", details=log_details, category='management')
-        db.session.add(log_entry)
+        audit_service.record(part_id=part.part_id, user_id=current_user.id, action="Смена ответственного", details=log_details, category='management',
+                             payload={'event': 'responsible_changed', 'responsible_old': old_responsible_id,
+                                      'responsible_new': new_responsible_id})
         db.session.commit()
         
         _send_websocket_notification(
@@ -308,10 +239,12 @@ def create_child_part(form, parent_part_id, user):
     )
     # --- КОНЕЦ ИЗМЕНЕНИЯ ---
     db.session.add(new_part)
+    hierarchy_service.add_part(new_part.part_id, parent_part_id)
+    progress_service.invalidate_assembly_progress([new_part.part_id])
     
     log_details = f"В состав '{parent_part.name}' добавлен узел '{new_part.name}'."
-    log_entry = AuditLog(part_id=parent_part_id, user_id=user.id, action="Обновление состава", details=log_details, category='part')
-    db.session.add(log_entry)
+    audit_service.record(part_id=parent_part_id, user_id=user.id, action="Обновление состава", details=log_details, category='part',
+                         payload={'event': 'child_added', 'child': new_part.part_id})
     
     db.session.commit()
     
@@ -323,14 +256,25 @@ def create_child_part(form, parent_part_id, user):
 
 def log_qr_generation(part_id, user):
     """Логирует факт генерации или перегенерации QR-кода."""
-    log_entry = AuditLog(part_id=part_id, user_id=user.id, action="Генерация QR", details=f"Создан QR-код для детали '{part_id}'.", category='part')
-    db.session.add(log_entry)
+    audit_service.record(part_id=part_id, user_id=user.id, action="Генерация QR", details=f"Создан QR-код для детали '{part_id}'.", category='part',
+                         payload={'event': 'qr_generated'})
+    db.session.commit()
+
+def log_qr_export(part_count, export_format, user, product=None):
+    """Логирует массовую выгрузку QR-кодов одной записью."""
+    target = f"изделия '{product}'" if product else "выбранных деталей"
+    audit_service.record(user_id=user.id, action="Выгрузка QR", details=f"Выгружено QR-кодов {target}: {part_count} ({export_format.upper()}).", category='part',
+                         payload={'event': 'qr_exported', 'quantity': part_count, 'format': export_format, 'product': product})
     db.session.commit()
 
 def get_parts_for_printing(part_ids):
-    """Получает данные деталей и их QR-коды для страницы печати."""
-    parts = Part.query.filter(Part.part_id.in_(part_ids)).all()
-    return [{'part': part, 'qr_image': generate_qr_code_as_base64(part.part_id)} for part in parts]
+    """
+    Получает детали для страницы печати. Сами QR-коды страница подгружает
+    отдельными кэшируемыми картинками, а недостающие заранее рисуются в фоне.
+    """
+    parts = Part.query.filter(Part.part_id.in_(part_ids)).order_by(Part.part_id).all()
+    qr_service.prewarm_in_background([part.part_id for part in parts])
+    return parts
 
 def cancel_stage_by_history_id(history_id, user):
     """Отменяет этап производства по ID записи в истории."""
@@ -341,13 +285,17 @@ def cancel_stage_by_history_id(history_id, user):
     if part.quantity_completed < 0: part.quantity_completed = 0
     
     log_details = f"Отменен этап: '{history_entry.status}' ({history_entry.quantity} шт.)."
-    db.session.add(AuditLog(part_id=part.part_id, user_id=user.id, action="Отмена этапа", details=log_details, category='part'))
+    audit_service.record(part_id=part.part_id, user_id=user.id, action="Отмена этапа", details=log_details, category='part',
+                         payload={'event': 'stage_cancelled', 'stage': history_entry.status,
+                                  'quantity': history_entry.quantity})
     
     stage_name = history_entry.status
     db.session.delete(history_entry)
 
     new_last_history = StatusHistory.query.filter_by(part_id=part.part_id).order_by(StatusHistory.timestamp.desc()).first()
     part.current_status = new_last_history.status if new_last_history else 'На складе'
+    progress_service.recalculate_stage(part, stage_name)
+    progress_service.invalidate_assembly_progress([part.part_id])
     
     db.session.commit()
     
@@ -362,12 +310,13 @@ def delete_multiple_parts(part_ids, user, config):
     """Массово удаляет детали из списка их ID."""
     parts_to_delete = Part.query.filter(Part.part_id.in_(part_ids)).all()
     deleted_count = 0
+    progress_service.invalidate_assembly_progress([part.part_id for part in parts_to_delete])
+    # Чертежи освобождаются одним запросом; файлы удаляет уборка хранилища
+    drawing_service.release_for_parts([part.part_id for part in parts_to_delete])
+    hierarchy_service.remove_subtrees([part.part_id for part in parts_to_delete])
     for part in parts_to_delete:
-        if part.drawing_filename:
-            file_path = os.path.join(config['DRAWING_UPLOAD_FOLDER'], part.drawing_filename)
-            if os.path.exists(file_path): os.remove(file_path)
-        
-        db.session.add(AuditLog(part_id=part.part_id, user_id=user.id, action="Массовое удаление", details=f"Деталь '{part.part_id}' удалена.", category='part'))
+        audit_service.record(part_id=part.part_id, user_id=user.id, action="Массовое удаление", details=f"Деталь '{part.part_id}' удалена.", category='part',
+                             payload={'event': 'part_deleted', 'bulk': True})
         db.session.delete(part)
         deleted_count += 1
         
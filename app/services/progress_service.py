@@ -0,0 +1,248 @@
+# app/services/progress_service.py
+
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from sqlalchemy import func, case, delete, insert, select, exists, update
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.models.models import (Part, PartStageProgress, Stage, StatusHistory,
+                               PartClosure, AssemblyProgress)
+from app.services.sql_utils import dialect_insert
+
+STATUS_PENDING = 'pending'
+STATUS_IN_PROGRESS = 'in_progress'
+STATUS_COMPLETED = 'completed'
+
+
+def stage_status(qty_done: int, quantity_total: int) -> str:
+    """Определяет статус этапа по выполненному и общему количеству."""
+    if qty_done >= quantity_total:
+        return STATUS_COMPLETED
+    if qty_done > 0:
+        return STATUS_IN_PROGRESS
+    return STATUS_PENDING
+
+
+def _get_or_create_row(part, stage_id):
+    row = db.session.get(PartStageProgress, (part.part_id, stage_id))
+    if row is None:
+        row = PartStageProgress(part_id=part.part_id, stage_id=stage_id, qty_done=0, status=STATUS_PENDING)
+        db.session.add(row)
+    return row
+
+
+def get_stage_qty_done(part, stage) -> int:
+    """Возвращает количество, уже выполненное по этапу (без чтения истории)."""
+    row = db.session.get(PartStageProgress, (part.part_id, stage.id))
+    return row.qty_done if row else 0
+
+
+def apply_stage_completion(part, stage, quantity, timestamp=None):
+    """
+    Учитывает подтверждение этапа в материализованном прогрессе.
+    Коммит выполняет вызывающий код вместе с записью в StatusHistory.
+    """
+    row = _get_or_create_row(part, stage.id)
+    row.qty_done += quantity
+    row.status = stage_status(row.qty_done, part.quantity_total)
+    row.last_timestamp = timestamp or datetime.now(timezone.utc)
+    return row
+
+
+def recalculate_stage(part, stage_name):
+    """
+    Пересчитывает прогресс одного этапа детали по оставшейся истории
+    одним агрегирующим запросом (используется при отмене этапа).
+    """
+    stage = Stage.query.filter_by(name=stage_name).first()
+    if stage is None:
+        return None
+
+    qty_done, last_timestamp = db.session.query(
+        func.coalesce(func.sum(StatusHistory.quantity), 0),
+        func.max(StatusHistory.timestamp)
+    ).filter(
+        StatusHistory.part_id == part.part_id,
+        StatusHistory.status == stage_name
+    ).one()
+
+    row = _get_or_create_row(part, stage.id)
+    row.qty_done = qty_done
+    row.status = stage_status(qty_done, part.quantity_total)
+    row.last_timestamp = last_timestamp
+    return row
+
+
+def refresh_stage_statuses(part_ids):
+    """
+    Пересчитывает статусы этапов после изменения quantity_total деталей
+    одним UPDATE (выполненные количества при этом не меняются).
+    Коммит выполняет вызывающий код.
+    """
+    part_ids = list(part_ids)
+    if not part_ids:
+        return
+    quantity_total = select(Part.quantity_total).where(
+        Part.part_id == PartStageProgress.part_id
+    ).scalar_subquery()
+    db.session.execute(
+        update(PartStageProgress).where(PartStageProgress.part_id.in_(part_ids)).values(
+            status=case(
+                (PartStageProgress.qty_done >= quantity_total, STATUS_COMPLETED),
+                (PartStageProgress.qty_done > 0, STATUS_IN_PROGRESS),
+                else_=STATUS_PENDING
+            )
+        ),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def get_progress_map(part_ids):
+    """
+    Возвращает прогресс по этапам для набора деталей одним запросом:
+    {part_id: {stage_id: PartStageProgress}}.
+    """
+    progress_map = defaultdict(dict)
+    if not part_ids:
+        return progress_map
+    rows = PartStageProgress.query.filter(PartStageProgress.part_id.in_(part_ids))
+    for row in rows:
+        progress_map[row.part_id][row.stage_id] = row
+    return progress_map
+
+
+def rebuild_stage_progress() -> int:
+    """
+    Полностью перестраивает таблицу PartStageProgress из StatusHistory
+    одним INSERT ... SELECT. Возвращает количество созданных строк.
+    """
+    qty_sum = func.sum(StatusHistory.quantity)
+    status_expr = case(
+        (qty_sum >= Part.quantity_total, STATUS_COMPLETED),
+        (qty_sum > 0, STATUS_IN_PROGRESS),
+        else_=STATUS_PENDING
+    )
+    source = select(
+        StatusHistory.part_id,
+        Stage.id,
+        qty_sum,
+        status_expr,
+        func.max(StatusHistory.timestamp)
+    ).join(
+        Stage, Stage.name == StatusHistory.status
+    ).join(
+        Part, Part.part_id == StatusHistory.part_id
+    ).group_by(StatusHistory.part_id, Stage.id, Part.quantity_total)
+
+    db.session.execute(delete(PartStageProgress))
+    db.session.execute(
+        insert(PartStageProgress).from_select(
+            ['part_id', 'stage_id', 'qty_done', 'status', 'last_timestamp'], source
+        )
+    )
+    db.session.commit()
+    return db.session.query(func.count()).select_from(PartStageProgress).scalar()
+
+
+def invalidate_assembly_progress(part_ids):
+    """
+    Сбрасывает кэш сводного прогресса у корневых сборок, в состав которых
+    входят указанные детали (одним DELETE по таблице замыкания).
+    Коммит выполняет вызывающий код.
+    """
+    part_ids = list(part_ids)
+    if not part_ids:
+        return
+    root_ids = select(PartClosure.ancestor_id).join(
+        Part, Part.part_id == PartClosure.ancestor_id
+    ).where(
+        PartClosure.descendant_id.in_(part_ids),
+        Part.parent_id.is_(None)
+    )
+    db.session.execute(
+        delete(AssemblyProgress).where(AssemblyProgress.root_id.in_(root_ids.scalar_subquery())),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def refresh_assembly_progress(root_ids=None):
+    """
+    Пересчитывает кэш для корневых сборок, у которых его нет, одним
+    INSERT ... SELECT с агрегатом по таблице замыкания.
+    Выполненное количество узла ограничено его общим количеством,
+    чтобы перевыполнение одной детали не завышало готовность сборки.
+
+    Вызывается и из запросов на чтение, поэтому не коммитит: строки кэша
+    только сбрасываются в транзакцию сессии и сохраняются вместе с коммитом
+    пишущего кода, а в запросе без записи служат до его конца.
+    """
+    descendant = aliased(Part)
+    # Корни без строки в кэше; агрегат идет по индексу PartClosure(ancestor_id, ...)
+    stale_roots = select(Part.part_id).where(
+        Part.parent_id.is_(None),
+        ~exists().where(AssemblyProgress.root_id == Part.part_id)
+    )
+    if root_ids is not None:
+        stale_roots = stale_roots.where(Part.part_id.in_(list(root_ids)))
+
+    completed = case(
+        (descendant.quantity_completed > descendant.quantity_total, descendant.quantity_total),
+        else_=descendant.quantity_completed
+    )
+    source = select(
+        PartClosure.ancestor_id,
+        func.count(),
+        func.coalesce(func.sum(descendant.quantity_total), 0),
+        func.coalesce(func.sum(completed), 0),
+        func.current_timestamp()
+    ).join(
+        descendant, descendant.part_id == PartClosure.descendant_id
+    ).where(
+        PartClosure.ancestor_id.in_(stale_roots.scalar_subquery())
+    ).group_by(PartClosure.ancestor_id)
+
+    # ON CONFLICT DO NOTHING: параллельный запрос мог уже пересчитать ту же сборку
+    db.session.execute(
+        dialect_insert(AssemblyProgress).on_conflict_do_nothing().from_select(
+            ['root_id', 'part_count', 'quantity_total', 'quantity_completed', 'updated_at'], source
+        )
+    )
+    db.session.flush()
+
+
+def get_assembly_progress_map(root_ids):
+    """
+    Возвращает сводный прогресс сборок {root_id: AssemblyProgress}.
+    Отсутствующие в кэше сборки пересчитываются одним запросом.
+    """
+    root_ids = list(root_ids)
+    if not root_ids:
+        return {}
+    rows = AssemblyProgress.query.filter(AssemblyProgress.root_id.in_(root_ids)).all()
+    if len(rows) < len(root_ids):
+        refresh_assembly_progress(set(root_ids) - {row.root_id for row in rows})
+        rows = AssemblyProgress.query.filter(AssemblyProgress.root_id.in_(root_ids)).all()
+    return {row.root_id: row for row in rows}
+
+
+def get_product_assembly_summary():
+    """
+    Сводка по изделиям для панели мониторинга: суммы по всем поддеревьям
+    корневых деталей. Корни без строк замыкания учитываются собственными количествами.
+    """
+    refresh_assembly_progress()
+    own_completed = case(
+        (Part.quantity_completed > Part.quantity_total, Part.quantity_total),
+        else_=Part.quantity_completed
+    )
+    return db.session.query(
+        Part.product_designation,
+        func.count(Part.part_id).label('total_parts'),
+        func.sum(func.coalesce(AssemblyProgress.part_count, 1)).label('assembly_parts'),
+        func.sum(func.coalesce(AssemblyProgress.quantity_total, Part.quantity_total)).label('total_quantity'),
+        func.sum(func.coalesce(AssemblyProgress.quantity_completed, own_completed)).label('completed_quantity')
+    ).outerjoin(
+        AssemblyProgress, AssemblyProgress.root_id == Part.part_id
+    ).filter(Part.parent_id.is_(None)).group_by(Part.product_designation).all()
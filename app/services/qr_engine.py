@@ -0,0 +1,134 @@
+# app/services/qr_engine.py
+
+import base64
+from io import BytesIO
+
+import qrcode
+from qrcode import constants
+
+# Форматы вывода и их MIME-типы
+MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Уровни коррекции ошибок: доля кода, которую можно повредить без потери данных
+ERROR_CORRECTION_LEVELS = {
+    'L': constants.ERROR_CORRECT_L,  # ~7%
+    'M': constants.ERROR_CORRECT_M,  # ~15%, как у qrcode.make
+    'Q': constants.ERROR_CORRECT_Q,  # ~25%
+    'H': constants.ERROR_CORRECT_H,  # ~30%
+}
+
+# Параметры отрисовки по умолчанию (совпадают с qrcode.make)
+DEFAULT_OPTIONS = {'format': 'png', 'box_size': 10, 'border': 4, 'error_correction': 'M', 'compact': False}
+MAX_BOX_SIZE = 50
+MAX_BORDER = 20
+
+# Короткий путь для компактных кодов: /S/<токен>
+COMPACT_PATH = 'S'
+
+
+def compact_token(part_id) -> str:
+    """
+    Токен детали для компактного URL: base32 (A–Z, 2–7) без выравнивания '='.
+    Вместе с URL в верхнем регистре весь код попадает в алфавитно-цифровой
+    режим QR (5,5 бит на символ вместо 8), что снижает версию кода.
+    """
+    return base64.b32encode(part_id.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_token(token) -> str:
+    """Обратное преобразование compact_token. ValueError при некорректном токене."""
+    token = token.upper()
+    try:
+        return base64.b32decode(token + '=' * (-len(token) % 8)).decode('utf-8')
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Некорректный токен QR-кода: {token}") from e
+
+
+def build_url(base_url, part_id, compact=False) -> str:
+    """Содержимое QR-кода: полный URL сканирования или компактный /S/<токен>."""
+    if compact:
+        return f"{base_url}/{COMPACT_PATH}/{compact_token(part_id)}".upper()
+    return f"{base_url}/scan/{part_id}"
+
+
+def normalize_options(options) -> dict:
+    """
+    Дополняет параметры значениями по умолчанию и проверяет их.
+    ValueError, если формат, уровень коррекции или размеры недопустимы.
+    """
+    result = dict(DEFAULT_OPTIONS)
+    result.update((name, value) for name, value in options.items() if value is not None)
+    if result['format'] not in MIMETYPES:
+        raise ValueError(f"Неизвестный формат QR-кода: {result['format']}")
+    result['error_correction'] = str(result['error_correction']).upper()
+    if result['error_correction'] not in ERROR_CORRECTION_LEVELS:
+        raise ValueError(f"Неизвестный уровень коррекции ошибок: {result['error_correction']}")
+    result['box_size'], result['border'] = int(result['box_size']), int(result['border'])
+    if not 1 <= result['box_size'] <= MAX_BOX_SIZE or not 0 <= result['border'] <= MAX_BORDER:
+        raise ValueError("Недопустимый размер модуля или поля QR-кода.")
+    result['compact'] = bool(result['compact'])
+    return result
+
+
+def parse_options(args) -> dict:
+    """
+    Параметры отрисовки из строки запроса: format, ec, box, border, compact.
+    Отсутствующие параметры не передаются (берутся значения по умолчанию).
+    """
+    options = {
+        'format': args.get('format'),
+        'error_correction': args.get('ec'),
+        'box_size': args.get('box'),
+        'border': args.get('border'),
+        'compact': args.get('compact') in ('1', 'true', 'on') if 'compact' in args else None,
+    }
+    return {name: value for name, value in normalize_options(options).items() if options[name] is not None}
+
+
+def make_qr(data, error_correction='M', box_size=10, border=4) -> qrcode.QRCode:
+    """Кодирует данные в QR-код минимальной подходящей версии."""
+    qr = qrcode.QRCode(
+        error_correction=ERROR_CORRECTION_LEVELS[error_correction],
+        box_size=box_size, border=border
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+def _render_svg(qr) -> bytes:
+    """
+    SVG в координатах модулей: каждая горизонтальная серия темных модулей —
+    один прямоугольник общего <path>. Файл меньше PNG и не требует растеризации.
+    """
+    matrix = qr.get_matrix()  # уже с полем border
+    size = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if row[x]:
+                start = x
+                while x < size and row[x]:
+                    x += 1
+                runs.append(f"M{start} {y}h{x - start}v1H{start}z")
+            else:
+                x += 1
+    pixels = size * qr.box_size
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{"".join(runs)}"/></svg>'
+    ).encode('ascii')
+
+
+def render(url, format='png', box_size=10, border=4, error_correction='M') -> bytes:
+    """Кодирует URL в QR-код и возвращает PNG или SVG."""
+    if format not in MIMETYPES:
+        raise ValueError(f"Неизвестный формат QR-кода: {format}")
+    qr = make_qr(url, error_correction, box_size, border)
+    if format == 'svg':
+        return _render_svg(qr)
+    buffer = BytesIO()
+    qr.make_image().save(buffer, format='PNG')
+    return buffer.getvalue()
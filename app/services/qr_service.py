@@ -0,0 +1,280 @@
+# app/services/qr_service.py
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from importlib.metadata import version
+
+from flask import current_app, has_app_context
+
+from app.services import qr_engine, render_pool
+from app.services.qr_engine import MIMETYPES
+
+DEFAULT_CACHE_SIZE = 2048
+# Сколько кодов отдавать процессу пула за одну передачу
+RENDER_CHUNK_SIZE = 64
+# Сколько кодов держать в памяти одновременно при потоковой выдаче (iter_images)
+RENDER_BATCH_SIZE = 256
+
+# Версия библиотеки входит в ключ: после обновления qrcode картинки перерисуются
+_QRCODE_VERSION = version('qrcode')
+
+QRImage = namedtuple('QRImage', ['data', 'etag', 'mimetype'])
+
+
+class QRCache:
+    """
+    Кэш готовых QR-кодов по ключу содержимого: LRU в памяти процесса
+    и необязательное хранилище на диске (переживает перезапуск).
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE, folder=None):
+        self.max_entries = max_entries
+        self.folder = folder
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.bin")
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+        if self.folder:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    data = f.read()
+                # Время изменения — время последнего использования: purge удаляет давно не нужные коды
+                os.utime(self._path(key))
+            except FileNotFoundError:
+                return None
+            self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        self._remember(key, data)
+        if self.folder:
+            # Пишем во временный файл и атомарно переименовываем,
+            # чтобы параллельный запрос не прочитал недописанный файл
+            tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+
+    def _remember(self, key, data):
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def purge_disk_cache(folder, max_age=None) -> int:
+    """
+    Удаляет файлы дискового кэша QR-кодов из folder: все или, если задан max_age
+    (timedelta), не использованные дольше этого срока. Недописанные временные
+    файлы удаляются так же. Возвращает число удаленных файлов.
+    """
+    if not folder or not os.path.isdir(folder):
+        return 0
+    cutoff = time.time() - max_age.total_seconds() if max_age is not None else None
+    removed = 0
+    for entry in os.scandir(folder):
+        if not entry.is_file() or not entry.name.endswith(('.bin', '.tmp')):
+            continue
+        try:
+            if cutoff is not None and entry.stat().st_mtime >= cutoff:
+                continue
+            os.remove(entry.path)
+        except FileNotFoundError:
+            continue  # удален параллельно
+        removed += 1
+    return removed
+
+
+# Кэш для вызовов вне контекста приложения (скрипты, тесты сервисов)
+_default_cache = QRCache()
+
+
+def init_app(app):
+    """Создает кэш QR-кодов приложения по настройкам QR_CACHE_SIZE и QR_CACHE_FOLDER."""
+    app.extensions['qr_cache'] = QRCache(
+        max_entries=app.config.get('QR_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+        folder=app.config.get('QR_CACHE_FOLDER')
+    )
+
+
+def _get_cache():
+    if has_app_context():
+        return current_app.extensions.get('qr_cache', _default_cache)
+    return _default_cache
+
+
+def scan_url(part_id, compact=False) -> str:
+    """URL, который зашивается в QR-код: страница сканирования или компактный /S/<токен>."""
+    if has_app_context():
+        host, port = current_app.config['SERVER_PUBLIC_IP'], current_app.config['SERVER_PORT']
+    else:
+        host, port = os.environ.get('SERVER_PUBLIC_IP', '127.0.0.1'), os.environ.get('SERVER_PORT', '5000')
+    return qr_engine.build_url(f"http://{host}:{port}", part_id, compact)
+
+
+def cache_key(url, options) -> str:
+    """Ключ содержимого: хэш данных кода, параметров отрисовки и версии qrcode."""
+    payload = json.dumps([_QRCODE_VERSION, url, sorted(options.items())], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def resolve_options(overrides):
+    """Параметры отрисовки: значения по умолчанию из конфигурации (QR_*) и явные переопределения."""
+    options = {}
+    if has_app_context():
+        options.update(
+            error_correction=current_app.config.get('QR_ERROR_CORRECTION'),
+            box_size=current_app.config.get('QR_BOX_SIZE'),
+            compact=current_app.config.get('QR_COMPACT_URLS'),
+        )
+    options.update((name, value) for name, value in overrides.items() if value is not None)
+    return qr_engine.normalize_options(options)
+
+
+def _job(part_id, options):
+    """Задание на отрисовку (ключ, url, параметры отрисовки) для уже нормализованных options."""
+    url = scan_url(part_id, options['compact'])
+    render_options = {name: value for name, value in options.items() if name != 'compact'}
+    return cache_key(url, render_options), url, render_options
+
+
+def etag_for(part_id, **options) -> str:
+    """
+    Сильный ETag QR-кода детали. Вычисляется без отрисовки,
+    поэтому ответ 304 не требует ни кодирования, ни чтения кэша.
+    """
+    return _job(part_id, resolve_options(options))[0]
+
+
+def get_qr(part_id, **options) -> QRImage:
+    """
+    Возвращает QR-код детали: из кэша, а при промахе рисует и кэширует.
+    Параметры (format, box_size, border, error_correction, compact) входят в ключ кэша.
+    """
+    key, url, render_options = _job(part_id, resolve_options(options))
+    cache = _get_cache()
+    data = cache.get(key)
+    if data is None:
+        data = qr_engine.render(url, **render_options)
+        cache.put(key, data)
+    return QRImage(data, key, MIMETYPES[render_options['format']])
+
+
+def _render_task(args):
+    url, options = args
+    return qr_engine.render(url, **options)
+
+
+def _render_missing(cache, pending, workers):
+    """Рисует коды pending [(ключ, url, параметры)], кладет их в cache и возвращает {ключ: данные}."""
+    if workers > 1 and len(pending) > 1:
+        tasks = [(url, options) for _, url, options in pending]
+        images = render_pool.get_pool(workers).map(_render_task, tasks, chunksize=RENDER_CHUNK_SIZE)
+    else:
+        images = (qr_engine.render(url, **options) for _, url, options in pending)
+    rendered = {}
+    for (key, _, _), data in zip(pending, images):
+        cache.put(key, data)
+        rendered[key] = data
+    return rendered
+
+
+def _pending(part_ids, options):
+    """Задания на отрисовку [(ключ, url, параметры)] в порядке деталей."""
+    options = resolve_options(options)
+    return [_job(part_id, options) for part_id in part_ids]
+
+
+def _prewarm_pending(cache, pending, workers):
+    missing = [item for item in pending if cache.get(item[0]) is None]
+    return len(_render_missing(cache, missing, workers)) if missing else 0
+
+
+def prewarm(part_ids, workers=None, **options) -> int:
+    """
+    Заранее рисует QR-коды деталей, которых еще нет в кэше, пачкой в пуле
+    процессов (RENDER_WORKERS). Возвращает количество нарисованных кодов.
+    """
+    if workers is None:
+        workers = render_pool.configured_workers()
+    return _prewarm_pending(_get_cache(), _pending(dict.fromkeys(part_ids), options), workers)
+
+
+def prewarm_in_background(part_ids, **options):
+    """
+    То же, что prewarm, но проверка кэша и отрисовка идут фоновой задачей, не задерживая
+    ответ. Картинку, запрошенную раньше, браузер получит обычным путем через get_qr.
+    """
+    from app import socketio
+
+    socketio.start_background_task(
+        _prewarm_pending, _get_cache(), _pending(dict.fromkeys(part_ids), options),
+        render_pool.configured_workers()
+    )
+
+
+def iter_images(part_ids, workers=None, batch_size=RENDER_BATCH_SIZE, **options):
+    """
+    Выдает (part_id, QRImage) по порядку part_ids для потоковой выгрузки.
+    Коды обрабатываются пачками по batch_size: промахи кэша каждой пачки
+    рисуются в пуле процессов, поэтому в памяти одновременно не больше одной пачки.
+    """
+    if workers is None:
+        workers = render_pool.configured_workers()
+    cache = _get_cache()
+    part_ids = list(part_ids)
+    for start in range(0, len(part_ids), batch_size):
+        batch_ids = part_ids[start:start + batch_size]
+        pending = _pending(batch_ids, options)
+        # Пачка держится в словаре, чтобы не зависеть от вытеснения из LRU-кэша
+        images = {key: cache.get(key) for key, _, _ in pending}
+        missing = [item for item in pending if images[item[0]] is None]
+        if missing:
+            images.update(_render_missing(cache, missing, workers))
+        for part_id, (key, _, item_options) in zip(batch_ids, pending):
+            yield part_id, QRImage(images[key], key, MIMETYPES[item_options['format']])
+
+
+def benchmark(part_id, count=200):
+    """
+    Замеряет генерацию QR-кода детали во всех сочетаниях формата, компактного URL
+    и уровня коррекции ошибок, минуя кэш. Возвращает строки отчета:
+    [{'format', 'compact', 'error_correction', 'version', 'ms', 'bytes'}].
+    """
+    results = []
+    for format in qr_engine.MIMETYPES:
+        for compact in (False, True):
+            url = scan_url(part_id, compact)
+            for error_correction in qr_engine.ERROR_CORRECTION_LEVELS:
+                started = time.perf_counter()
+                for _ in range(count):
+                    data = qr_engine.render(url, format=format, error_correction=error_correction)
+                elapsed = time.perf_counter() - started
+                results.append({
+                    'format': format, 'compact': compact, 'error_correction': error_correction,
+                    'version': qr_engine.make_qr(url, error_correction).version,
+                    'ms': elapsed * 1000 / count, 'bytes': len(data),
+                })
+    return results
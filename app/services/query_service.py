@@ -1,76 +1,97 @@
 # app/services/query_service.py (ФИНАЛЬНАЯ ПОЛНАЯ ВЕРСИЯ С ЯВНЫМИ ИМЕНАМИ КОЛОНОК)
 
-from sqlalchemy import union_all, literal_column, cast, String
-from app.models.models import db, Part, StatusHistory, AuditLog, PartNote, User, Stage, ResponsibleHistory
+import base64
+import json
+import operator
+from datetime import datetime
 
-def get_combined_history(part):
+from sqlalchemy import union_all, literal_column, literal, cast, String, func, or_, and_
+from sqlalchemy.orm import joinedload
+from app.models.models import (db, Part, StatusHistory, AuditLog, PartNote, User, Stage, ResponsibleHistory,
+                               RouteTemplate, RouteStage)
+from app.services.sql_utils import payload_conditions
+
+# --- Лента истории детали (keyset-пагинация по нескольким таблицам) ---
+
+HISTORY_PAGE_DEFAULT_LIMIT = 50
+HISTORY_PAGE_MAX_LIMIT = 200
+
+# Действия с примечаниями показываются самими примечаниями, а не записями аудита
+NOTE_AUDIT_ACTIONS = ['Добавлено примечание', 'Изменено примечание', 'Удалено примечание']
+
+
+def _history_branches(part_id):
+    """
+    Ветви ленты истории: (тип записи, модель, запрос). Колонки у всех ветвей
+    одинаковые, чтобы их можно было объединить через UNION ALL.
+    """
+    return [
+        ('status', StatusHistory, db.session.query(
+            StatusHistory.id.label("id"),
+            StatusHistory.timestamp.label("timestamp"),
+            literal_column("'status'").label("type"),
+            StatusHistory.status.label("col1"),
+            StatusHistory.operator_name.label("col2"),
+            cast(StatusHistory.quantity, String).label("col3"),
+            literal_column("NULL", type_=db.Integer).label("user_id")
+        ).filter(StatusHistory.part_id == part_id)),
+        ('audit', AuditLog, db.session.query(
+            AuditLog.id.label("id"),
+            AuditLog.timestamp.label("timestamp"),
+            literal_column("'audit'").label("type"),
+            AuditLog.action.label("col1"),
+            AuditLog.details.label("col2"),
+            literal_column("NULL").label("col3"),
+            AuditLog.user_id
+        ).filter(AuditLog.part_id == part_id, AuditLog.action.notin_(NOTE_AUDIT_ACTIONS))),
+        ('note', PartNote, db.session.query(
+            PartNote.id.label("id"),
+            PartNote.timestamp.label("timestamp"),
+            literal_column("'note'").label("type"),
+            PartNote.text.label("col1"),
+            cast(PartNote.stage_id, String).label("col2"),
+            literal_column("NULL").label("col3"),
+            PartNote.user_id
+        ).filter(PartNote.part_id == part_id)),
+        ('responsible', ResponsibleHistory, db.session.query(
+            ResponsibleHistory.id.label("id"),
+            ResponsibleHistory.timestamp.label("timestamp"),
+            literal_column("'responsible'").label("type"),
+            literal_column("NULL").label("col1"),
+            literal_column("NULL").label("col2"),
+            literal_column("NULL").label("col3"),
+            ResponsibleHistory.user_id
+        ).filter(ResponsibleHistory.part_id == part_id)),
+    ]
+
+
+def _history_keyset_condition(entry_type, model, last_timestamp, last_type, last_id):
     """
-    Получает объединенную и отсортированную историю для одной детали
-    единым эффективным запросом с использованием UNION ALL.
+    Условие «строго раньше курсора» по ключу (timestamp, type, id) для одной ветви.
+    Тип у ветви постоянный, поэтому сравнение типов выполняется здесь, а в SQL
+    остается только условие по (timestamp, id), которое обслуживает индекс (part_id, timestamp).
     """
-    
-    # Запрос 1: История статусов
-    status_query = db.session.query(
-        StatusHistory.id.label("id"),
-        StatusHistory.timestamp.label("timestamp"),
-        literal_column("'status'").label("type"),
-        StatusHistory.status.label("col1"),
-        StatusHistory.operator_name.label("col2"),
-        cast(StatusHistory.quantity, String).label("col3"),
-        literal_column("NULL", type_=db.Integer).label("user_id")
-    ).filter(StatusHistory.part_id == part.part_id)
-
-    # Запрос 2: Логи аудита
-    audit_query = db.session.query(
-        AuditLog.id.label("id"),
-        AuditLog.timestamp.label("timestamp"),
-        literal_column("'audit'").label("type"),
-        AuditLog.action.label("col1"),
-        AuditLog.details.label("col2"),
-        literal_column("NULL").label("col3"),
-        AuditLog.user_id
-    ).filter(
-        AuditLog.part_id == part.part_id,
-        AuditLog.action.notin_(['Добавлено примечание', 'Изменено примечание', 'Удалено примечание'])
+    if entry_type < last_type:
+        return model.timestamp <= last_timestamp
+    if entry_type > last_type:
+        return model.timestamp < last_timestamp
+    return or_(
+        model.timestamp < last_timestamp,
+        and_(model.timestamp == last_timestamp, model.id < last_id)
     )
 
-    # Запрос 3: Примечания
-    notes_query = db.session.query(
-        PartNote.id.label("id"),
-        PartNote.timestamp.label("timestamp"),
-        literal_column("'note'").label("type"),
-        PartNote.text.label("col1"),
-        cast(PartNote.stage_id, String).label("col2"),
-        literal_column("NULL").label("col3"),
-        PartNote.user_id
-    ).filter(PartNote.part_id == part.part_id)
-    
-    # Запрос 4: История смены ответственных
-    resp_query = db.session.query(
-        ResponsibleHistory.id.label("id"),
-        ResponsibleHistory.timestamp.label("timestamp"),
-        literal_column("'responsible'").label("type"),
-        literal_column("NULL").label("col1"),
-        literal_column("NULL").label("col2"),
-        literal_column("NULL").label("col3"),
-        ResponsibleHistory.user_id
-    ).filter(ResponsibleHistory.part_id == part.part_id)
-    
-    # Объединяем все четыре запроса
-    combined_query = union_all(status_query, audit_query, notes_query, resp_query).alias("combined_history")
-    
-    # Финальный запрос для сортировки
-    final_query = db.session.query(combined_query).order_by(combined_query.c.timestamp.desc())
-
-    results = final_query.all()
-    user_ids = {row.user_id for row in results if row.user_id}
-    stage_ids_from_notes = {int(row.col2) for row in results if row.type == 'note' and row.col2}
-
-    users_map = {u.id: u for u in db.session.query(User).filter(User.id.in_(user_ids))}
-    stages_map = {s.id: s for s in db.session.query(Stage).filter(Stage.id.in_(stage_ids_from_notes))}
+
+def history_entries(rows):
+    """Преобразует строки ленты в словари для шаблона, подгружая пользователей и этапы пачкой."""
+    user_ids = {row.user_id for row in rows if row.user_id}
+    stage_ids_from_notes = {int(row.col2) for row in rows if row.type == 'note' and row.col2}
+
+    users_map = {u.id: u for u in db.session.query(User).filter(User.id.in_(user_ids))} if user_ids else {}
+    stages_map = ({s.id: s for s in db.session.query(Stage).filter(Stage.id.in_(stage_ids_from_notes))}
+                  if stage_ids_from_notes else {})
 
     history_list = []
-    for row in results:
+    for row in rows:
         entry = {
             'id': row.id,
             'timestamp': row.timestamp,
@@ -96,4 +117,268 @@ def get_combined_history(part):
         
         history_list.append(entry)
         
-    return history_list
\ No newline at end of file
+    return history_list
+
+
+def get_history_page(part_id, cursor=None, limit=None, payload=None):
+    """
+    Возвращает одну страницу объединенной истории детали (статусы, аудит,
+    примечания, смена ответственных) от новых записей к старым.
+
+    Ключ пагинации — (timestamp, type, id). LIMIT применяется в каждой ветви
+    UNION ALL отдельно, поэтому любая страница читает не больше limit + 1 строк
+    из каждой таблицы по индексу (part_id, timestamp), независимо от длины истории.
+    С фильтром payload (например, {'event': 'route_changed'}) лента состоит только
+    из записей аудита с такими значениями ключей.
+
+    :return: (entries, next_cursor) — next_cursor равен None на последней странице.
+    """
+    limit = max(1, min(limit or HISTORY_PAGE_DEFAULT_LIMIT, HISTORY_PAGE_MAX_LIMIT))
+    keyset = None
+    if cursor is not None:
+        try:
+            last_timestamp, last_type, last_id = decode_cursor(cursor)
+            keyset = (datetime.fromisoformat(last_timestamp), str(last_type), int(last_id))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Некорректный курсор: {e}")
+
+    history_branches = _history_branches(part_id)
+    if payload:
+        conditions = payload_conditions(AuditLog.payload, payload)
+        history_branches = [
+            (entry_type, model, query.filter(*conditions))
+            for entry_type, model, query in history_branches if entry_type == 'audit'
+        ]
+
+    branches = []
+    for entry_type, model, query in history_branches:
+        if keyset is not None:
+            query = query.filter(_history_keyset_condition(entry_type, model, *keyset))
+        # Каждая ветвь — отдельный подзапрос: SQLite не допускает LIMIT внутри UNION ALL напрямую
+        branch = query.order_by(model.timestamp.desc(), model.id.desc()).limit(limit + 1).subquery()
+        branches.append(db.select(branch))
+
+    combined = (union_all(*branches) if len(branches) > 1 else branches[0]).subquery("combined_history")
+    rows = db.session.execute(
+        db.select(combined)
+        .order_by(combined.c.timestamp.desc(), combined.c.type.desc(), combined.c.id.desc())
+        .limit(limit + 1)
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([last.timestamp, last.type, last.id])
+
+    return history_entries(rows), next_cursor
+
+
+def serialize_history_entry(entry):
+    """Преобразует запись ленты из get_history_page в JSON-совместимый словарь."""
+    data = {key: value for key, value in entry.items() if key not in ('user', 'author', 'stage')}
+    data['timestamp'] = entry['timestamp'].isoformat() if entry['timestamp'] else None
+    for key in ('user', 'author'):
+        if key in entry:
+            data[key] = entry[key].username if entry[key] else None
+    if 'stage' in entry:
+        data['stage'] = entry['stage'].name if entry['stage'] else None
+    return data
+
+# --- Постраничная выдача деталей изделия (keyset-пагинация) ---
+
+PARTS_PAGE_DEFAULT_LIMIT = 100
+PARTS_PAGE_MAX_LIMIT = 500
+
+PARTS_SORT_COLUMNS = {
+    'part_id': Part.part_id,
+    'name': Part.name,
+    'material': Part.material,
+    'status': Part.current_status,
+    'date_added': Part.date_added,
+}
+
+
+def encode_cursor(values) -> str:
+    """Упаковывает значения ключа последней строки в непрозрачный курсор."""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> list:
+    """Распаковывает курсор. Вызывает ValueError, если курсор поврежден."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Некорректный курсор: {e}")
+
+
+def _parts_filter_conditions(product_designation, filters):
+    conditions = [
+        Part.product_designation == product_designation,
+        Part.parent_id.is_(None)
+    ]
+    if filters.get('status'):
+        conditions.append(Part.current_status == filters['status'])
+    if filters.get('responsible'):
+        if filters['responsible'] == 'none':
+            conditions.append(Part.responsible_id.is_(None))
+        elif filters['responsible'].isdigit():
+            conditions.append(Part.responsible_id == int(filters['responsible']))
+        else:
+            raise ValueError(f"Некорректный фильтр ответственного: '{filters['responsible']}'.")
+    # Подстроки ищутся буквально: % и _ из запроса экранируются (autoescape)
+    if filters.get('material'):
+        conditions.append(Part.material.icontains(filters['material'], autoescape=True))
+    if filters.get('q'):
+        conditions.append(or_(Part.part_id.icontains(filters['q'], autoescape=True),
+                              Part.name.icontains(filters['q'], autoescape=True)))
+    return conditions
+
+
+def get_parts_page(product_designation, filters=None, sort='part_id', descending=False,
+                   cursor=None, limit=PARTS_PAGE_DEFAULT_LIMIT):
+    """
+    Возвращает одну страницу корневых деталей изделия с keyset-пагинацией.
+
+    Ключ пагинации — (поле сортировки, part_id), поэтому стоимость страницы
+    не зависит от ее номера. Детали без значения поля сортировки (NULL) идут
+    в конце при любом направлении. Общее количество считается только для первой
+    страницы отдельным агрегатом без JOIN'ов.
+
+    :return: (parts, next_cursor, total) — total равен None для последующих страниц.
+    """
+    filters = filters or {}
+    if sort not in PARTS_SORT_COLUMNS:
+        raise ValueError(f"Недопустимое поле сортировки: {sort}")
+    limit = max(1, min(limit or PARTS_PAGE_DEFAULT_LIMIT, PARTS_PAGE_MAX_LIMIT))
+    sort_column = PARTS_SORT_COLUMNS[sort]
+    conditions = _parts_filter_conditions(product_designation, filters)
+
+    total = None
+    if cursor is None:
+        total = db.session.query(func.count(Part.part_id)).filter(*conditions).scalar()
+
+    query = Part.query.options(
+        joinedload(Part.route_template).selectinload(RouteTemplate.stages).joinedload(RouteStage.stage),
+        joinedload(Part.responsible)
+    ).filter(*conditions)
+
+    if cursor is not None:
+        try:
+            last_value, last_part_id = decode_cursor(cursor)
+            if isinstance(sort_column.type, db.DateTime) and last_value is not None:
+                last_value = datetime.fromisoformat(last_value)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Некорректный курсор: {e}")
+        compare = operator.lt if descending else operator.gt
+        if sort == 'part_id':
+            query = query.filter(compare(Part.part_id, last_part_id))
+        elif last_value is None:
+            # Курсор уже среди деталей без значения: дальше только они, по part_id
+            query = query.filter(sort_column.is_(None), compare(Part.part_id, last_part_id))
+        else:
+            query = query.filter(or_(
+                compare(sort_column, last_value),
+                and_(sort_column == last_value, compare(Part.part_id, last_part_id)),
+                sort_column.is_(None)
+            ))
+
+    if descending:
+        query = query.order_by(sort_column.desc().nulls_last(), Part.part_id.desc())
+    else:
+        query = query.order_by(sort_column.asc().nulls_last(), Part.part_id.asc())
+
+    parts = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(parts) > limit:
+        parts = parts[:limit]
+        last = parts[-1]
+        next_cursor = encode_cursor([getattr(last, sort_column.key), last.part_id])
+
+    return parts, next_cursor, total
+
+
+# --- Загрузка состава изделия одним рекурсивным запросом ---
+
+# Защита от зацикливания рекурсии при поврежденных данных (parent_id по кругу)
+PART_TREE_MAX_DEPTH = 100
+
+
+def get_part_subtree(root_part_id):
+    """
+    Загружает все поддерево состава детали одним запросом WITH RECURSIVE
+    и собирает его в памяти.
+
+    Каждый узел — словарь с основными полями детали, а также 'depth'
+    (глубина относительно корня), 'children' (список узлов, отсортированный
+    по наименованию), 'child_count' и 'descendant_count'.
+    Возвращает корневой узел или None, если деталь не найдена.
+    """
+    subtree = db.session.query(
+        Part.part_id.label('part_id'),
+        literal(0).label('depth')
+    ).filter(Part.part_id == root_part_id).cte('part_subtree', recursive=True)
+
+    subtree = subtree.union_all(
+        db.session.query(
+            Part.part_id,
+            subtree.c.depth + 1
+        ).join(subtree, Part.parent_id == subtree.c.part_id).filter(subtree.c.depth < PART_TREE_MAX_DEPTH)
+    )
+
+    rows = db.session.query(
+        Part.part_id, Part.parent_id, Part.name, Part.material,
+        Part.quantity_total, Part.quantity_completed, Part.current_status,
+        subtree.c.depth
+    ).join(subtree, Part.part_id == subtree.c.part_id).order_by(subtree.c.depth, Part.name).all()
+
+    nodes = {}
+    root = None
+    for row in rows:
+        node = {
+            'part_id': row.part_id,
+            'parent_id': row.parent_id,
+            'name': row.name,
+            'material': row.material,
+            'quantity_total': row.quantity_total,
+            'quantity_completed': row.quantity_completed,
+            'current_status': row.current_status,
+            'depth': row.depth,
+            'children': [],
+            'child_count': 0,
+            'descendant_count': 0
+        }
+        nodes[row.part_id] = node
+        if row.depth == 0:
+            root = node
+        elif row.parent_id in nodes:
+            # Строки упорядочены по глубине, поэтому родитель уже создан,
+            # а дети внутри уровня идут по наименованию.
+            parent = nodes[row.parent_id]
+            parent['children'].append(node)
+            parent['child_count'] += 1
+
+    # Количество всех потомков считаем снизу вверх (от самых глубоких узлов)
+    for node in sorted(nodes.values(), key=lambda n: n['depth'], reverse=True):
+        if node['depth'] > 0 and node['parent_id'] in nodes:
+            nodes[node['parent_id']]['descendant_count'] += node['descendant_count'] + 1
+
+    return root
+
+
+def serialize_part_tree(node):
+    """Преобразует дерево из get_part_subtree в JSON-совместимую структуру."""
+    return {
+        'part_id': node['part_id'],
+        'name': node['name'],
+        'material': node['material'],
+        'quantity_total': node['quantity_total'],
+        'quantity_completed': node['quantity_completed'],
+        'current_status': node['current_status'],
+        'depth': node['depth'],
+        'child_count': node['child_count'],
+        'descendant_count': node['descendant_count'],
+        'children': [serialize_part_tree(child) for child in node['children']]
+    }
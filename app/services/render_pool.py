@@ -0,0 +1,48 @@
+# app/services/render_pool.py
+
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app, has_app_context
+
+# Общий пул процессов для тяжелой отрисовки (QR-коды, этикетки, копии чертежей).
+# Создается при первом обращении; размер задает RENDER_WORKERS (по умолчанию 0 — без пула).
+# Под eventlet (gunicorn --worker-class eventlet, см. entrypoint.sh) служебные потоки
+# ProcessPoolExecutor становятся гринлетами monkey-patching, и пул может зависнуть,
+# поэтому он включается только явно — для синхронных воркеров или после проверки.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configured_workers() -> int:
+    """Число процессов из RENDER_WORKERS; 0 или 1 — рисовать в текущем процессе."""
+    return current_app.config.get('RENDER_WORKERS', 0) if has_app_context() else 0
+
+
+def get_pool(workers):
+    """Возвращает общий пул процессов, создавая его при первом обращении."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+
+def map_tasks(fn, *iterables, workers=None):
+    """Параллельный аналог встроенного map в пуле процессов; без пула — обычный map."""
+    if workers is None:
+        workers = configured_workers()
+    if workers > 1:
+        return get_pool(workers).map(fn, *iterables)
+    return map(fn, *iterables)
+
+
+def run(fn, *args, workers=None):
+    """
+    Выполняет fn(*args) в пуле процессов и ждет результат; без пула — в текущем процессе.
+    """
+    if workers is None:
+        workers = configured_workers()
+    if workers > 1:
+        return get_pool(workers).submit(fn, *args).result()
+    return fn(*args)
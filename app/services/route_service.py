@@ -0,0 +1,60 @@
+# app/services/route_service.py
+
+import hashlib
+
+from sqlalchemy import select
+
+from app import db
+from app.models.models import RouteTemplate, Stage
+
+# Мемо процесса: сигнатура операций -> ID маршрута. Сбрасывается при любом изменении
+# маршрутов в админ-панели (management_routes). Приложение работает одним процессом
+# eventlet, поэтому сброса в текущем процессе достаточно.
+_signature_memo = {}
+
+
+def operations_signature(stage_names) -> str:
+    """
+    Каноничная сигнатура маршрута: SHA-256 упорядоченного списка названий этапов
+    в нижнем регистре. Не зависит от названия маршрута и регистра в файле импорта.
+    """
+    key = '\x1f'.join(name.strip().lower() for name in stage_names)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def signature_for_stage_ids(stage_ids) -> str:
+    """Сигнатура для маршрута из формы (упорядоченный список ID этапов), одним запросом."""
+    stage_ids = list(stage_ids)
+    names = dict(db.session.execute(select(Stage.id, Stage.name).where(Stage.id.in_(stage_ids))).all())
+    return operations_signature(names[stage_id] for stage_id in stage_ids)
+
+
+def find_route_ids(signatures) -> dict:
+    """
+    Возвращает {сигнатура: route_id} для известных сигнатур: сначала из мемо,
+    остальные — одним запросом по индексу RouteTemplates.operations_signature.
+    """
+    signatures = set(signatures)
+    found = {sig: _signature_memo[sig] for sig in signatures if sig in _signature_memo}
+    missing = signatures - found.keys()
+    if missing:
+        rows = db.session.execute(
+            select(RouteTemplate.operations_signature, RouteTemplate.id)
+            .where(RouteTemplate.operations_signature.in_(missing))
+            .order_by(RouteTemplate.id)
+        )
+        for signature, route_id in rows:
+            found.setdefault(signature, route_id)
+        _signature_memo.update((sig, found[sig]) for sig in missing if sig in found)
+    return found
+
+
+def remember(signature, route_id):
+    """Запоминает только что созданный маршрут в мемо процесса."""
+    _signature_memo[signature] = route_id
+
+
+def invalidate_memo():
+    """Сбрасывает мемо сигнатур (после создания, изменения или удаления маршрута)."""
+    _signature_memo.clear()
+
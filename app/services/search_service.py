@@ -0,0 +1,217 @@
+# app/services/search_service.py
+
+import re
+
+from sqlalchemy import DDL, Float, String, and_, cast, column, event, func, literal_column, or_, select, table, union_all
+
+from app import db
+from app.models.models import AuditLog, PartNote
+from app.services.query_service import NOTE_AUDIT_ACTIONS, history_entries, decode_cursor, encode_cursor
+from app.services.sql_utils import payload_conditions
+
+SEARCH_PAGE_DEFAULT_LIMIT = 20
+SEARCH_PAGE_MAX_LIMIT = 100
+# Где искать: записи журнала аудита и примечания к деталям (типы записей ленты истории)
+SCOPES = ('audit', 'note')
+
+# Документы PostgreSQL: выражения совпадают с GIN-индексами ix_AuditLogs_search и ix_PartNotes_search
+# (миграция e4a9c2d71b56), иначе планировщик не использует индекс
+_PG_DOCUMENTS = {
+    'audit': "to_tsvector('russian', \"AuditLogs\".action || ' ' || coalesce(\"AuditLogs\".details, ''))",
+    'note': "to_tsvector('russian', \"PartNotes\".text)",
+}
+
+# Зеркало для SQLite: таблицы FTS5 с внешним содержимым (content=) над AuditLogs и PartNotes,
+# синхронизируются триггерами. Создаются миграцией e4a9c2d71b56 и при db.create_all()
+_SQLITE_TABLES = {'audit': 'audit_search', 'note': 'note_search'}
+SQLITE_MIRROR_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS audit_search USING fts5("
+    "action, details, content='AuditLogs', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    'CREATE TRIGGER IF NOT EXISTS audit_search_ai AFTER INSERT ON "AuditLogs" BEGIN '
+    "INSERT INTO audit_search(rowid, action, details) VALUES (new.id, new.action, new.details); END",
+    'CREATE TRIGGER IF NOT EXISTS audit_search_ad AFTER DELETE ON "AuditLogs" BEGIN '
+    "INSERT INTO audit_search(audit_search, rowid, action, details) "
+    "VALUES ('delete', old.id, old.action, old.details); END",
+    'CREATE TRIGGER IF NOT EXISTS audit_search_au AFTER UPDATE OF action, details ON "AuditLogs" BEGIN '
+    "INSERT INTO audit_search(audit_search, rowid, action, details) "
+    "VALUES ('delete', old.id, old.action, old.details); "
+    "INSERT INTO audit_search(rowid, action, details) VALUES (new.id, new.action, new.details); END",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS note_search USING fts5("
+    "text, content='PartNotes', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    'CREATE TRIGGER IF NOT EXISTS note_search_ai AFTER INSERT ON "PartNotes" BEGIN '
+    "INSERT INTO note_search(rowid, text) VALUES (new.id, new.text); END",
+    'CREATE TRIGGER IF NOT EXISTS note_search_ad AFTER DELETE ON "PartNotes" BEGIN '
+    "INSERT INTO note_search(note_search, rowid, text) VALUES ('delete', old.id, old.text); END",
+    'CREATE TRIGGER IF NOT EXISTS note_search_au AFTER UPDATE OF text ON "PartNotes" BEGIN '
+    "INSERT INTO note_search(note_search, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO note_search(rowid, text) VALUES (new.id, new.text); END",
+]
+# Триггеры к этому моменту удалены вместе с AuditLogs и PartNotes (db.drop_all())
+SQLITE_MIRROR_DROP = ['DROP TABLE IF EXISTS audit_search', 'DROP TABLE IF EXISTS note_search']
+
+for _statement in SQLITE_MIRROR_DDL:
+    event.listen(db.metadata, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+for _statement in SQLITE_MIRROR_DROP:
+    event.listen(db.metadata, 'after_drop', DDL(_statement).execute_if(dialect='sqlite'))
+
+_WORD_RE = re.compile(r'\w+')
+# Окончания русских слов, от длинных к коротким: FTS5 не знает русской морфологии,
+# поэтому в SQLite слово запроса ищется по основе как по префиксу ("сверловки" -> "сверловк"*)
+_RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'иях', 'ией',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю', 'ов', 'ев',
+    'ах', 'ях', 'ам', 'ям', 'ом', 'ем', 'ия', 'ию', 'ью',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+_MIN_STEM_LENGTH = 3
+
+
+def _stem(word):
+    for ending in _RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def fts_query(query) -> str:
+    """
+    Запрос FTS5 из строки пользователя: все слова обязательны, каждое ищется по основе
+    как по префиксу. Операторы FTS5 из строки не проходят — берутся только слова.
+    """
+    terms = [_stem(word) for word in _WORD_RE.findall(query.lower())]
+    if not terms:
+        raise ValueError("Пустой поисковый запрос.")
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _columns(entry_type, model, col1, col2, rank):
+    # Колонки как у ветвей ленты истории (query_service), плюс деталь и релевантность
+    return [
+        model.id.label('id'),
+        model.timestamp.label('timestamp'),
+        literal_column(f"'{entry_type}'").label('type'),
+        col1.label('col1'),
+        col2.label('col2'),
+        literal_column('NULL').label('col3'),
+        model.user_id.label('user_id'),
+        model.part_id.label('part_id'),
+        rank.label('rank'),
+    ]
+
+
+def _branch(dialect, entry_type, query, conditions):
+    """Запрос одной области поиска: совпадения с рангом (чем больше, тем релевантнее)."""
+    model = AuditLog if entry_type == 'audit' else PartNote
+    col1, col2 = (AuditLog.action, AuditLog.details) if entry_type == 'audit' else (
+        PartNote.text, cast(PartNote.stage_id, String))
+
+    if dialect == 'postgresql':
+        document = literal_column(_PG_DOCUMENTS[entry_type])
+        tsquery = func.websearch_to_tsquery(literal_column("'russian'"), query)
+        rank = cast(func.ts_rank_cd(document, tsquery), Float)
+        return select(*_columns(entry_type, model, col1, col2, rank)).where(
+            document.op('@@')(tsquery), *conditions
+        )
+
+    fts_table = _SQLITE_TABLES[entry_type]
+    # bm25() в FTS5 тем меньше, чем релевантнее совпадение
+    rank = -func.bm25(literal_column(fts_table))
+    return (
+        select(*_columns(entry_type, model, col1, col2, rank))
+        .select_from(table(fts_table, column('rowid')))
+        .join(model, model.id == literal_column(f'{fts_table}.rowid'))
+        .where(literal_column(fts_table).op('MATCH')(fts_query(query)), *conditions)
+    )
+
+
+def _keyset_condition(results, last_rank, last_type, last_id):
+    """Условие «строго после курсора» по ключу сортировки (rank desc, type desc, id desc)."""
+    return or_(
+        results.c.rank < last_rank,
+        and_(results.c.rank == last_rank, or_(
+            results.c.type < last_type,
+            and_(results.c.type == last_type, results.c.id < last_id)
+        ))
+    )
+
+
+def search(query, scopes=SCOPES, categories=None, part_id=None, payload=None, cursor=None, limit=None):
+    """
+    Полнотекстовый поиск по журналу аудита (action и details) и примечаниям к деталям.
+    В PostgreSQL — tsvector с русской морфологией по GIN-индексам выражений,
+    в SQLite — зеркало FTS5 с поиском слов по основе.
+
+    categories и payload ограничивают записи журнала (как на страницах журнала),
+    part_id — обе области. Результаты упорядочены по убыванию релевантности; ключ
+    пагинации — (rank, type, id), поэтому страницы не пересекаются и не требуют OFFSET.
+
+    :return: (entries, next_cursor) — записи в формате ленты истории
+             (query_service.get_history_page) с дополнительными 'part_id' и 'rank'.
+    :raises ValueError: пустой запрос, неизвестная область или некорректный курсор.
+    """
+    query = (query or '').strip()
+    if not query:
+        raise ValueError("Пустой поисковый запрос.")
+    unknown = set(scopes) - set(SCOPES)
+    if unknown or not scopes:
+        raise ValueError(f"Неизвестная область поиска: {', '.join(sorted(unknown)) or '—'}")
+    limit = max(1, min(limit or SEARCH_PAGE_DEFAULT_LIMIT, SEARCH_PAGE_MAX_LIMIT))
+    keyset = None
+    if cursor is not None:
+        try:
+            last_rank, last_type, last_id = decode_cursor(cursor)
+            keyset = (float(last_rank), str(last_type), int(last_id))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Некорректный курсор: {e}")
+
+    dialect = db.session.get_bind().dialect.name
+    branches = []
+    if 'audit' in scopes:
+        conditions = payload_conditions(AuditLog.payload, payload)
+        if 'note' in scopes:
+            # Действия с примечаниями находятся самими примечаниями, как и в ленте истории
+            conditions.append(AuditLog.action.notin_(NOTE_AUDIT_ACTIONS))
+        if categories:
+            conditions.append(AuditLog.category.in_(categories))
+        if part_id:
+            conditions.append(AuditLog.part_id == part_id)
+        branches.append(_branch(dialect, 'audit', query, conditions))
+    if 'note' in scopes:
+        branches.append(_branch(dialect, 'note', query, [PartNote.part_id == part_id] if part_id else []))
+
+    results = (union_all(*branches) if len(branches) > 1 else branches[0]).subquery('search_results')
+    stmt = select(results)
+    if keyset is not None:
+        stmt = stmt.where(_keyset_condition(results, *keyset))
+    rows = db.session.execute(
+        stmt.order_by(results.c.rank.desc(), results.c.type.desc(), results.c.id.desc()).limit(limit + 1)
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([last.rank, last.type, last.id])
+
+    entries = history_entries(rows)
+    for entry, row in zip(entries, rows):
+        entry['part_id'] = row.part_id
+        entry['rank'] = row.rank
+    return entries, next_cursor
+
+
+def rebuild_index() -> bool:
+    """
+    Перестраивает зеркало FTS5 по текущему содержимому AuditLogs и PartNotes
+    (после восстановления БД из копии или пересоздания таблиц batch-миграцией,
+    при котором SQLite удаляет триггеры). В PostgreSQL индексы поддерживает сама СУБД:
+    возвращает False.
+    """
+    if db.session.get_bind().dialect.name != 'sqlite':
+        return False
+    for statement in SQLITE_MIRROR_DDL:
+        db.session.execute(db.text(statement))
+    for fts_table in _SQLITE_TABLES.values():
+        db.session.execute(db.text(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')"))
+    db.session.commit()
+    return True
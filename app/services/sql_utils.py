@@ -0,0 +1,120 @@
+# app/services/sql_utils.py
+
+import io
+import json
+import re
+from datetime import datetime
+
+from sqlalchemy import String, cast, func, insert, literal, literal_column
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+from app import db
+
+_JSON_KEY_RE = re.compile(r'[a-z_]+')
+
+
+def dialect_insert(model):
+    """
+    Возвращает INSERT диалекта текущей БД, поддерживающий ON CONFLICT
+    (on_conflict_do_nothing / on_conflict_do_update). Проект работает
+    с PostgreSQL в production и SQLite в разработке и тестах.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model)
+    if dialect == 'sqlite':
+        return sqlite.insert(model)
+    raise NotImplementedError(f"INSERT ... ON CONFLICT не поддерживается для СУБД '{dialect}'.")
+
+
+def _copy_value(value) -> str:
+    """Экранирует значение для COPY ... FROM STDIN в текстовом формате PostgreSQL."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def bulk_insert(model, rows):
+    """
+    Массово вставляет строки (список словарей с одинаковыми ключами).
+    На PostgreSQL используется COPY, на остальных СУБД — executemany-INSERT.
+    Выполняется в текущей транзакции сессии; коммит делает вызывающий код.
+    """
+    if not rows:
+        return
+    if db.session.get_bind().dialect.name != 'postgresql':
+        db.session.execute(insert(model), rows)
+        return
+
+    table = model.__table__
+    columns = list(rows[0].keys())
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(row[column]) for column in columns))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    dbapi_connection = db.session.connection().connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY "{table.name}" ({column_list}) FROM STDIN', buffer)
+
+
+class json_text(FunctionElement):
+    """
+    Значение ключа JSON-колонки как текст: (column ->> 'key') в PostgreSQL,
+    json_extract(column, '$.key') в остальных СУБД. Ключ подставляется в SQL литералом,
+    поэтому выражение в запросе совпадает с выражением индекса и индекс используется.
+    """
+    type = String()
+    name = 'json_text'
+    inherit_cache = True
+
+    def __init__(self, column, key):
+        if not _JSON_KEY_RE.fullmatch(key):
+            raise ValueError(f"Недопустимый ключ JSON: {key}")
+        super().__init__(column, literal_column(key))
+
+
+@compiles(json_text)
+def _json_text(element, compiler, **kw):
+    column, key = element.clauses
+    return f"json_extract({compiler.process(column, **kw)}, '$.{key.name}')"
+
+
+@compiles(json_text, 'postgresql')
+def _json_text_postgresql(element, compiler, **kw):
+    column, key = element.clauses
+    return f"({compiler.process(column, **kw)} ->> '{key.name}')"
+
+
+def payload_conditions(column, payload) -> list:
+    """
+    Условия WHERE по ключам JSON-колонки column (payload журнала аудита). Вид действия
+    (event) сравнивается выражением json_text, совпадающим с индексом (event, timestamp).
+    Остальные ключи в PostgreSQL проверяются одним column @> {...} по GIN-индексу
+    jsonb_path_ops, в других СУБД — json_extract.
+    """
+    payload = dict(payload or {})
+    conditions = []
+    event_name = payload.pop('event', None)
+    if event_name is not None:
+        conditions.append(json_text(column, 'event') == event_name)
+    if payload:
+        if db.session.get_bind().dialect.name == 'postgresql':
+            # Значение передается строкой JSON: так его можно подставить и литералом (EXPLAIN в estimate_count)
+            document = cast(literal(json.dumps(payload, ensure_ascii=False), String), JSONB)
+            conditions.append(column.op('@>')(document))
+        else:
+            conditions.extend(
+                func.json_extract(column, f'$.{key}') == value for key, value in payload.items()
+            )
+    return conditions
@@ -3,8 +3,9 @@
 // app/static/js/dashboard.js
 
 document.addEventListener('DOMContentLoaded', function() {
-    // Кэш для хранения уже загруженных данных о деталях
-    const detailsCache = {};
+    // Состояние постраничной загрузки для каждого раскрытого изделия
+    const productStates = {};
+    const PAGE_SIZE = 100;
     
     // Основные элементы DOM, с которыми будем работать
     const mainTable = document.getElementById('main-dashboard-table');
@@ -13,6 +14,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const bulkClearButton = document.getElementById('bulk-clear-selection');
     const bulkDeleteForm = document.getElementById('bulk-delete-form');
     const bulkPrintForm = document.getElementById('bulk-print-form');
+    const bulkExportForm = document.getElementById('bulk-export-form');
     const searchInput = document.getElementById('searchInput');
 
     function updateBulkActionsPanel() {
@@ -77,6 +79,15 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    if (bulkExportForm) {
+        bulkExportForm.addEventListener('submit', function(event) {
+            if (prepareFormForSubmit(bulkExportForm) === 0) {
+                event.preventDefault();
+                Swal.fire('Нет выбранных элементов', 'Пожалуйста, выберите хотя бы одну деталь для выгрузки.', 'info');
+            }
+        });
+    }
+
     if (bulkClearButton) {
         bulkClearButton.addEventListener('click', () => {
             mainTable.querySelectorAll('.part-checkbox:checked, .select-all-parts:checked').forEach(cb => cb.checked = false);
@@ -84,6 +95,150 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    function renderDetailsShell(safeKey) {
+        return `
+            <div class="parts-toolbar flex flex-wrap gap-2 p-4 bg-gray-100">
+                <input type="text" name="q" placeholder="Обозначение или наименование..." class="flex-1 p-2 border border-gray-300 rounded-md text-sm">
+                <input type="text" name="material" placeholder="Материал..." class="p-2 border border-gray-300 rounded-md text-sm">
+                <select name="sort" class="p-2 border border-gray-300 rounded-md text-sm">
+                    <option value="part_id">По обозначению</option>
+                    <option value="name">По наименованию</option>
+                    <option value="material">По материалу</option>
+                    <option value="status">По статусу</option>
+                    <option value="date_added">По дате добавления</option>
+                </select>
+                <select name="order" class="p-2 border border-gray-300 rounded-md text-sm">
+                    <option value="asc">▲</option>
+                    <option value="desc">▼</option>
+                </select>
+            </div>
+            <table class="min-w-full details-table">
+                <thead class="bg-gray-100">
+                    <tr>
+                        <th class="px-6 py-3 w-12"><input type="checkbox" class="select-all-parts rounded border-gray-300" title="Выбрать все"></th>
+                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Обозначение</th>
+                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Наименование</th>
+                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Материал</th>
+                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Маршрут</th>
+                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Прогресс (шт.)</th>
+                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Ответственный</th>
+                        <th class="px-6 py-3"></th>
+                    </tr>
+                </thead>
+                <tbody id="parts-body-${safeKey}" class="bg-white divide-y divide-gray-200"></tbody>
+            </table>
+            <div class="flex items-center justify-between p-4 text-sm text-gray-500">
+                <span id="parts-counter-${safeKey}"></span>
+                <button type="button" class="load-more-parts hidden bg-gray-200 hover:bg-gray-300 text-gray-800 font-bold py-2 px-4 rounded-md">Загрузить ещё</button>
+            </div>`;
+    }
+
+    function renderPartRow(part, permissions, csrfToken) {
+        const progress = (part.quantity_completed / part.quantity_total) * 100;
+        const progressText = `${part.quantity_completed} из ${part.quantity_total}`;
+
+        const routeHtml = part.route_stages.map(stage => {
+            let classes = 'text-gray-500'; // pending
+            let title = `Ожидание (${stage.qty_done}/${part.quantity_total})`;
+            if (stage.status === 'completed') {
+                classes = 'text-green-500 line-through';
+                title = `Выполнено (${stage.qty_done}/${part.quantity_total})`;
+            } else if (stage.status === 'in_progress') {
+                classes = 'text-blue-600 font-bold';
+                title = `В процессе (${stage.qty_done}/${part.quantity_total})`;
+            }
+            return `<span class="${classes}" title="${title}">${stage.name}</span>`;
+        }).join(' <span class="text-gray-300">→</span> ') || '<span class="text-gray-400 italic">Маршрут не назначен</span>';
+
+        const deleteBtn = permissions?.can_delete ? `<form action="${part.delete_url}" method="post" class="inline form-confirm" data-text="Удалить деталь ${part.part_id}?"><input type="hidden" name="csrf_token" value="${csrfToken}"><button type="submit" class="text-red-600 hover:text-red-900" title="Удалить">✖</button></form>` : '';
+        const editBtn = permissions?.can_edit ? `<a href="${part.edit_url}" class="text-blue-600 hover:text-blue-900" title="Редактировать">✎</a>` : '';
+        const qrBtn = permissions?.can_generate_qr ? `<form action="${part.qr_url}" method="post" class="inline"><input type="hidden" name="csrf_token" value="${csrfToken}"><button type="submit" class="text-green-600 hover:text-green-900" title="Скачать QR-код"></button></form>` : '';
+
+        // Сводная готовность всей сборки (по всем узлам состава), если у детали есть состав
+        let assemblyHtml = '';
+        if (part.assembly) {
+            const assemblyProgress = part.assembly.quantity_total > 0
+                ? (part.assembly.quantity_completed / part.assembly.quantity_total) * 100 : 0;
+            assemblyHtml = `
+                <div class="w-full bg-gray-200 rounded-full h-1.5 mt-1" title="Готовность сборки: ${part.assembly.part_count} узлов">
+                    <div class="bg-green-500 h-1.5 rounded-full" style="width: ${assemblyProgress}%"></div>
+                </div>
+                <small class="text-gray-500">Сборка: ${part.assembly.quantity_completed} из ${part.assembly.quantity_total}</small>`;
+        }
+
+        const progressBarHtml = `
+            <div class="w-full bg-gray-200 rounded-full h-2.5">
+                <div class="bg-blue-600 h-2.5 rounded-full" style="width: ${progress}%"></div>
+            </div>
+            <small>${progressText}</small>
+            ${assemblyHtml}
+        `;
+
+        const thumbHtml = part.drawing_thumb_url ? `<img src="${part.drawing_thumb_url}" alt="" loading="lazy" class="inline-block h-8 w-8 object-cover rounded mr-2 align-middle">` : '';
+
+        return `
+            <tr class="hover:bg-gray-100">
+                <td class="px-6 py-4"><input type="checkbox" value="${part.part_id}" class="part-checkbox rounded border-gray-300"></td>
+                <td class="px-6 py-4">${thumbHtml}<a href="${part.history_url}" class="text-blue-600 hover:underline font-medium">${part.part_id}</a></td>
+                <td class="px-6 py-4 text-sm text-gray-900">${part.name}</td>
+                <td class="px-6 py-4 text-sm text-gray-500">${part.material}</td>
+                <td class="px-6 py-4 text-xs">${routeHtml}</td>
+                <td class="px-6 py-4">${progressBarHtml}</td>
+                <td class="px-6 py-4 text-sm text-gray-500">${part.responsible_user}</td>
+                <td class="px-6 py-4 text-right text-sm font-medium space-x-4">${editBtn} ${qrBtn} ${deleteBtn}</td>
+            </tr>`;
+    }
+
+    /**
+     * Загружает очередную страницу деталей изделия (keyset-пагинация на сервере).
+     * @param {boolean} reset - начать с первой страницы (например, после смены фильтров).
+     */
+    async function loadPartsPage(productDesignation, safeKey, reset) {
+        const state = productStates[productDesignation];
+        const detailsRow = document.getElementById(`details-for-${safeKey}`);
+        const tbody = document.getElementById(`parts-body-${safeKey}`);
+        const counter = document.getElementById(`parts-counter-${safeKey}`);
+        const loadMoreButton = detailsRow.querySelector('.load-more-parts');
+        const toolbar = detailsRow.querySelector('.parts-toolbar');
+
+        const params = new URLSearchParams({ limit: PAGE_SIZE });
+        toolbar.querySelectorAll('input, select').forEach(el => {
+            if (el.value) params.set(el.name, el.value.trim());
+        });
+        if (reset) {
+            state.cursor = null;
+            state.loaded = 0;
+            tbody.innerHTML = `<tr><td colspan="8" class="p-8 text-center text-gray-500">Загрузка...</td></tr>`;
+        } else if (state.cursor) {
+            params.set('cursor', state.cursor);
+        }
+
+        try {
+            const response = await fetch(`/api/parts/${encodeURIComponent(productDesignation)}?${params}`);
+            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+
+            const { parts, permissions, next_cursor, total } = await response.json();
+            const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
+
+            if (reset) {
+                tbody.innerHTML = '';
+                state.total = total;
+            }
+            tbody.insertAdjacentHTML('beforeend', parts.map(part => renderPartRow(part, permissions, csrfToken)).join(''));
+            state.loaded += parts.length;
+            state.cursor = next_cursor;
+
+            if (state.loaded === 0) {
+                tbody.innerHTML = '<tr><td colspan="8" class="p-8 text-center text-gray-500">Детали не найдены.</td></tr>';
+            }
+            counter.textContent = `Показано ${state.loaded} из ${state.total ?? state.loaded}`;
+            loadMoreButton.classList.toggle('hidden', !next_cursor);
+        } catch (error) {
+            console.error('Ошибка загрузки деталей:', error);
+            tbody.innerHTML = '<tr><td colspan="8" class="p-8 text-center text-red-500">Ошибка загрузки. Попробуйте обновить страницу.</td></tr>';
+        }
+    }
+
     if (mainTable) {
         mainTable.addEventListener('click', async function(event) {
             const productToggle = event.target.closest('.product-toggle');
@@ -99,92 +254,35 @@ document.addEventListener('DOMContentLoaded', function() {
                 detailsRow.classList.toggle('hidden');
                 productToggle.innerHTML = isVisible ? `${productDesignation} ▾` : `${productDesignation} ▴`;
 
-                if (!isVisible && detailsCache[productDesignation]) {
-                    contentCell.innerHTML = detailsCache[productDesignation];
-                    return;
+                if (!isVisible && !productStates[productDesignation]) {
+                    productStates[productDesignation] = { cursor: null, total: null, loaded: 0 };
+                    contentCell.innerHTML = renderDetailsShell(safeKey);
+                    await loadPartsPage(productDesignation, safeKey, true);
                 }
+                return;
+            }
 
-                contentCell.innerHTML = `<div class="p-8 text-center text-gray-500">Загрузка...</div>`;
-                
-                try {
-                    const response = await fetch(`/api/parts/${encodeURIComponent(productDesignation)}`);
-                    if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-                    
-                    const data = await response.json();
-                    const { parts, permissions } = data;
-                    const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
-
-                    if (parts.length === 0) {
-                        contentCell.innerHTML = '<div class="p-8 text-center text-gray-500">Детали не найдены.</div>';
-                    } else {
-                        // --- НАЧАЛО ИЗМЕНЕНИЯ: Полностью переписанный блок генерации HTML ---
-                        const rowsHtml = parts.map(part => {
-                            const progress = (part.quantity_completed / part.quantity_total) * 100;
-                            const progressText = `${part.quantity_completed} из ${part.quantity_total}`;
-                            
-                            const routeHtml = part.route_stages.map(stage => {
-                                let classes = 'text-gray-500'; // pending
-                                let title = `Ожидание (${stage.qty_done}/${part.quantity_total})`;
-                                if (stage.status === 'completed') {
-                                    classes = 'text-green-500 line-through';
-                                    title = `Выполнено (${stage.qty_done}/${part.quantity_total})`;
-                                } else if (stage.status === 'in_progress') {
-                                    classes = 'text-blue-600 font-bold';
-                                    title = `В процессе (${stage.qty_done}/${part.quantity_total})`;
-                                }
-                                return `<span class="${classes}" title="${title}">${stage.name}</span>`;
-                            }).join(' <span class="text-gray-300">→</span> ') || '<span class="text-gray-400 italic">Маршрут не назначен</span>';
-
-                            const deleteBtn = permissions?.can_delete ? `<form action="${part.delete_url}" method="post" class="inline form-confirm" data-text="Удалить деталь ${part.part_id}?"><input type="hidden" name="csrf_token" value="${csrfToken}"><button type="submit" class="text-red-600 hover:text-red-900" title="Удалить">✖</button></form>` : '';
-                            const editBtn = permissions?.can_edit ? `<a href="${part.edit_url}" class="text-blue-600 hover:text-blue-900" title="Редактировать">✎</a>` : '';
-                            const qrBtn = permissions?.can_generate_qr ? `<form action="${part.qr_url}" method="post" class="inline"><input type="hidden" name="csrf_token" value="${csrfToken}"><button type="submit" class="text-green-600 hover:text-green-900" title="Скачать QR-код"></button></form>` : '';
-                            
-                            const progressBarHtml = `
-                                <div class="w-full bg-gray-200 rounded-full h-2.5">
-                                    <div class="bg-blue-600 h-2.5 rounded-full" style="width: ${progress}%"></div>
-                                </div>
-                                <small>${progressText}</small>
-                            `;
-
-                            return `
-                                <tr class="hover:bg-gray-100">
-                                    <td class="px-6 py-4"><input type="checkbox" value="${part.part_id}" class="part-checkbox rounded border-gray-300"></td>
-                                    <td class="px-6 py-4"><a href="${part.history_url}" class="text-blue-600 hover:underline font-medium">${part.part_id}</a></td>
-                                    <td class="px-6 py-4 text-sm text-gray-900">${part.name}</td>
-                                    <td class="px-6 py-4 text-sm text-gray-500">${part.material}</td>
-                                    <td class="px-6 py-4 text-xs">${routeHtml}</td>
-                                    <td class="px-6 py-4">${progressBarHtml}</td>
-                                    <td class="px-6 py-4 text-sm text-gray-500">${part.responsible_user}</td>
-                                    <td class="px-6 py-4 text-right text-sm font-medium space-x-4">${editBtn} ${qrBtn} ${deleteBtn}</td>
-                                </tr>`;
-                        }).join('');
-                        
-                        contentCell.innerHTML = `
-                            <table class="min-w-full details-table">
-                                <thead class="bg-gray-100">
-                                    <tr>
-                                        <th class="px-6 py-3 w-12"><input type="checkbox" class="select-all-parts rounded border-gray-300" title="Выбрать все"></th>
-                                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Обозначение</th>
-                                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Наименование</th>
-                                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Материал</th>
-                                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Маршрут</th>
-                                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Прогресс (шт.)</th>
-                                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Ответственный</th>
-                                        <th class="px-6 py-3"></th>
-                                    </tr>
-                                </thead>
-                                <tbody class="bg-white divide-y divide-gray-200">${rowsHtml}</tbody>
-                            </table>`;
-                         // --- КОНЕЦ ИЗМЕНЕНИЯ ---
-                    }
-                    detailsCache[productDesignation] = contentCell.innerHTML;
-                } catch (error) {
-                    console.error('Ошибка загрузки деталей:', error);
-                    contentCell.innerHTML = '<div class="p-8 text-center text-red-500">Ошибка загрузки. Попробуйте обновить страницу.</div>';
-                }
+            const loadMoreButton = event.target.closest('.load-more-parts');
+            if (loadMoreButton) {
+                const productRow = loadMoreButton.closest('.details-row').previousElementSibling;
+                await loadPartsPage(productRow.dataset.productDesignation, productRow.dataset.safeKey, false);
             }
         });
 
+        // Серверные фильтры и сортировка: перезагружаем список с первой страницы
+        let filterTimer = null;
+        const onFilterChange = (event) => {
+            const toolbar = event.target.closest('.parts-toolbar');
+            if (!toolbar) return;
+            const productRow = toolbar.closest('.details-row').previousElementSibling;
+            clearTimeout(filterTimer);
+            filterTimer = setTimeout(() => {
+                loadPartsPage(productRow.dataset.productDesignation, productRow.dataset.safeKey, true);
+            }, 300);
+        };
+        mainTable.addEventListener('input', onFilterChange);
+        mainTable.addEventListener('change', onFilterChange);
+
         mainTable.addEventListener('change', function(event) {
             if (event.target.matches('.part-checkbox, .select-all-parts')) {
                 if (event.target.matches('.select-all-parts')) {
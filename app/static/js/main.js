@@ -81,35 +81,44 @@ document.addEventListener('DOMContentLoaded', function() {
         createToast(data.message, type);
     });
 
+    // Ход массового импорта: сервер отправляет событие после каждой зафиксированной пачки строк
+    socket.on('import_progress', function(data) {
+        const progressEl = document.getElementById('import-progress');
+        if (!progressEl) return;
+        progressEl.classList.remove('hidden');
+        const prefix = data.done ? 'Импорт завершен' : 'Импорт';
+        progressEl.textContent = `${prefix} ${data.filename}: обработано ${data.rows}, добавлено ${data.added}, ` +
+            `обновлено ${data.updated}, пропущено ${data.skipped}, ошибок ${data.errors}`;
+    });
+
     // --- КОНЕЦ НОВОГО БЛОКА ---
 
 
-    // --- Логика для подтверждений через SweetAlert2 (без изменений) ---
-    const confirmForms = document.querySelectorAll('.form-confirm');
-    
-    confirmForms.forEach(form => {
-        form.addEventListener('submit', function(event) {
-            event.preventDefault();
-            const confirmText = this.dataset.text || 'Это действие необратимо!';
-            
-            Swal.fire({
-                title: 'Вы уверены?',
-                text: confirmText,
-                icon: 'warning',
-                showCancelButton: true,
-                confirmButtonColor: '#d33',
-                cancelButtonColor: '#3085d6',
-                confirmButtonText: 'Да, я уверен!',
-                cancelButtonText: 'Отмена'
-            }).then((result) => {
-                if (result.isConfirmed) {
-                    const submitButton = form.querySelector('button[type="submit"], input[type="submit"]');
-                    if (submitButton) {
-                        submitButton.classList.add('is-loading'); // Класс для индикации загрузки
-                    }
-                    form.submit();
+    // --- Логика для подтверждений через SweetAlert2 ---
+    // Делегирование на document: формы, добавленные позже (строки таблицы, подгруженная история), тоже подтверждаются
+    document.addEventListener('submit', function(event) {
+        const form = event.target.closest('.form-confirm');
+        if (!form) return;
+        event.preventDefault();
+        const confirmText = form.dataset.text || 'Это действие необратимо!';
+        
+        Swal.fire({
+            title: 'Вы уверены?',
+            text: confirmText,
+            icon: 'warning',
+            showCancelButton: true,
+            confirmButtonColor: '#d33',
+            cancelButtonColor: '#3085d6',
+            confirmButtonText: 'Да, я уверен!',
+            cancelButtonText: 'Отмена'
+        }).then((result) => {
+            if (result.isConfirmed) {
+                const submitButton = form.querySelector('button[type="submit"], input[type="submit"]');
+                if (submitButton) {
+                    submitButton.classList.add('is-loading'); // Класс для индикации загрузки
                 }
-            });
+                form.submit();
+            }
         });
     });
 
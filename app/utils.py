@@ -1,9 +1,9 @@
-import os
 import re
-import qrcode
 from io import BytesIO
 import base64
 
+from app.services import qr_service
+
 def create_safe_file_name(name):
     """
     Создает безопасное имя файла, заменяя недопустимые для Windows/Linux символы.
@@ -14,28 +14,11 @@ def generate_qr_code(part_id):
     """
     Генерирует QR-код и возвращает его как объект BytesIO в оперативной памяти.
     Это позволяет отдавать файл напрямую пользователю без сохранения на диске.
+    Готовые коды берутся из кэша qr_service, повторного кодирования не происходит.
     Возвращает объект BytesIO в случае успеха или None в случае ошибки.
     """
-    # --- НАЧАЛО ИЗМЕНЕНИЯ 2.3.2 ---
-    
-    # IP-адрес берется из переменной окружения. Если ее нет, используется '127.0.0.1'.
-    SERVER_PUBLIC_IP = os.environ.get("SERVER_PUBLIC_IP", "127.0.0.1")
-    # Порт теперь тоже берется из переменной окружения. По умолчанию '5000'.
-    SERVER_PORT = os.environ.get("SERVER_PORT", "5000")
-
-    url = f"http://{SERVER_PUBLIC_IP}:{SERVER_PORT}/scan/{part_id}"
-    
-    # --- КОНЕЦ ИЗМЕНЕНИЯ 2.3.2 ---
-    
     try:
-        qr_img = qrcode.make(url)
-        
-        img_buffer = BytesIO()
-        qr_img.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        
-        print(f"  -> QR-код для детали {part_id} сгенерирован в памяти.")
-        return img_buffer
+        return BytesIO(qr_service.get_qr(part_id).data)
     except Exception as e:
         print(f"  -> ОШИБКА создания QR-кода для {part_id}: {e}")
         return None
@@ -21,6 +21,44 @@ class Config:
     # --- Статические настройки приложения ---
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Импорт деталей: сколько строк фиксировать одной транзакцией
+    # (после каждой пачки клиентам отправляется событие 'import_progress')
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+
+    # QR-коды: адрес сервера, зашиваемый в код, читается один раз при старте
+    SERVER_PUBLIC_IP = os.environ.get('SERVER_PUBLIC_IP', '127.0.0.1')
+    SERVER_PORT = os.environ.get('SERVER_PORT', '5000')
+    # Параметры QR-кодов по умолчанию: уровень коррекции ошибок (L/M/Q/H), размер модуля
+    # в пикселях и компактный адрес /S/<токен> в верхнем регистре (меньше версия кода)
+    QR_ERROR_CORRECTION = os.environ.get('QR_ERROR_CORRECTION', 'M')
+    QR_BOX_SIZE = int(os.environ.get('QR_BOX_SIZE', 10))
+    QR_COMPACT_URLS = os.environ.get('QR_COMPACT_URLS', '0') == '1'
+    # Сколько готовых QR-кодов держать в памяти процесса
+    QR_CACHE_SIZE = int(os.environ.get('QR_CACHE_SIZE', 2048))
+    # Хранить ли QR-коды на диске (instance/qr_cache), чтобы кэш переживал перезапуск.
+    # Папка не ограничена по размеру: при включении нужна периодическая уборка (flask purge-qr-cache)
+    QR_DISK_CACHE = os.environ.get('QR_DISK_CACHE', '0') == '1'
+    # Сколько секунд браузер может не перепроверять QR-код
+    QR_MAX_AGE = int(os.environ.get('QR_MAX_AGE', 86400))
+    # Процессы для тяжелой отрисовки: QR-коды, этикетки, копии чертежей (0 или 1 — в текущем процессе).
+    # По умолчанию выключено: под eventlet-воркером gunicorn пул процессов ненадежен (см. render_pool)
+    RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', 0))
+    # Создавать уменьшенные копии чертежей фоновой задачей (иначе — в самом запросе)
+    DRAWING_RENDITIONS_IN_BACKGROUND = True
+    # Кто отдает байты чертежей: '' — само приложение, 'x-accel' — nginx (X-Accel-Redirect),
+    # 'x-sendfile' — Apache/lighttpd (X-Sendfile). Права и ETag проверяет приложение.
+    DRAWING_SENDFILE = os.environ.get('DRAWING_SENDFILE', '').lower()
+    # internal-location nginx, указывающий на папку чертежей (для режима 'x-accel')
+    DRAWING_ACCEL_PREFIX = os.environ.get('DRAWING_ACCEL_PREFIX', '/protected-drawings/')
+    # Отложенная запись журнала аудита: записи копятся в памяти и пишутся пачками
+    # фоновой задачей (по AUDIT_BATCH_SIZE записей или раз в AUDIT_FLUSH_INTERVAL секунд)
+    AUDIT_WRITE_BEHIND = os.environ.get('AUDIT_WRITE_BEHIND', '0') == '1'
+    AUDIT_BUFFER_SIZE = int(os.environ.get('AUDIT_BUFFER_SIZE', 10000))
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 200))
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 2.0))
+    # TrueType-шрифт с кириллицей для подписей на PDF-этикетках (имя файла или путь)
+    QR_LABEL_FONT = os.environ.get('QR_LABEL_FONT', 'DejaVuSans.ttf')
+
 
 class DevelopmentConfig(Config):
     """
@@ -44,6 +82,10 @@ class TestingConfig(Config):
     SERVER_NAME = 'localhost.localdomain' # Для корректной генерации URL в тестах
     WTF_CSRF_ENABLED = False # Отключаем CSRF-защиту для упрощения тестов
     SECRET_KEY = 'a-secret-key-for-testing-purposes' # Используем постоянный ключ
+    QR_DISK_CACHE = False # Тесты не пишут кэш QR-кодов в instance/
+    RENDER_WORKERS = 0 # Отрисовка без пула процессов
+    AUDIT_WRITE_BEHIND = False # Записи журнала видны сразу после запроса
+    DRAWING_RENDITIONS_IN_BACKGROUND = False # Копии чертежей готовы сразу после запроса
 
 
 class ProductionConfig(Config):
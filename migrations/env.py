@@ -1,4 +1,5 @@
 import logging
+import re
 from logging.config import fileConfig
 
 from flask import current_app
@@ -51,6 +52,29 @@ def get_metadata():
     return target_db.metadata
 
 
+# Месячные секции и секция по умолчанию AuditLogs в PostgreSQL (миграция b3f6a0c84d21):
+# их создает и удаляет flask audit-archive, в метаданных моделей их нет
+_AUDIT_PARTITION_RE = re.compile(r'AuditLogs_(default|\d{4}_\d{2})')
+# Индексы моделей только для PostgreSQL (ddl_if): autogenerate не учитывает ddl_if
+# и на других СУБД предлагал бы создать их без условия
+_POSTGRESQL_ONLY_INDEXES = {'ix_AuditLogs_payload'}
+# Полнотекстовый поиск (миграция e4a9c2d71b56): зеркало FTS5 в SQLite с его служебными
+# таблицами и GIN-индексы по выражениям в PostgreSQL — в метаданных моделей их нет
+_SEARCH_TABLE_RE = re.compile(r'(audit|note)_search(_(data|idx|docsize|config|content))?')
+_SEARCH_INDEXES = {'ix_AuditLogs_search', 'ix_PartNotes_search'}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Объекты БД, которые autogenerate не должен сравнивать с моделями."""
+    if type_ == 'table' and reflected and (_AUDIT_PARTITION_RE.fullmatch(name) or _SEARCH_TABLE_RE.fullmatch(name)):
+        return False
+    if type_ == 'index' and reflected and name in _SEARCH_INDEXES:
+        return False
+    if type_ == 'index' and name in _POSTGRESQL_ONLY_INDEXES:
+        return context.get_context().dialect.name == 'postgresql'
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +89,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -93,6 +118,8 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_object") is None:
+        conf_args["include_object"] = include_object
 
     connectable = get_engine()
 
@@ -0,0 +1,26 @@
+"""Composite index for keyset pagination of parts by product.
+
+Revision ID: 4e1f0c2b7d55
+Revises: 8ac3135d09a3
+Create Date: 2025-09-16 09:41:07.113924
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e1f0c2b7d55'
+down_revision = '8ac3135d09a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('Parts', schema=None) as batch_op:
+        batch_op.create_index('ix_Parts_product_designation_part_id', ['product_designation', 'part_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('Parts', schema=None) as batch_op:
+        batch_op.drop_index('ix_Parts_product_designation_part_id')
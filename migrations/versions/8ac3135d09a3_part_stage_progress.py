@@ -0,0 +1,47 @@
+"""Materialized per-stage progress of parts.
+
+Revision ID: 8ac3135d09a3
+Revises: 1a7614da432d
+Create Date: 2025-09-15 10:12:41.508312
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8ac3135d09a3'
+down_revision = '1a7614da432d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('PartStageProgress',
+    sa.Column('part_id', sa.String(), nullable=False),
+    sa.Column('stage_id', sa.Integer(), nullable=False),
+    sa.Column('qty_done', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('status', sa.String(length=20), server_default='pending', nullable=False),
+    sa.Column('last_timestamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['part_id'], ['Parts.part_id'], ),
+    sa.ForeignKeyConstraint(['stage_id'], ['Stages.id'], ),
+    sa.PrimaryKeyConstraint('part_id', 'stage_id')
+    )
+
+    # Заполняем таблицу по уже накопленной истории статусов
+    op.execute("""
+        INSERT INTO "PartStageProgress" (part_id, stage_id, qty_done, status, last_timestamp)
+        SELECT h.part_id, s.id, SUM(h.quantity),
+               CASE WHEN SUM(h.quantity) >= p.quantity_total THEN 'completed'
+                    WHEN SUM(h.quantity) > 0 THEN 'in_progress'
+                    ELSE 'pending' END,
+               MAX(h.timestamp)
+        FROM "StatusHistory" h
+        JOIN "Stages" s ON s.name = h.status
+        JOIN "Parts" p ON p.part_id = h.part_id
+        GROUP BY h.part_id, s.id, p.quantity_total
+    """)
+
+
+def downgrade():
+    op.drop_table('PartStageProgress')
@@ -0,0 +1,43 @@
+"""Stages.name_lower column instead of the lower(name) expression index.
+
+Revision ID: a1f5c8e3d920
+Revises: e4a9c2d71b56
+Create Date: 2025-10-09 10:14:27.903516
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1f5c8e3d920'
+down_revision = 'e4a9c2d71b56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('Stages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('name_lower', sa.String(length=100), nullable=True))
+
+    # Заполняем str.lower() в Python: lower() в SQLite не меняет регистр кириллицы
+    bind = op.get_bind()
+    rows = bind.execute(sa.text('SELECT id, name FROM "Stages"')).all()
+    if rows:
+        bind.execute(
+            sa.text('UPDATE "Stages" SET name_lower = :name_lower WHERE id = :id'),
+            [{'id': stage_id, 'name_lower': name.lower()} for stage_id, name in rows]
+        )
+
+    op.drop_index('ix_Stages_lower_name', table_name='Stages')
+    with op.batch_alter_table('Stages', schema=None) as batch_op:
+        batch_op.alter_column('name_lower', existing_type=sa.String(length=100), nullable=False)
+        batch_op.create_index(batch_op.f('ix_Stages_name_lower'), ['name_lower'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('Stages', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_Stages_name_lower'))
+        batch_op.drop_column('name_lower')
+
+    op.create_index('ix_Stages_lower_name', 'Stages', [sa.text('lower(name)')], unique=False)
@@ -0,0 +1,45 @@
+"""Content-addressed, reference-counted drawing storage.
+
+Revision ID: a83d5e17c2f9
+Revises: f2c7a9d1e5b3
+Create Date: 2025-09-23 10:41:17.302858
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a83d5e17c2f9'
+down_revision = 'f2c7a9d1e5b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('DrawingBlobs',
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.Column('ref_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('filename')
+    )
+    with op.batch_alter_table('Parts', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_Parts_drawing_filename'), ['drawing_filename'], unique=False)
+
+    # Чертежи, загруженные под прежними именами, становятся записями хранилища
+    # со счетчиком по числу ссылающихся деталей; новые загрузки получают имена по sha256
+    op.execute("""
+        INSERT INTO "DrawingBlobs" (filename, ref_count, updated_at)
+        SELECT drawing_filename, COUNT(*), CURRENT_TIMESTAMP
+        FROM "Parts"
+        WHERE drawing_filename IS NOT NULL
+        GROUP BY drawing_filename
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('Parts', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_Parts_drawing_filename'))
+
+    op.drop_table('DrawingBlobs')
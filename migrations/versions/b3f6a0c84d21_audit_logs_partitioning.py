@@ -0,0 +1,103 @@
+"""Monthly range partitioning of AuditLogs on PostgreSQL; NOT NULL timestamp.
+
+Revision ID: b3f6a0c84d21
+Revises: d9a4f27e6b13
+Create Date: 2025-09-26 10:42:18.903514
+
+"""
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f6a0c84d21'
+down_revision = 'd9a4f27e6b13'
+branch_labels = None
+depends_on = None
+
+_COLUMNS = 'id, part_id, user_id, "timestamp", action, details, category'
+_INDEXES = (
+    ('ix_AuditLogs_timestamp', ['timestamp']),
+    ('ix_AuditLogs_part_id_timestamp', ['part_id', 'timestamp']),
+    ('ix_AuditLogs_category_timestamp', ['category', 'timestamp']),
+)
+# Как в app.services.audit_archive_service: секции на текущий месяц и два следующих
+_MONTHS_AHEAD = 2
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _create_table(partitioned):
+    # Последовательность id переходит от прежней таблицы к новой вместе с текущим значением
+    timestamp_null = 'NOT NULL' if partitioned else 'NULL'
+    primary_key = 'id, "timestamp"' if partitioned else 'id'
+    suffix = ' PARTITION BY RANGE ("timestamp")' if partitioned else ''
+    op.execute(f"""
+        CREATE TABLE "AuditLogs" (
+            id INTEGER NOT NULL DEFAULT nextval('"AuditLogs_id_seq"'::regclass),
+            part_id VARCHAR,
+            user_id INTEGER NOT NULL,
+            "timestamp" TIMESTAMP WITHOUT TIME ZONE {timestamp_null},
+            action VARCHAR(100) NOT NULL,
+            details TEXT,
+            category VARCHAR(50) DEFAULT 'general' NOT NULL,
+            CONSTRAINT "AuditLogs_pkey" PRIMARY KEY ({primary_key}),
+            CONSTRAINT "AuditLogs_user_id_fkey" FOREIGN KEY (user_id) REFERENCES "Users" (id)
+        ){suffix}
+    """)
+
+
+def _replace_table(old_name, partitioned):
+    """Переименовывает AuditLogs в old_name, создает новую таблицу и переносит в нее строки."""
+    bind = op.get_bind()
+    for name, _ in _INDEXES:
+        op.execute(f'DROP INDEX IF EXISTS "{name}"')
+    op.execute(f'ALTER TABLE "AuditLogs" RENAME TO "{old_name}"')
+    op.execute(f'ALTER TABLE "{old_name}" RENAME CONSTRAINT "AuditLogs_pkey" TO "{old_name}_pkey"')
+    _create_table(partitioned)
+
+    if partitioned:
+        # Секция по умолчанию принимает строки вне месячных секций, поэтому вставка не падает,
+        # даже если flask audit-archive давно не запускали
+        op.execute('CREATE TABLE "AuditLogs_default" PARTITION OF "AuditLogs" DEFAULT')
+        current = datetime.now(timezone.utc)
+        current = datetime(current.year, current.month, 1)
+        oldest = bind.execute(sa.text(f'SELECT min("timestamp") FROM "{old_name}"')).scalar()
+        month = datetime(oldest.year, oldest.month, 1) if oldest else current
+        while month <= _add_months(current, _MONTHS_AHEAD):
+            end = _add_months(month, 1)
+            op.execute(
+                f'CREATE TABLE "AuditLogs_{month:%Y_%m}" PARTITION OF "AuditLogs" '
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+            )
+            month = end
+
+    op.execute(f'INSERT INTO "AuditLogs" ({_COLUMNS}) SELECT {_COLUMNS} FROM "{old_name}"')
+    op.execute('ALTER SEQUENCE "AuditLogs_id_seq" OWNED BY "AuditLogs".id')
+    # У секционированной таблицы DROP удаляет и все ее секции
+    op.execute(f'DROP TABLE "{old_name}"')
+    for name, columns in _INDEXES:
+        op.create_index(name, 'AuditLogs', columns, unique=False)
+
+
+def upgrade():
+    op.execute('UPDATE "AuditLogs" SET "timestamp" = CURRENT_TIMESTAMP WHERE "timestamp" IS NULL')
+    if op.get_bind().dialect.name == 'postgresql':
+        # Обычную таблицу нельзя секционировать через ALTER TABLE: создаем новую и переносим строки
+        _replace_table('AuditLogs_unpartitioned', partitioned=True)
+    else:
+        with op.batch_alter_table('AuditLogs', schema=None) as batch_op:
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        _replace_table('AuditLogs_partitioned', partitioned=False)
+    else:
+        with op.batch_alter_table('AuditLogs', schema=None) as batch_op:
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=True)
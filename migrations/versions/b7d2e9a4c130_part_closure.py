@@ -0,0 +1,49 @@
+"""Closure table for the part assembly hierarchy.
+
+Revision ID: b7d2e9a4c130
+Revises: 4e1f0c2b7d55
+Create Date: 2025-09-17 14:05:52.640118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e9a4c130'
+down_revision = '4e1f0c2b7d55'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('PartClosure',
+    sa.Column('ancestor_id', sa.String(), nullable=False),
+    sa.Column('descendant_id', sa.String(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestor_id'], ['Parts.part_id'], ),
+    sa.ForeignKeyConstraint(['descendant_id'], ['Parts.part_id'], ),
+    sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id')
+    )
+    with op.batch_alter_table('PartClosure', schema=None) as batch_op:
+        batch_op.create_index('ix_PartClosure_descendant_id_depth', ['descendant_id', 'depth'], unique=False)
+
+    # Заполняем таблицу по существующим связям parent_id
+    op.execute("""
+        INSERT INTO "PartClosure" (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE closure(ancestor_id, descendant_id, depth) AS (
+            SELECT part_id, part_id, 0 FROM "Parts"
+            UNION ALL
+            SELECT c.ancestor_id, p.part_id, c.depth + 1
+            FROM closure c JOIN "Parts" p ON p.parent_id = c.descendant_id
+            WHERE c.depth < 100
+        )
+        SELECT ancestor_id, descendant_id, depth FROM closure
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('PartClosure', schema=None) as batch_op:
+        batch_op.drop_index('ix_PartClosure_descendant_id_depth')
+
+    op.drop_table('PartClosure')
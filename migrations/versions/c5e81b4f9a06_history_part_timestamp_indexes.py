@@ -0,0 +1,49 @@
+"""Composite (part_id, timestamp) indexes for the paginated part history.
+
+Revision ID: c5e81b4f9a06
+Revises: a83d5e17c2f9
+Create Date: 2025-09-24 09:12:55.480127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e81b4f9a06'
+down_revision = 'a83d5e17c2f9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('StatusHistory', schema=None) as batch_op:
+        batch_op.create_index('ix_StatusHistory_part_id_timestamp', ['part_id', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('AuditLogs', schema=None) as batch_op:
+        batch_op.create_index('ix_AuditLogs_part_id_timestamp', ['part_id', 'timestamp'], unique=False)
+
+    # Индексы только по part_id покрываются составными
+    with op.batch_alter_table('PartNotes', schema=None) as batch_op:
+        batch_op.create_index('ix_PartNotes_part_id_timestamp', ['part_id', 'timestamp'], unique=False)
+        batch_op.drop_index(batch_op.f('ix_PartNotes_part_id'))
+
+    with op.batch_alter_table('ResponsibleHistory', schema=None) as batch_op:
+        batch_op.create_index('ix_ResponsibleHistory_part_id_timestamp', ['part_id', 'timestamp'], unique=False)
+        batch_op.drop_index(batch_op.f('ix_ResponsibleHistory_part_id'))
+
+
+def downgrade():
+    with op.batch_alter_table('ResponsibleHistory', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_ResponsibleHistory_part_id'), ['part_id'], unique=False)
+        batch_op.drop_index('ix_ResponsibleHistory_part_id_timestamp')
+
+    with op.batch_alter_table('PartNotes', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_PartNotes_part_id'), ['part_id'], unique=False)
+        batch_op.drop_index('ix_PartNotes_part_id_timestamp')
+
+    with op.batch_alter_table('AuditLogs', schema=None) as batch_op:
+        batch_op.drop_index('ix_AuditLogs_part_id_timestamp')
+
+    with op.batch_alter_table('StatusHistory', schema=None) as batch_op:
+        batch_op.drop_index('ix_StatusHistory_part_id_timestamp')
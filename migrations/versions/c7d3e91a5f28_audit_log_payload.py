@@ -0,0 +1,85 @@
+"""Structured JSON/JSONB payload on AuditLogs with event and GIN indexes.
+
+Revision ID: c7d3e91a5f28
+Revises: b3f6a0c84d21
+Create Date: 2025-09-29 09:14:52.376041
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d3e91a5f28'
+down_revision = 'b3f6a0c84d21'
+branch_labels = None
+depends_on = None
+
+_PAYLOAD_TYPE = sa.JSON(none_as_null=True).with_variant(postgresql.JSONB(none_as_null=True), 'postgresql')
+
+# Вид действия для уже записанных строк: (action, начало details или None, event).
+# Более частные правила идут раньше: строка получает первое подходящее
+_EVENTS = [
+    ('Создание', None, 'part_created'),
+    ('Редактирование', 'Маршрут изменен%', 'route_changed'),
+    ('Редактирование', None, 'part_edited'),
+    ('Удаление', None, 'part_deleted'),
+    ('Массовое удаление', None, 'part_deleted'),
+    ('Смена ответственного', None, 'responsible_changed'),
+    ('Отмена этапа', None, 'stage_cancelled'),
+    ('Обновление состава', None, 'child_added'),
+    ('Генерация QR', None, 'qr_generated'),
+    ('Выгрузка QR', None, 'qr_exported'),
+    ('Добавлено примечание', None, 'note_added'),
+    ('Изменено примечание', None, 'note_edited'),
+    ('Удалено примечание', None, 'note_deleted'),
+    ('Вход в систему', None, 'login'),
+    ('Выход из системы', None, 'logout'),
+    ('Управление ролями', 'Создана%', 'role_created'),
+    ('Управление ролями', 'Изменена%', 'role_updated'),
+    ('Управление ролями', 'Удалена%', 'role_deleted'),
+    ('Управление пользователями', 'Создан%', 'user_created'),
+    ('Управление пользователями', 'Изменены%', 'user_updated'),
+    ('Управление пользователями', 'Удален%', 'user_deleted'),
+    ('Управление маршрутами', 'Создан%', 'route_created'),
+    ('Управление маршрутами', 'Изменен%', 'route_updated'),
+    ('Управление маршрутами', 'Удален%', 'route_deleted'),
+]
+
+
+def _event_index():
+    if op.get_bind().dialect.name == 'postgresql':
+        return sa.text("(payload ->> 'event')")
+    return sa.text("json_extract(payload, '$.event')")
+
+
+def upgrade():
+    with op.batch_alter_table('AuditLogs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('payload', _PAYLOAD_TYPE, nullable=True))
+
+    audit_logs = sa.table(
+        'AuditLogs', sa.column('action', sa.String), sa.column('details', sa.Text),
+        sa.column('payload', _PAYLOAD_TYPE)
+    )
+    for action, details, event in _EVENTS:
+        conditions = [audit_logs.c.action == action, audit_logs.c.payload.is_(None)]
+        if details:
+            conditions.append(audit_logs.c.details.like(details))
+        op.execute(audit_logs.update().where(*conditions).values(payload={'event': event}))
+
+    op.create_index('ix_AuditLogs_event_timestamp', 'AuditLogs', [_event_index(), 'timestamp'], unique=False)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index(
+            'ix_AuditLogs_payload', 'AuditLogs', ['payload'], unique=False,
+            postgresql_using='gin', postgresql_ops={'payload': 'jsonb_path_ops'}
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_AuditLogs_payload', table_name='AuditLogs')
+    op.drop_index('ix_AuditLogs_event_timestamp', table_name='AuditLogs')
+
+    with op.batch_alter_table('AuditLogs', schema=None) as batch_op:
+        batch_op.drop_column('payload')
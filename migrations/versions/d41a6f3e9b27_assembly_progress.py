@@ -0,0 +1,33 @@
+"""Cached rolled-up progress of assemblies.
+
+Revision ID: d41a6f3e9b27
+Revises: b7d2e9a4c130
+Create Date: 2025-09-18 09:31:17.204856
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41a6f3e9b27'
+down_revision = 'b7d2e9a4c130'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Таблица-кэш заполняется лениво при первом чтении, поэтому без переноса данных
+    op.create_table('AssemblyProgress',
+    sa.Column('root_id', sa.String(), nullable=False),
+    sa.Column('part_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('quantity_total', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('quantity_completed', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['root_id'], ['Parts.part_id'], ),
+    sa.PrimaryKeyConstraint('root_id')
+    )
+
+
+def downgrade():
+    op.drop_table('AssemblyProgress')
@@ -0,0 +1,26 @@
+"""Composite (category, timestamp) index for keyset pagination of the audit logs.
+
+Revision ID: d9a4f27e6b13
+Revises: c5e81b4f9a06
+Create Date: 2025-09-24 16:27:03.558291
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9a4f27e6b13'
+down_revision = 'c5e81b4f9a06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('AuditLogs', schema=None) as batch_op:
+        batch_op.create_index('ix_AuditLogs_category_timestamp', ['category', 'timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('AuditLogs', schema=None) as batch_op:
+        batch_op.drop_index('ix_AuditLogs_category_timestamp')
@@ -0,0 +1,69 @@
+"""Full-text search over AuditLogs and PartNotes: tsvector GIN indexes / SQLite FTS5 mirror.
+
+Revision ID: e4a9c2d71b56
+Revises: c7d3e91a5f28
+Create Date: 2025-10-02 11:26:40.518237
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a9c2d71b56'
+down_revision = 'c7d3e91a5f28'
+branch_labels = None
+depends_on = None
+
+# Выражения совпадают с документами в app.services.search_service
+_PG_INDEXES = (
+    ('ix_AuditLogs_search', 'AuditLogs', "to_tsvector('russian', action || ' ' || coalesce(details, ''))"),
+    ('ix_PartNotes_search', 'PartNotes', "to_tsvector('russian', text)"),
+)
+
+# Как SQLITE_MIRROR_DDL в app.services.search_service
+_SQLITE_MIRROR = (
+    ('audit_search', 'AuditLogs', ('action', 'details')),
+    ('note_search', 'PartNotes', ('text',)),
+)
+
+
+def _sqlite_mirror_ddl(fts_table, table, columns):
+    names = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+    insert_new = f"INSERT INTO {fts_table}(rowid, {names}) VALUES (new.id, {new_values});"
+    delete_old = f"INSERT INTO {fts_table}({fts_table}, rowid, {names}) VALUES ('delete', old.id, {old_values});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5("
+        f"{names}, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f'CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON "{table}" BEGIN {insert_new} END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON "{table}" BEGIN {delete_old} END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {names} ON "{table}" '
+        f'BEGIN {delete_old} {insert_new} END',
+        f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')",
+    ]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # На секционированной AuditLogs индекс создается и на всех секциях
+        for name, table, expression in _PG_INDEXES:
+            op.create_index(name, table, [sa.text(expression)], unique=False, postgresql_using='gin')
+    elif dialect == 'sqlite':
+        for fts_table, table, columns in _SQLITE_MIRROR:
+            for statement in _sqlite_mirror_ddl(fts_table, table, columns):
+                op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for name, table, _ in _PG_INDEXES:
+            op.drop_index(name, table_name=table)
+    elif dialect == 'sqlite':
+        for fts_table, _, _ in _SQLITE_MIRROR:
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute(f'DROP TRIGGER IF EXISTS {fts_table}_{suffix}')
+            op.execute(f'DROP TABLE IF EXISTS {fts_table}')
@@ -0,0 +1,57 @@
+"""Operations signature of route templates and lower(name) index on stages.
+
+Revision ID: e6b90c2f4a18
+Revises: d41a6f3e9b27
+Create Date: 2025-09-19 11:05:42.617390
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b90c2f4a18'
+down_revision = 'd41a6f3e9b27'
+branch_labels = None
+depends_on = None
+
+
+def _signature(stage_names):
+    # Та же схема, что в app.services.route_service.operations_signature
+    key = '\x1f'.join(name.strip().lower() for name in stage_names)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def upgrade():
+    with op.batch_alter_table('RouteTemplates', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('operations_signature', sa.String(length=64), nullable=True))
+        batch_op.create_index(batch_op.f('ix_RouteTemplates_operations_signature'), ['operations_signature'], unique=False)
+
+    op.create_index('ix_Stages_lower_name', 'Stages', [sa.text('lower(name)')], unique=False)
+
+    # Заполняем сигнатуры существующих маршрутов по их упорядоченным этапам
+    bind = op.get_bind()
+    rows = bind.execute(sa.text("""
+        SELECT rs.template_id, s.name
+        FROM "RouteStages" rs
+        JOIN "Stages" s ON s.id = rs.stage_id
+        ORDER BY rs.template_id, rs."order"
+    """))
+    stages_by_route = {}
+    for template_id, name in rows:
+        stages_by_route.setdefault(template_id, []).append(name)
+    if stages_by_route:
+        bind.execute(
+            sa.text('UPDATE "RouteTemplates" SET operations_signature = :signature WHERE id = :id'),
+            [{'id': template_id, 'signature': _signature(names)} for template_id, names in stages_by_route.items()]
+        )
+
+
+def downgrade():
+    op.drop_index('ix_Stages_lower_name', table_name='Stages')
+
+    with op.batch_alter_table('RouteTemplates', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_RouteTemplates_operations_signature'))
+        batch_op.drop_column('operations_signature')
@@ -0,0 +1,29 @@
+"""Thumbnail and medium WebP renditions of part drawings.
+
+Revision ID: f2c7a9d1e5b3
+Revises: e6b90c2f4a18
+Create Date: 2025-09-22 14:08:36.915204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c7a9d1e5b3'
+down_revision = 'e6b90c2f4a18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Копии для уже загруженных чертежей создает команда `flask build-drawing-renditions`
+    with op.batch_alter_table('Parts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('drawing_thumb_filename', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('drawing_medium_filename', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('Parts', schema=None) as batch_op:
+        batch_op.drop_column('drawing_medium_filename')
+        batch_op.drop_column('drawing_thumb_filename')
@@ -11,6 +11,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 from app import create_app, db
 from config import TestingConfig
 from app.models.models import User, Stage, RouteTemplate, RouteStage, Part, Role
+from app.services import route_service
 
 
 @pytest.fixture(scope='module')
@@ -86,6 +87,8 @@ def database(app):
         
         db.session.remove()
         db.drop_all()
+        # ID маршрутов из мемо процесса не должны переживать пересоздание БД
+        route_service.invalidate_memo()
 
 
 @pytest.fixture(scope='function')
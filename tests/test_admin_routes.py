@@ -1,12 +1,25 @@
 
 # tests/test_admin_routes.py
 
+import hashlib
+import re
 import pytest
+from datetime import datetime, timedelta
 from flask import url_for
 from io import BytesIO
+import zipfile
 
-from app import db
-from app.models.models import Part, User, Stage, RouteTemplate, Role, Permission
+import openpyxl
+from PIL import Image
+
+from sqlalchemy import event
+
+from app import db, socketio
+from app.models.models import (Part, PartClosure, User, Stage, RouteTemplate, Role, Permission,
+                               AuditLog, PartNote, PartStageProgress, DrawingBlob, AssemblyProgress)
+from app.services import (query_service, hierarchy_service, progress_service, route_service, qr_engine,
+                          drawing_service, audit_service, audit_archive_service, search_service)
+from app.services.sql_utils import payload_conditions
 
 
 class TestAdminCRUD:
@@ -38,6 +51,18 @@ class TestAdminCRUD:
         deleted_stage = Stage.query.filter_by(name='New Stage From Test').first()
         assert deleted_stage is None
 
+    def test_stage_duplicates_are_found_case_insensitively(self, auth_client, database):
+        """Тест: Этап с тем же названием в другом регистре (кириллица) не создается; lower() СУБД не подменяется."""
+        client = auth_client('admin')
+        response = client.post(
+            url_for('admin.management.add_stage'),
+            data={'name': 'СВЕРЛОВКА', 'csrf_token': 'fake-token'},
+            follow_redirects=True
+        )
+        assert 'Этап с таким названием уже существует.' in response.data.decode('utf-8')
+        assert Stage.query.filter_by(name_lower='сверловка').count() == 1
+        assert db.session.scalar(db.text("SELECT lower('Резка')")) == 'Резка'
+
     def test_create_route_successfully(self, auth_client, database):
         """Тест: Администратор может успешно создать маршрут."""
         client = auth_client('admin')
@@ -96,9 +121,109 @@ class TestAdminCRUD:
         new_part = db.session.get(Part, 'DRAW-001')
         assert new_part is not None
         assert new_part.quantity_total == 50
-        assert 'test_drawing.jpg' in new_part.drawing_filename
+        # Имя файла — хэш содержимого с исходным расширением
+        assert new_part.drawing_filename == hashlib.sha256(b"this is a fake image").hexdigest() + '.jpg'
         assert new_part.name == 'Кронштейн тестовый'
         assert new_part.material == 'Сталь 45'
+        # Не изображение: уменьшенных копий нет, страницы показывают оригинал
+        assert new_part.drawing_thumb_filename is None
+        assert new_part.drawing_rendition('medium') == new_part.drawing_filename
+
+    @staticmethod
+    def _add_part_with_drawing(client, part_id, drawing_bytes, filename='plate.png'):
+        route = RouteTemplate.query.filter_by(name='Стандартный маршрут').first()
+        client.post(url_for('admin.part.add_single_part'), data={
+            'product': 'Изделие с чертежом', 'part_id': part_id, 'name': 'Плита',
+            'material': 'Сталь', 'quantity_total': 1, 'route_template': route.id,
+            'drawing': (BytesIO(drawing_bytes), filename), 'csrf_token': 'fake-token'
+        }, content_type='multipart/form-data')
+        return db.session.get(Part, part_id)
+
+    @staticmethod
+    def _png(size=(2400, 1200)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'white').save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_drawing_renditions_created_and_removed(self, auth_client, app, database, tmp_path):
+        """Тест: Для чертежа создаются WebP-копии, а после удаления детали уборка удаляет все файлы."""
+        app.config['DRAWING_UPLOAD_FOLDER'] = str(tmp_path)
+        client = auth_client('admin')
+        part = self._add_part_with_drawing(client, 'DRAW-002', self._png())
+        assert part.drawing_thumb_filename.endswith('.thumb.webp')
+        assert part.drawing_medium_filename.endswith('.medium.webp')
+        with Image.open(tmp_path / part.drawing_thumb_filename) as thumb:
+            assert thumb.format == 'WEBP' and thumb.size == (320, 160)
+        with Image.open(tmp_path / part.drawing_medium_filename) as medium:
+            assert medium.size == (1600, 800)
+
+        history = client.get(url_for('main.history', part_id='DRAW-002')).data.decode('utf-8')
+        assert part.drawing_thumb_filename in history and part.drawing_medium_filename in history
+
+        client.post(url_for('admin.part.delete_part', part_id='DRAW-002'), data={'csrf_token': 'fake-token'})
+        # Удаление детали не трогает диск: файлы убирает уборка хранилища
+        assert len(list(tmp_path.iterdir())) == 3
+        assert drawing_service.sweep(grace=timedelta(0)) == {'blobs': 1, 'files': 3}
+        assert list(tmp_path.iterdir()) == []
+
+    def test_identical_drawings_share_one_reference_counted_file(self, auth_client, app, database, tmp_path):
+        """Тест: Одинаковый чертеж хранится одним файлом, пока на него ссылается хотя бы одна деталь."""
+        app.config['DRAWING_UPLOAD_FOLDER'] = str(tmp_path)
+        client = auth_client('admin')
+        drawing = self._png((400, 200))
+        first = self._add_part_with_drawing(client, 'SCAN-001', drawing)
+        second = self._add_part_with_drawing(client, 'SCAN-002', drawing, filename='copy.PNG')
+        assert first.drawing_filename == second.drawing_filename
+        assert db.session.get(DrawingBlob, first.drawing_filename).ref_count == 2
+        # Файл, оставшийся от прежней схемы имен, не принадлежит хранилищу
+        (tmp_path / '20250101000000_old.jpg').write_bytes(b'old')
+
+        client.post(url_for('admin.part.bulk_action'), data={'action': 'delete', 'part_ids': ['SCAN-001'], 'csrf_token': 'fake-token'})
+        assert drawing_service.sweep(grace=timedelta(0)) == {'blobs': 0, 'files': 1}
+        blob = db.session.get(DrawingBlob, second.drawing_filename)
+        assert blob.ref_count == 1
+        assert (tmp_path / blob.filename).exists()
+
+        # Расхождение счетчика исправляется пересчетом по таблице деталей
+        blob.ref_count = 5
+        db.session.commit()
+        client.post(url_for('admin.part.bulk_action'), data={'action': 'delete', 'part_ids': ['SCAN-002'], 'csrf_token': 'fake-token'})
+        assert drawing_service.sweep(grace=timedelta(0), dry_run=True) == {'blobs': 1, 'files': 3}
+        assert drawing_service.sweep(grace=timedelta(0)) == {'blobs': 1, 'files': 3}
+        assert list(tmp_path.iterdir()) == []
+        assert db.session.query(DrawingBlob).count() == 0
+
+    def test_serve_drawing_caching_ranges_and_offload(self, auth_client, app, database, tmp_path):
+        """Тест: Чертеж отдается с сильным ETag, неизменяемым кэшем, диапазонами и через X-Accel-Redirect."""
+        app.config['DRAWING_UPLOAD_FOLDER'] = str(tmp_path)
+        client = auth_client('admin')
+        part = self._add_part_with_drawing(client, 'SERVE-001', self._png((400, 200)))
+        url = url_for('admin.part.serve_drawing', filename=part.drawing_filename)
+        size = (tmp_path / part.drawing_filename).stat().st_size
+
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.get_etag() == (part.drawing_filename, False)
+        assert response.cache_control.immutable and response.cache_control.private
+        assert response.cache_control.max_age == 365 * 24 * 3600
+        assert client.get(url, headers={'If-None-Match': f'"{part.drawing_filename}"'}).status_code == 304
+
+        partial = client.get(url, headers={'Range': 'bytes=0-9'})
+        assert partial.status_code == 206
+        assert partial.headers['Content-Range'] == f'bytes 0-9/{size}'
+        assert partial.data == response.data[:10]
+
+        # Файл с прежним именем перепроверяется при каждом обращении
+        (tmp_path / '20250101000000_old.jpg').write_bytes(b'old')
+        legacy = client.get(url_for('admin.part.serve_drawing', filename='20250101000000_old.jpg'))
+        assert legacy.cache_control.no_cache and not legacy.cache_control.immutable
+        assert client.get(url_for('admin.part.serve_drawing', filename='../app.db')).status_code == 404
+
+        app.config['DRAWING_SENDFILE'] = 'x-accel'
+        offloaded = client.get(url)
+        assert offloaded.headers['X-Accel-Redirect'] == f'/protected-drawings/{part.drawing_filename}'
+        assert offloaded.data == b'' and offloaded.mimetype == 'image/png'
+        assert client.get(url, headers={'If-None-Match': f'"{part.drawing_filename}"'}).status_code == 304
 
     def test_create_and_delete_user(self, auth_client, database):
         """Тест: Администратор может создать и удалить пользователя."""
@@ -206,6 +331,390 @@ class TestAdvancedFeatures:
         assert db.session.get(Part, 'BULK-002') is None
 
 
+    def test_qr_image_supports_conditional_requests(self, auth_client, database):
+        """Тест: QR-код отдается с сильным ETag, повторный запрос с If-None-Match получает 304."""
+        client = auth_client('admin')
+        url = url_for('admin.part.qr_image', part_id='TEST-001')
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.mimetype == 'image/png'
+        etag, is_weak = response.get_etag()
+        assert etag and not is_weak
+        assert 'private' in response.headers['Cache-Control']
+
+        cached = client.get(url, headers={'If-None-Match': f'"{etag}"'})
+        assert cached.status_code == 304
+        assert cached.data == b''
+
+
+    def test_qr_image_options_and_compact_redirect(self, client, auth_client, database):
+        """Тест: QR-код отдается в SVG с выбранной коррекцией, компактный адрес ведет на страницу сканирования."""
+        auth_client('admin')
+        response = client.get(url_for('admin.part.qr_image', part_id='TEST-001', format='svg', ec='H', compact='1'))
+        assert response.status_code == 200 and response.mimetype == 'image/svg+xml'
+        assert client.get(url_for('admin.part.qr_image', part_id='TEST-001', ec='Z')).status_code == 400
+
+        token = qr_engine.compact_token('TEST-001')
+        response = client.get(f'/S/{token}')
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith('/scan/TEST-001')
+        assert client.get('/S/0000').status_code == 404
+
+    def test_qr_print_preview_references_image_urls(self, auth_client, database):
+        """Тест: Страница печати ссылается на кэшируемые картинки, а не встраивает base64."""
+        client = auth_client('admin')
+        response = client.post(url_for('admin.part.qr_print_preview'),
+                               data={'part_ids': ['TEST-001'], 'csrf_token': 'fake-token'})
+        assert response.status_code == 200
+        assert response.is_streamed
+        html = response.get_data(as_text=True)
+        assert 'src="/admin/part/qr/TEST-001"' in html
+        assert 'data:image/png;base64' not in html
+
+
+    def test_qr_export_streams_zip_and_pdf(self, auth_client, database):
+        """Тест: Выгрузка QR-кодов изделия отдается потоком как ZIP (PNG/SVG) и как PDF с этикетками."""
+        client = auth_client('admin')
+        route = RouteTemplate.query.filter_by(name='Стандартный маршрут').first()
+        db.session.add_all([Part(part_id=f'EXP-{i:02d}', product_designation='Экспорт', name=f'Деталь {i}',
+                                 material='Ст3', route_template_id=route.id) for i in range(15)])
+        db.session.commit()
+
+        # Выгрузка пишется в журнал, поэтому GET не принимается
+        assert client.get(url_for('admin.part.qr_export', product='Экспорт', format='svg')).status_code == 405
+        assert AuditLog.query.filter_by(action='Выгрузка QR').count() == 0
+
+        response = client.post(url_for('admin.part.qr_export'),
+                               data={'product': 'Экспорт', 'format': 'svg', 'csrf_token': 'fake-token'})
+        assert response.status_code == 200 and response.is_streamed
+        with zipfile.ZipFile(BytesIO(response.get_data())) as archive:
+            names = archive.namelist()
+            assert len(names) == 15 and names[0] == 'part_EXP-00_qr.svg'
+            assert b'<svg' in archive.read(names[0])
+
+        response = client.post(url_for('admin.part.qr_export'),
+                               data={'format': 'pdf', 'part_ids': ['EXP-01', 'TEST-001'], 'csrf_token': 'fake-token'})
+        pdf = response.get_data()
+        assert response.mimetype == 'application/pdf'
+        assert pdf.startswith(b'%PDF-1.4') and pdf.rstrip().endswith(b'%%EOF')
+        # Таблица xref указывает точно на начало каждого объекта
+        xref_offset = int(pdf.rsplit(b'startxref', 1)[1].split()[0])
+        entries = pdf[xref_offset:].split(b'\n')[3:]
+        for obj_id, entry in enumerate(entries, start=1):
+            if not entry[:10].isdigit():
+                break
+            assert pdf[int(entry[:10]):].startswith(b'%d 0 obj' % obj_id)
+        assert b'/Count 1' in pdf
+        assert AuditLog.query.filter_by(action='Выгрузка QR').count() == 2
+
+
+class TestAuditLogPagination:
+    """Тесты keyset-пагинации журнала аудита и журнала пользователей."""
+
+    @pytest.fixture
+    def logs(self, database):
+        user = User.query.filter_by(username='admin').first()
+        base = datetime(2025, 3, 1, 8, 0, 0)
+        rows = []
+        for i in range(30):
+            # Попарно одинаковое время: порядок внутри пары задает id
+            rows.append(AuditLog(user_id=user.id, part_id='TEST-001', action=f'Деталь {i}',
+                                 category='part', timestamp=base + timedelta(minutes=i // 2)))
+        for i, category in enumerate(['auth', 'management', 'auth', 'management', 'auth']):
+            rows.append(AuditLog(user_id=user.id, action=f'{category} {i}', category=category,
+                                 timestamp=base + timedelta(minutes=i)))
+        db.session.add_all(rows)
+        db.session.commit()
+
+    def test_log_pages_follow_cursor_without_offset(self, logs):
+        """Тест: Страницы по курсору покрывают журнал от новых к старым без повторов."""
+        expected = AuditLog.query.filter(AuditLog.category.in_(audit_service.USER_CATEGORIES)).order_by(
+            AuditLog.timestamp.desc(), AuditLog.id.desc()).all()
+        seen, cursor = [], None
+        while True:
+            page, cursor = audit_service.get_log_page(audit_service.USER_CATEGORIES, cursor=cursor, limit=2)
+            seen.extend(page)
+            if cursor is None:
+                break
+        assert [log.id for log in seen] == [log.id for log in expected]
+        assert audit_service.estimate_count(audit_service.USER_CATEGORIES) == (len(expected), False)
+
+    def test_audit_log_view_loads_older_entries(self, auth_client, logs):
+        """Тест: Страница журнала показывает 25 записей и ссылку на более старые."""
+        client = auth_client('admin')
+        first = client.get(url_for('admin.user.audit_log')).data.decode('utf-8')
+        assert 'Деталь 29' in first and 'Деталь 4<' not in first
+        assert 'Всего записей: 30.' in first
+        next_url = re.search(r'href="([^"]*cursor=[^"]*)"', first).group(1).replace('&amp;', '&')
+
+        older = client.get(next_url).data.decode('utf-8')
+        assert 'Деталь 4<' in older and 'Деталь 0<' in older and 'Деталь 5<' not in older
+        assert 'Более старые' not in older and 'К последним' in older
+
+        assert client.get(url_for('admin.user.audit_log', cursor='broken')).status_code == 400
+
+
+class TestAuditWriteBehind:
+    """Тесты отложенной записи журнала аудита (AUDIT_WRITE_BEHIND)."""
+
+    @pytest.fixture
+    def buffer(self, app, database):
+        # Буфер без фоновой задачи: сброс в тестах вызывается явно
+        buffer = audit_service.AuditBuffer(app, max_size=3, batch_size=2)
+        app.extensions['audit_buffer'] = buffer
+        event.listen(db.session, 'after_commit', audit_service._after_commit)
+        event.listen(db.session, 'after_rollback', audit_service._after_rollback)
+        yield buffer
+        event.remove(db.session, 'after_commit', audit_service._after_commit)
+        event.remove(db.session, 'after_rollback', audit_service._after_rollback)
+        app.extensions.pop('audit_buffer')
+
+    def test_records_reach_db_only_after_commit_and_flush(self, buffer):
+        """Тест: Запись попадает в буфер после коммита и в БД — после сброса пачкой."""
+        user = User.query.filter_by(username='admin').first()
+        audit_service.record(user.id, 'Проверка', category='part', part_id='TEST-001')
+        assert len(buffer) == 0
+        db.session.commit()
+        assert len(buffer) == 1
+        assert AuditLog.query.filter_by(action='Проверка').count() == 0
+
+        assert buffer.flush() == 1
+        assert AuditLog.query.filter_by(action='Проверка', part_id='TEST-001').count() == 1
+
+    def test_rollback_discards_pending_records(self, buffer):
+        """Тест: При откате транзакции запись о действии отбрасывается."""
+        user = User.query.filter_by(username='admin').first()
+        audit_service.record(user.id, 'Отмененное действие')
+        db.session.rollback()
+        db.session.commit()
+        assert len(buffer) == 0
+        assert buffer.flush() == 0
+
+    def test_bulk_records_follow_transaction(self, buffer):
+        """Тест: Пачка записей (импорт) тоже ждет коммита в буфере и отбрасывается при откате."""
+        user = User.query.filter_by(username='admin').first()
+        entries = [{'user_id': user.id, 'action': 'Создание', 'category': 'part', 'part_id': part_id,
+                    'payload': {'event': 'part_created', 'source': 'import'}} for part_id in ('B-1', 'B-2')]
+        audit_service.record_many(entries)
+        db.session.rollback()
+        assert len(buffer) == 0
+
+        audit_service.record_many(entries)
+        db.session.commit()
+        assert len(buffer) == 2
+        assert AuditLog.query.filter(AuditLog.part_id.in_(['B-1', 'B-2'])).count() == 0
+        buffer.flush()
+        assert AuditLog.query.filter(AuditLog.part_id.in_(['B-1', 'B-2'])).count() == 2
+
+    def test_overflow_is_written_synchronously(self, buffer):
+        """Тест: То, что не помещается в буфер, пишется сразу, без потерь."""
+        user = User.query.filter_by(username='admin').first()
+        for i in range(5):
+            audit_service.record(user.id, f'Действие {i}', category='management')
+        db.session.commit()
+        assert len(buffer) == 3
+        assert AuditLog.query.filter_by(category='management').count() == 2
+
+        buffer.flush()
+        actions = {log.action for log in AuditLog.query.filter_by(category='management')}
+        assert actions == {f'Действие {i}' for i in range(5)}
+
+    def test_route_actions_are_buffered(self, auth_client, buffer):
+        """Тест: Действия в обработчиках пишутся через буфер, а не в транзакции запроса."""
+        client = auth_client('admin')
+        buffer.flush()  # запись о входе
+        client.post(url_for('main.add_note', part_id='TEST-001'), data={'text': 'Заметка'})
+        assert len(buffer) == 1
+        assert AuditLog.query.filter_by(part_id='TEST-001').count() == 0
+        buffer.flush()
+        assert AuditLog.query.filter_by(part_id='TEST-001', category='part').count() == 1
+
+
+class TestAuditArchive:
+    """Тесты выгрузки старого журнала аудита в архив и поиска по архиву."""
+
+    @pytest.fixture
+    def months(self):
+        # Четыре и три месяца назад (уходят в архив) и текущий месяц
+        current = audit_archive_service.month_start(datetime.now())
+        return [audit_archive_service.add_months(current, offset) for offset in (-4, -3, 0)]
+
+    @pytest.fixture
+    def old_logs(self, app, database, tmp_path, months):
+        app.config['AUDIT_ARCHIVE_FOLDER'] = str(tmp_path)
+        user = User.query.filter_by(username='admin').first()
+        for number, (month, count) in enumerate(zip(months, (3, 2, 1))):
+            for i in range(count):
+                db.session.add(AuditLog(user_id=user.id, part_id='TEST-001', category='part',
+                                        action=f'Действие {number}.{i}', details='Сверловка' if i == 0 else None,
+                                        timestamp=month + timedelta(days=i, hours=9)))
+        db.session.commit()
+        return tmp_path
+
+    def test_archive_moves_old_months_to_compressed_files(self, old_logs, months):
+        """Тест: Месяцы старше порога уходят в audit-ГГГГ-ММ.jsonl.gz и удаляются из БД."""
+        results = audit_archive_service.archive(2)
+        assert [(r['month'], r['rows']) for r in results] == [(months[0], 3), (months[1], 2)]
+        assert sorted(p.name for p in old_logs.iterdir()) == [
+            audit_archive_service.archive_filename(month) for month in months[:2]
+        ]
+        assert [log.action for log in AuditLog.query.all()] == ['Действие 2.0']
+
+        # Запись, добавленная задним числом, дописывается к архиву месяца
+        user = User.query.filter_by(username='admin').first()
+        db.session.add(AuditLog(user_id=user.id, action='Позднее', category='auth',
+                                timestamp=months[0] + timedelta(days=20)))
+        db.session.commit()
+        assert audit_archive_service.archive(2)[0]['rows'] == 1
+        first = audit_archive_service.search_archive(date_from=months[0], date_to=months[1])
+        assert [entry['action'] for entry in first] == ['Позднее', 'Действие 0.2', 'Действие 0.1', 'Действие 0.0']
+
+    def test_search_archive_filters_entries(self, old_logs):
+        """Тест: Поиск по архиву учитывает текст, деталь и категорию и идет от новых к старым."""
+        audit_archive_service.archive(2)
+        found = audit_archive_service.search_archive(query='сверлов')
+        assert [entry['action'] for entry in found] == ['Действие 1.0', 'Действие 0.0']
+        assert isinstance(found[0]['timestamp'], datetime)
+        assert audit_archive_service.search_archive(category='auth') == []
+        assert len(audit_archive_service.search_archive(part_id='TEST-001', limit=4)) == 4
+
+    def test_archive_command_and_search_page(self, app, auth_client, old_logs, months):
+        """Тест: Команда flask audit-archive и страница поиска по архиву."""
+        result = app.test_cli_runner().invoke(args=['audit-archive', '--months', '1'])
+        assert result.exit_code == 0 and 'перенесено записей: 5' in result.output
+        assert app.test_cli_runner().invoke(args=['audit-archive', '--months', '0']).exit_code != 0
+
+        client = auth_client('admin')
+        month = months[1].strftime('%Y-%m')
+        page = client.get(url_for('admin.user.audit_archive')).data.decode('utf-8')
+        assert month in page and 'Действие 1.1' not in page
+        page = client.get(url_for('admin.user.audit_archive', month=month, q='действие 1.1')).data.decode('utf-8')
+        assert 'Действие 1.1' in page and 'Действие 1.0' not in page
+        assert client.get(url_for('admin.user.audit_archive', month='июнь')).status_code == 400
+
+
+class TestAuditPayload:
+    """Тесты структурированных данных журнала аудита (AuditLog.payload) и фильтров по ним."""
+
+    @pytest.fixture
+    def route_changes(self, auth_client, database):
+        client = auth_client('admin')
+        routes = []
+        for name in ('Маршрут А', 'Маршрут Б'):
+            route = RouteTemplate(name=name)
+            db.session.add(route)
+            db.session.commit()
+            routes.append(route.id)
+        for route_id in routes:
+            client.post(url_for('admin.part.change_part_route', part_id='TEST-001'), data={'new_route': route_id})
+        return client, routes
+
+    def test_route_change_is_recorded_with_payload(self, route_changes):
+        """Тест: Смена маршрута пишет старый и новый маршрут в payload рядом с текстом."""
+        _, (first, second) = route_changes
+        log = AuditLog.query.filter(AuditLog.details.like('Маршрут изменен%')).order_by(AuditLog.id.desc()).first()
+        assert log.payload == {'event': 'route_changed', 'route_old': first, 'route_new': second}
+
+        default_route = RouteTemplate.query.filter_by(name='Стандартный маршрут').first()
+        logs, _ = audit_service.get_log_page(audit_service.PART_CATEGORIES, payload={'event': 'route_changed', 'route_new': first})
+        assert [entry.payload['route_old'] for entry in logs] == [default_route.id]
+        assert audit_service.estimate_count(audit_service.PART_CATEGORIES, {'event': 'route_changed'}) == (2, False)
+
+    def test_event_filter_uses_expression_index(self, database):
+        """Тест: Фильтр по виду действия читает индекс по выражению (event, timestamp)."""
+        query = db.select(AuditLog.id).where(*payload_conditions(AuditLog.payload, {'event': 'route_changed'})).order_by(
+            AuditLog.timestamp.desc()).limit(10)
+        compiled = query.compile(db.engine, compile_kwargs={'literal_binds': True})
+        plan = ' '.join(row[-1] for row in db.session.execute(db.text(f"EXPLAIN QUERY PLAN {compiled}")))
+        assert 'ix_AuditLogs_event_timestamp' in plan
+
+    def test_log_view_and_history_api_filter_by_payload(self, route_changes):
+        """Тест: Журнал аудита и лента истории фильтруются параметрами ?event= и ключами payload."""
+        client, (first, second) = route_changes
+        page = client.get(url_for('admin.user.audit_log', event='route_changed', route_new=second)).data.decode('utf-8')
+        assert 'Всего записей: 1.' in page and 'на &#39;Маршрут Б&#39;' in page
+        assert client.get(url_for('admin.user.audit_log', route_new='Б')).status_code == 400
+
+        data = client.get(url_for('main.api_part_history', part_id='TEST-001', event='route_changed')).get_json()
+        assert [entry['details'] for entry in data['entries']] == [
+            "Маршрут изменен с 'Маршрут А' на 'Маршрут Б'.", "Маршрут изменен с 'Стандартный маршрут' на 'Маршрут А'."
+        ]
+
+
+class TestFullTextSearch:
+    """Тесты полнотекстового поиска по журналу аудита и примечаниям (зеркало FTS5 в SQLite)."""
+
+    @pytest.fixture
+    def searchable(self, database):
+        admin = User.query.filter_by(username='admin').first()
+        for i in range(5):
+            db.session.add(AuditLog(user_id=admin.id, part_id='TEST-001', action='Редактирование', category='part',
+                                    details='Изменена сверловка отверстий' + ', сверловка' * i))
+        db.session.add(AuditLog(user_id=admin.id, part_id='TEST-001', action='Создание', category='part',
+                                details='Деталь создана после резки'))
+        db.session.add(PartNote(part_id='TEST-001', user_id=admin.id, text='Сверловку перенести на второй станок'))
+        db.session.add(PartNote(part_id='TEST-001', user_id=admin.id, text='Резка без замечаний'))
+        db.session.commit()
+
+    def test_russian_word_forms_match_and_rank(self, searchable):
+        """Тест: Поиск находит другие формы слова, самые релевантные записи идут первыми."""
+        assert search_service.fts_query('Сверловки отверстий') == '"сверловк"* "отверст"*'
+        entries, next_cursor = search_service.search('сверловки')
+        assert next_cursor is None
+        assert sorted(entry['type'] for entry in entries) == ['audit'] * 5 + ['note']
+        audit_entries = [entry for entry in entries if entry['type'] == 'audit']
+        assert audit_entries[0]['details'].count('сверловка') == 5
+        assert [entry['rank'] for entry in entries] == sorted((entry['rank'] for entry in entries), reverse=True)
+
+    def test_keyset_pages_do_not_overlap(self, searchable):
+        """Тест: Страницы результатов по курсору не пересекаются и покрывают все совпадения."""
+        seen, cursor = [], None
+        while True:
+            entries, cursor = search_service.search('сверловка', cursor=cursor, limit=2)
+            seen.extend((entry['type'], entry['id']) for entry in entries)
+            if cursor is None:
+                break
+        assert len(seen) == len(set(seen)) == 6
+        with pytest.raises(ValueError):
+            search_service.search('сверловка', cursor='не-курсор')
+        with pytest.raises(ValueError):
+            search_service.search('!!!')
+
+    def test_mirror_follows_updates_and_deletes(self, searchable):
+        """Тест: Триггеры держат зеркало FTS5 в актуальном состоянии и после перестроения."""
+        note = PartNote.query.filter(PartNote.text.like('Резка%')).first()
+        note.text = 'Фрезеровка без замечаний'
+        db.session.commit()
+        assert [entry['id'] for entry in search_service.search('фрезеровка', scopes=('note',))[0]] == [note.id]
+        assert search_service.search('резка', scopes=('note',))[0] == []
+
+        AuditLog.query.filter(AuditLog.action == 'Создание').delete()
+        db.session.commit()
+        assert search_service.search('резки', scopes=('audit',))[0] == []
+        assert search_service.rebuild_index() is True
+        assert len(search_service.search('сверловка', scopes=('audit',))[0]) == 5
+
+    def test_api_and_log_pages(self, searchable, auth_client):
+        """Тест: API поиска, поиск на странице журнала и по примечаниям на странице истории."""
+        client = auth_client('admin')
+        data = client.get(url_for('main.api_search', q='сверловка', limit=4)).get_json()
+        assert len(data['results']) == 4 and data['next_cursor']
+        assert data['results'][0]['part_id'] == 'TEST-001'
+        assert client.get(url_for('main.api_search', q='')).status_code == 400
+
+        page = client.get(url_for('admin.user.audit_log', q='резки')).data.decode('utf-8')
+        assert 'Деталь создана после резки' in page and 'Изменена сверловка' not in page
+        page = client.get(url_for('main.history', part_id='TEST-001', q='сверловкой станок')).data.decode('utf-8')
+        assert 'Сверловку перенести' in page and 'Резка без замечаний' not in page
+
+    def test_api_without_audit_permission(self, searchable, auth_client):
+        """Тест: Пользователь без права просмотра журнала находит через API только примечания."""
+        client = auth_client('operator')
+        data = client.get(url_for('main.api_search', q='сверловка')).get_json()
+        assert [entry['type'] for entry in data['results']] == ['note']
+        assert client.get(url_for('main.api_search', q='сверловка', scope='audit')).status_code == 403
+
+
 class TestHierarchyFeatures:
     """Группа тестов для проверки функционала иерархии деталей."""
 
@@ -261,4 +770,338 @@ class TestHierarchyFeatures:
         assert 'Деталь PARENT-CASCADE и вся ее история удалены' in response.data.decode('utf-8')
 
         assert db.session.get(Part, 'PARENT-CASCADE') is None
-        assert db.session.get(Part, 'CHILD-CASCADE') is None
\ No newline at end of file
+        assert db.session.get(Part, 'CHILD-CASCADE') is None
+
+    def test_part_tree_loaded_with_single_query(self, client, app, database):
+        """Тест: Весь состав изделия загружается одним рекурсивным запросом и отдается через API."""
+        db.session.add_all([
+            Part(part_id='TREE-A', product_designation='Дерево', name='Б-узел', material='Ст3', parent_id='TEST-001'),
+            Part(part_id='TREE-B', product_designation='Дерево', name='А-узел', material='Ст3', parent_id='TEST-001'),
+            Part(part_id='TREE-A1', product_designation='Дерево', name='Винт', material='Ст3',
+                 parent_id='TREE-A', quantity_total=4),
+        ])
+        db.session.commit()
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            tree = query_service.get_part_subtree('TEST-001')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        assert len(statements) == 1
+        assert tree['child_count'] == 2
+        assert tree['descendant_count'] == 3
+        assert [child['part_id'] for child in tree['children']] == ['TREE-B', 'TREE-A']
+        grandchild = tree['children'][1]['children'][0]
+        assert grandchild['part_id'] == 'TREE-A1' and grandchild['depth'] == 2
+
+        response = client.get(url_for('main.api_part_tree', part_id='TEST-001'))
+        assert response.status_code == 200
+        assert response.get_json()['children'][1]['children'][0]['quantity_total'] == 4
+        assert client.get(url_for('main.api_part_tree', part_id='NOPE')).status_code == 404
+        # Обозначение изделия, оканчивающееся на /tree, по-прежнему открывает список деталей изделия
+        assert 'parts' in client.get(url_for('main.api_parts_for_product', product_designation='ИЗД/tree')).get_json()
+
+        history_page = client.get(url_for('main.history', part_id='TEST-001')).data.decode('utf-8')
+        assert 'Винт (TREE-A1)' in history_page
+
+    def test_closure_table_maintained_on_add_move_and_delete(self, auth_client, database):
+        """Тест: Таблица замыкания обновляется при добавлении узлов, переносе через форму редактирования и удалении."""
+        client = auth_client('admin')
+        hierarchy_service.rebuild_closure()
+
+        def add_child(parent_id, part_id):
+            client.post(
+                url_for('admin.part.add_child_part', parent_part_id=parent_id),
+                data={'part_id': part_id, 'name': part_id, 'material': 'Ст3',
+                      'quantity_total': 1, 'csrf_token': 'fake-token'},
+                follow_redirects=True
+            )
+
+        add_child('TEST-001', 'CL-A')
+        add_child('CL-A', 'CL-A1')
+        add_child('CL-A1', 'CL-A1X')
+        add_child('TEST-001', 'CL-B')
+
+        assert [p.part_id for p in hierarchy_service.get_ancestors('CL-A1X')] == ['TEST-001', 'CL-A', 'CL-A1']
+        assert len(hierarchy_service.get_descendant_ids('TEST-001')) == 4
+        assert set(hierarchy_service.get_descendant_ids('CL-A')) == {'CL-A1', 'CL-A1X'}
+
+        def set_parent(part_id, parent_id):
+            return client.post(
+                url_for('admin.part.edit_part', part_id=part_id),
+                data={'product_designation': 'Тестовое изделие', 'name': part_id, 'material': 'Ст3',
+                      'parent_id': parent_id, 'csrf_token': 'fake-token'},
+                follow_redirects=True
+            ).data.decode('utf-8')
+
+        # Перенос поддерева CL-A1 под CL-B через форму редактирования
+        progress_service.get_assembly_progress_map(['TEST-001'])
+        assert db.session.get(AssemblyProgress, 'TEST-001') is not None
+        set_parent('CL-A1', 'CL-B')
+        assert [p.part_id for p in hierarchy_service.get_ancestors('CL-A1X')] == ['TEST-001', 'CL-B', 'CL-A1']
+        assert hierarchy_service.get_descendant_ids('CL-A') == []
+        assert db.session.get(Part, 'CL-A1').parent_id == 'CL-B'
+        assert db.session.get(AssemblyProgress, 'TEST-001') is None
+        assert AuditLog.query.filter(AuditLog.details.like("Состав: 'CL-A' -> 'CL-B'%")).count() == 1
+
+        # Узел нельзя перенести внутрь собственного состава
+        assert 'внутрь его собственного состава' in set_parent('CL-B', 'CL-A1X')
+        assert db.session.get(Part, 'CL-B').parent_id == 'TEST-001'
+
+        # Удаление поддерева удаляет и его строки замыкания
+        client.post(url_for('admin.part.delete_part', part_id='CL-B'), data={'csrf_token': 'fake-token'})
+        assert len(hierarchy_service.get_descendant_ids('TEST-001')) == 1
+        assert PartClosure.query.filter(PartClosure.descendant_id.in_(['CL-B', 'CL-A1', 'CL-A1X'])).count() == 0
+
+
+class TestPartImport:
+    """Тесты массового импорта деталей из файла."""
+
+    CSV_HEADER = "Спецификация\nИзделие,Импорт-1\nОбозначение,Наименование,Кол-во,Прим,Размер,Операции\n"
+
+    def _upload(self, client, body, filename='bom.csv', **options):
+        return client.post(
+            url_for('admin.part.upload_excel'),
+            data={'file': (BytesIO((self.CSV_HEADER + body).encode('utf-8')), filename),
+                  'csrf_token': 'fake-token', **options},
+            content_type='multipart/form-data',
+            follow_redirects=True
+        )
+
+    def test_import_adds_new_and_skips_duplicates(self, auth_client, database):
+        """Тест: Импорт добавляет новые детали, а существующие, повторные и неполные строки пропускает."""
+        client = auth_client('admin')
+        response = self._upload(client, (
+            "IMP-1,Корпус,2,Ст3,10x10,\"резка, Гибка\"\n"
+            "IMP-2,Крышка,,,,\n"
+            "IMP-1,Повтор в файле,1,,,\n"
+            "TEST-001,Уже в базе,1,,,\n"
+            "IMP-3,,1,,,\n"
+            ",,,,,\n"
+        ))
+        assert 'Добавлено: 2, пропущено дубликатов: 3' in response.data.decode('utf-8')
+
+        part = db.session.get(Part, 'IMP-1')
+        assert part.product_designation == 'Импорт-1'
+        assert part.quantity_total == 2 and part.size == '10x10'
+        # Существующий этап найден без учета регистра, новый создан
+        assert part.route_template.name == 'резка -> Гибка'
+        assert [rs.stage.name for rs in sorted(part.route_template.stages, key=lambda rs: rs.order)] == ['Резка', 'Гибка']
+
+        part2 = db.session.get(Part, 'IMP-2')
+        assert part2.material == 'Не указан' and part2.quantity_total == 1
+        assert part2.route_template.is_default
+
+        assert AuditLog.query.filter(AuditLog.part_id.in_(['IMP-1', 'IMP-2'])).count() == 2
+        assert PartClosure.query.filter_by(descendant_id='IMP-1').count() == 1
+
+    def test_reimport_reuses_routes(self, auth_client, database):
+        """Тест: Повторяющиеся строки операций разрешаются в один и тот же маршрут."""
+        client = auth_client('admin')
+        self._upload(client, "IMP-A,Деталь,1,,,\"Гибка, Сварка\"\n")
+        self._upload(client, "IMP-B,Деталь,1,,,\"Гибка, Сварка\"\nIMP-C,Деталь,1,,,\"Гибка, Сварка\"\n")
+
+        route_ids = {db.session.get(Part, pid).route_template_id for pid in ('IMP-A', 'IMP-B', 'IMP-C')}
+        assert len(route_ids) == 1
+        assert RouteTemplate.query.filter_by(name='Гибка -> Сварка').count() == 1
+        assert Stage.query.filter_by(name='Сварка').count() == 1
+
+    def test_import_matches_routes_by_operations_signature(self, auth_client, database):
+        """Тест: Маршрут находится по сигнатуре операций без учета регистра, мемо сбрасывается при правке маршрута."""
+        client = auth_client('admin')
+        stage1 = Stage.query.filter_by(name='Test Stage 1').first()
+        stage2 = Stage.query.filter_by(name='Test Stage 2').first()
+        client.post(url_for('admin.management.add_route'),
+                    data={'name': 'Ручной маршрут', 'stages': [stage1.id, stage2.id], 'csrf_token': 'fake-token'})
+        route = RouteTemplate.query.filter_by(name='Ручной маршрут').first()
+        assert route.operations_signature == route_service.operations_signature(['Test Stage 1', 'Test Stage 2'])
+
+        self._upload(client, "SIG-1,Деталь,1,,,\"test stage 1, TEST STAGE 2\"\n")
+        assert db.session.get(Part, 'SIG-1').route_template_id == route.id
+
+        # После изменения состава маршрута старая сигнатура не должна браться из мемо
+        client.post(url_for('admin.management.edit_route', route_id=route.id),
+                    data={'name': 'Ручной маршрут', 'stages': [stage1.id], 'csrf_token': 'fake-token'})
+        self._upload(client, "SIG-2,Деталь,1,,,\"Test Stage 1, Test Stage 2\"\n")
+        new_route_id = db.session.get(Part, 'SIG-2').route_template_id
+        assert new_route_id != route.id
+        assert db.session.get(RouteTemplate, new_route_id).operations_signature == \
+            route_service.operations_signature(['Test Stage 1', 'Test Stage 2'])
+
+    def test_import_commits_in_chunks_and_reports_progress(self, app, auth_client, database):
+        """Тест: Импорт идет пачками, каждая пачка отправляет событие 'import_progress'."""
+        client = auth_client('admin')
+        socket_client = socketio.test_client(app, flask_test_client=client)
+        app.config['IMPORT_CHUNK_SIZE'] = 2
+        try:
+            response = self._upload(client, "".join(f"CH-{i},Деталь,1,,,\n" for i in range(5)) + "CH-X,Деталь,много,,,\n")
+        finally:
+            app.config['IMPORT_CHUNK_SIZE'] = 1000
+
+        html = response.data.decode('utf-8')
+        assert 'Добавлено: 5' in html
+        assert 'Строк с ошибками: 1' in html
+        assert Part.query.filter(Part.part_id.like('CH-%')).count() == 5
+
+        events = [event['args'][0] for event in socket_client.get_received() if event['name'] == 'import_progress']
+        assert [event['added'] for event in events] == [2, 4, 5]
+        assert events[-1]['done'] and events[-1]['rows'] == 6 and events[-1]['errors'] == 1
+        socket_client.disconnect()
+
+    def test_import_xlsx_sheets_as_products(self, auth_client, database):
+        """Тест: Каждый лист книги .xlsx импортируется как отдельное изделие."""
+        workbook = openpyxl.Workbook()
+        first = workbook.active
+        first.title = 'Лист1'
+        for row in (["Спецификация"], ["Изделие", "Рама"],
+                    ["Обозначение", "Наименование", "Кол-во", "Прим", "Операции"],
+                    [1001, "Стойка", 3.0, "Ст3", "Резка"],
+                    [None, None, None, None, None]):
+            first.append(row)
+        second = workbook.create_sheet('Крепеж')
+        for row in (["Спецификация"], [],
+                    ["Обозначение", "Наименование", "Кол-во"],
+                    ["XL-2", "Болт", 10]):
+            second.append(row)
+        workbook.create_sheet('Пояснения').append(["Лист без заголовков"])
+        buffer = BytesIO()
+        workbook.save(buffer)
+
+        client = auth_client('admin')
+        response = client.post(
+            url_for('admin.part.upload_excel'),
+            data={'file': (BytesIO(buffer.getvalue()), 'bom.xlsx'), 'csrf_token': 'fake-token'},
+            content_type='multipart/form-data',
+            follow_redirects=True
+        )
+        assert 'Добавлено: 2' in response.data.decode('utf-8')
+
+        # Числовое обозначение из Excel не превращается в '1001.0'
+        part = db.session.get(Part, '1001')
+        assert part.product_designation == 'Рама' and part.quantity_total == 3
+        assert db.session.get(Part, 'XL-2').product_designation == 'Крепеж'
+
+    def test_import_builds_hierarchy_from_positions(self, auth_client, database):
+        """Тест: Колонка позиции "1.2.3" задает родителей за один проход, включая существующие детали."""
+        client = auth_client('admin')
+        hierarchy_service.rebuild_closure()
+        header = "Спецификация\nИзделие,Сборка\nПоз.,Обозначение,Наименование,Кол-во\n"
+        body = (
+            "1,BOM-1,Рама,1\n"
+            "1.1,BOM-11,Стойка,2\n"
+            "1.1.1,BOM-111,Пластина,4\n"
+            "1.2,BOM-12,Балка,1\n"
+            "2,TEST-001,Уже в базе,1\n"
+            "2.1,BOM-21,Новый узел существующей детали,1\n"
+        )
+        client.post(
+            url_for('admin.part.upload_excel'),
+            data={'file': (BytesIO((header + body).encode('utf-8')), 'bom.csv'), 'csrf_token': 'fake-token'},
+            content_type='multipart/form-data',
+            follow_redirects=True
+        )
+
+        parents = {pid: db.session.get(Part, pid).parent_id
+                   for pid in ('BOM-1', 'BOM-11', 'BOM-111', 'BOM-12', 'BOM-21')}
+        assert parents == {'BOM-1': None, 'BOM-11': 'BOM-1', 'BOM-111': 'BOM-11',
+                           'BOM-12': 'BOM-1', 'BOM-21': 'TEST-001'}
+        assert [p.part_id for p in hierarchy_service.get_ancestors('BOM-111')] == ['BOM-1', 'BOM-11']
+        assert len(hierarchy_service.get_descendant_ids('BOM-1')) == 3
+        assert [p.part_id for p in hierarchy_service.get_ancestors('BOM-21')] == ['TEST-001']
+
+    def test_import_builds_hierarchy_from_indentation(self, auth_client, database):
+        """Тест: Без колонок позиции и уровня иерархия берется из отступа наименования, если это включено."""
+        client = auth_client('admin')
+        body = (
+            "IND-1,Узел,1,,,\n"
+            "IND-2,  Деталь узла,1,,,\n"
+            "IND-3,    Крепеж детали,1,,,\n"
+            "IND-4,  Вторая деталь узла,1,,,\n"
+        )
+        # По умолчанию случайные пробелы не делают плоский файл деревом
+        self._upload(client, body)
+        assert db.session.get(Part, 'IND-2').parent_id is None
+        assert db.session.get(Part, 'IND-3').parent_id is None
+        Part.query.filter(Part.part_id.like('IND-%')).delete(synchronize_session=False)
+        PartClosure.query.filter(PartClosure.descendant_id.like('IND-%')).delete(synchronize_session=False)
+        db.session.commit()
+
+        self._upload(client, body, indent_hierarchy='y')
+        assert db.session.get(Part, 'IND-2').parent_id == 'IND-1'
+        assert db.session.get(Part, 'IND-3').parent_id == 'IND-2'
+        assert db.session.get(Part, 'IND-4').parent_id == 'IND-1'
+        assert db.session.get(Part, 'IND-2').name == 'Деталь узла'
+
+    def test_dry_run_returns_report_without_writing(self, auth_client, database):
+        """Тест: Пробный импорт возвращает CSV-отчет и ничего не записывает в БД."""
+        client = auth_client('admin')
+        body = (
+            "DRY-1,Корпус,2,,,\"Резка, Анодирование\"\n"
+            "DRY-1,Повтор,1,,,\n"
+            "TEST-001,Уже в базе,1,,,\n"
+            "DRY-2,Крышка,два,,,\n"
+            "DRY-3,,1,,,\n"
+            "DRY-4,Вал,2.0,,,\n"
+            "DRY-5,Ось,1e2,,,\n"
+            "DRY-6,Втулка, 3 ,,,\n"
+        )
+        response = client.post(
+            url_for('admin.part.upload_excel'),
+            data={'file': (BytesIO((self.CSV_HEADER + body).encode('utf-8')), 'bom.csv'),
+                  'dry_run': 'y', 'csrf_token': 'fake-token'},
+            content_type='multipart/form-data'
+        )
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+
+        lines = response.data.decode('utf-8-sig').splitlines()
+        assert lines[0] == 'Раздел,Изделие,Строка,Обозначение,Наименование,Кол-во,Операции,Результат'
+        results = {line.split(',')[2]: line.rsplit(',', 1)[1] for line in lines[1:] if line.startswith('Строка')}
+        assert results == {
+            '4': 'Будет добавлена', '5': 'Дубликат в файле', '6': 'Уже существует',
+            '7': 'Ошибка: некорректное количество', '8': 'Пропущена: нет обозначения или наименования',
+            '9': 'Ошибка: некорректное количество', '10': 'Ошибка: некорректное количество', '11': 'Будет добавлена'
+        }
+        assert 'Новый маршрут,,,,,,Резка -> Анодирование,' in lines
+        assert 'Новый этап,,,,,,Анодирование,' in lines
+
+        assert db.session.get(Part, 'DRY-1') is None
+        assert Stage.query.filter_by(name='Анодирование').first() is None
+
+    def test_update_existing_mode_applies_changes(self, auth_client, database):
+        """Тест: Режим обновления меняет существующие детали, пишет аудит и пересчитывает статусы этапов."""
+        client = auth_client('admin')
+        stage = Stage.query.filter_by(name='Резка').first()
+        progress_service.apply_stage_completion(db.session.get(Part, 'TEST-001'), stage, 1)
+        db.session.commit()
+        self._upload(client, "UPS-1,Без изменений,1,Ст3,,\n")
+
+        body = (
+            "TEST-001,Крышка новая,3,Ст3,,\"Резка, Сверловка\"\n"
+            "UPS-1,Без изменений,1,Ст3,,\n"
+            "UPS-2,Новая деталь,1,,,\n"
+        )
+        response = client.post(
+            url_for('admin.part.upload_excel'),
+            data={'file': (BytesIO((self.CSV_HEADER + body).encode('utf-8')), 'bom.csv'),
+                  'update_existing': 'y', 'csrf_token': 'fake-token'},
+            content_type='multipart/form-data',
+            follow_redirects=True
+        )
+        assert 'Добавлено: 1, обновлено: 1, без изменений или пропущено: 1' in response.data.decode('utf-8')
+
+        part = db.session.get(Part, 'TEST-001')
+        assert part.name == 'Крышка новая' and part.quantity_total == 3
+        assert part.product_designation == 'Тестовое изделие'
+        assert part.route_template.name == 'Резка -> Сверловка'
+
+        log = AuditLog.query.filter_by(part_id='TEST-001', action='Редактирование').one()
+        assert "Наименование: 'Крышка тестовая' -> 'Крышка новая'" in log.details
+        assert "Кол-во: '1' -> '3'" in log.details
+        assert "Маршрут: 'Стандартный маршрут' -> 'Резка -> Сверловка'" in log.details
+
+        # 1 из 3 шт. — этап больше не считается завершенным
+        assert db.session.get(PartStageProgress, ('TEST-001', stage.id)).status == 'in_progress'
@@ -1,6 +1,9 @@
 import pytest
+from datetime import datetime, timedelta
 from flask import url_for
-from app.models.models import Part, User, Stage, RouteTemplate, StatusHistory, AuditLog, Role, Permission
+from app.models.models import (Part, User, Stage, RouteTemplate, StatusHistory, AuditLog, Role, Permission,
+                               PartStageProgress, AssemblyProgress, PartNote, ResponsibleHistory)
+from app.services import progress_service, hierarchy_service, query_service
 from app import db
 
 class TestCoreWorkflow:
@@ -50,4 +53,270 @@ class TestCoreWorkflow:
         assert 'Резка' in response_text # Проверяем, что предложен правильный следующий этап
         assert 'name="quantity"' in response_text
         assert 'name="operator_name"' in response_text
-        assert 'Все этапы завершены' not in response_text
\ No newline at end of file
+        assert 'Все этапы завершены' not in response_text
+
+class TestStageProgress:
+    """Тесты материализованного прогресса по этапам (PartStageProgress)."""
+
+    def _confirm(self, client, stage, quantity):
+        return client.post(
+            url_for('main.confirm_stage', part_id='TEST-001', stage_id=stage.id),
+            data={'operator_name': 'Оператор', 'quantity': quantity, 'csrf_token': 'fake-token'},
+            follow_redirects=True
+        )
+
+    def test_confirm_stage_updates_progress_and_api(self, client, database):
+        """Тест: Подтверждение этапа обновляет прогресс, а API читает его без истории."""
+        stage = Stage.query.filter_by(name='Резка').first()
+        self._confirm(client, stage, 1)
+
+        progress = db.session.get(PartStageProgress, ('TEST-001', stage.id))
+        assert progress is not None
+        assert progress.qty_done == 1
+        assert progress.status == 'completed'
+        assert progress.last_timestamp is not None
+
+        response = client.get(url_for('main.api_parts_for_product', product_designation='Тестовое изделие'))
+        stages = response.get_json()['parts'][0]['route_stages']
+        assert stages[0] == {'name': 'Резка', 'status': 'completed', 'qty_done': 1}
+        assert stages[1]['status'] == 'pending'
+
+        # Следующим этапом на странице сканирования должен стать второй этап маршрута
+        response_scan = client.get(url_for('main.select_stage', part_id='TEST-001'))
+        assert 'Сверловка' in response_scan.data.decode('utf-8')
+
+    def test_cancel_stage_recalculates_progress(self, auth_client, database):
+        """Тест: Отмена этапа пересчитывает прогресс по оставшейся истории."""
+        client = auth_client('admin')
+        stage = Stage.query.filter_by(name='Резка').first()
+        self._confirm(client, stage, 1)
+        history_entry = StatusHistory.query.filter_by(part_id='TEST-001').first()
+
+        client.post(
+            url_for('admin.part.cancel_stage', history_id=history_entry.id),
+            data={'csrf_token': 'fake-token'},
+            follow_redirects=True
+        )
+
+        progress = db.session.get(PartStageProgress, ('TEST-001', stage.id))
+        assert progress.qty_done == 0
+        assert progress.status == 'pending'
+        assert progress.last_timestamp is None
+
+    def test_rebuild_stage_progress(self, database):
+        """Тест: Массовая перестройка восстанавливает прогресс из истории."""
+        stage = Stage.query.filter_by(name='Сверловка').first()
+        db.session.add_all([
+            StatusHistory(part_id='TEST-001', status='Сверловка', operator_name='A', quantity=1),
+            StatusHistory(part_id='TEST-001', status='Неизвестный этап', operator_name='A', quantity=1),
+        ])
+        db.session.commit()
+
+        assert progress_service.rebuild_stage_progress() == 1
+        progress = db.session.get(PartStageProgress, ('TEST-001', stage.id))
+        assert progress.qty_done == 1
+        assert progress.status == 'completed'
+
+
+class TestAssemblyProgress:
+    """Тесты сводного прогресса сборки по всему поддереву (кэш AssemblyProgress)."""
+
+    @pytest.fixture
+    def assembly(self, database):
+        # Сборка: TEST-001 (1 шт.) -> узел ASM-1 (4 шт.) -> подузел ASM-2 (5 шт.)
+        route = RouteTemplate.query.filter_by(name='Стандартный маршрут').first()
+        hierarchy_service.rebuild_closure()
+        for part_id, parent_id, quantity in (('ASM-1', 'TEST-001', 4), ('ASM-2', 'ASM-1', 5)):
+            db.session.add(Part(
+                part_id=part_id, product_designation='Тестовое изделие', name=part_id,
+                material='Ст3', quantity_total=quantity, parent_id=parent_id,
+                route_template_id=route.id
+            ))
+            hierarchy_service.add_part(part_id, parent_id)
+        db.session.commit()
+
+    def test_dashboard_and_api_roll_up_subtree(self, client, assembly):
+        """Тест: Панель и API показывают суммы по всему составу, а не только по корню."""
+        response = client.get(url_for('main.dashboard'))
+        html = response.data.decode('utf-8')
+        assert '0 из 10' in html
+        assert 'узлов в составе: 3' in html
+
+        response = client.get(url_for('main.api_parts_for_product', product_designation='Тестовое изделие'))
+        assert response.get_json()['parts'][0]['assembly'] == {
+            'part_count': 3, 'quantity_total': 10, 'quantity_completed': 0
+        }
+
+    def test_read_path_does_not_commit(self, assembly):
+        """Тест: Пересчет кэша при чтении не фиксирует чужие несохраненные изменения сессии."""
+        db.session.get(Part, 'ASM-1').name = 'Несохраненное имя'
+        assert progress_service.get_assembly_progress_map(['TEST-001'])['TEST-001'].part_count == 3
+        db.session.rollback()
+        assert db.session.get(Part, 'ASM-1').name == 'ASM-1'
+        assert db.session.get(AssemblyProgress, 'TEST-001') is None
+
+    def test_descendant_confirm_invalidates_root(self, client, assembly):
+        """Тест: Подтверждение этапа у вложенного узла сбрасывает кэш корня."""
+        progress_service.get_assembly_progress_map(['TEST-001'])
+        stage = Stage.query.filter_by(name='Резка').first()
+        client.post(
+            url_for('main.confirm_stage', part_id='ASM-2', stage_id=stage.id),
+            data={'operator_name': 'Оператор', 'quantity': 3, 'csrf_token': 'fake-token'}
+        )
+        assert db.session.get(AssemblyProgress, 'TEST-001') is None
+
+        assembly_progress = progress_service.get_assembly_progress_map(['TEST-001'])['TEST-001']
+        assert assembly_progress.quantity_completed == 3
+        assert assembly_progress.quantity_total == 10
+
+    def test_overcompleted_node_is_capped(self, assembly):
+        """Тест: Перевыполнение одного узла не завышает готовность сборки."""
+        db.session.get(Part, 'ASM-1').quantity_completed = 12
+        db.session.commit()
+        assembly_progress = progress_service.get_assembly_progress_map(['TEST-001'])['TEST-001']
+        assert assembly_progress.quantity_completed == 4
+
+
+class TestPartsApiPagination:
+    """Тесты keyset-пагинации, фильтров и сортировки API /api/parts/<изделие>."""
+
+    @pytest.fixture
+    def many_parts(self, database):
+        route = RouteTemplate.query.filter_by(name='Стандартный маршрут').first()
+        for i in range(5):
+            db.session.add(Part(
+                part_id=f'PG-{i:03d}', product_designation='Пагинация',
+                name=f'Деталь {4 - i}', material='Ст3' if i % 2 else 'Алюминий',
+                route_template_id=route.id
+            ))
+        db.session.commit()
+
+    def _get(self, client, **params):
+        return client.get(url_for('main.api_parts_for_product', product_designation='Пагинация', **params))
+
+    def test_keyset_pages_cover_all_parts(self, client, many_parts):
+        """Тест: Страницы по курсору возвращают все детали без повторов, total — только на первой."""
+        first = self._get(client, limit=2).get_json()
+        assert first['total'] == 5
+        assert [p['part_id'] for p in first['parts']] == ['PG-000', 'PG-001']
+
+        seen = [p['part_id'] for p in first['parts']]
+        cursor = first['next_cursor']
+        while cursor:
+            page = self._get(client, limit=2, cursor=cursor).get_json()
+            assert page['total'] is None
+            seen.extend(p['part_id'] for p in page['parts'])
+            cursor = page['next_cursor']
+        assert seen == [f'PG-{i:03d}' for i in range(5)]
+
+    def test_filters_and_sort(self, client, many_parts):
+        """Тест: Фильтр по материалу и сортировка по наименованию выполняются на сервере."""
+        data = self._get(client, material='Ст3', sort='name', order='desc', limit=1).get_json()
+        assert data['total'] == 2
+        assert data['parts'][0]['part_id'] == 'PG-001'  # 'Деталь 3'
+
+        second = self._get(client, material='Ст3', sort='name', order='desc', limit=1,
+                           cursor=data['next_cursor']).get_json()
+        assert [p['part_id'] for p in second['parts']] == ['PG-003']
+        assert second['next_cursor'] is None
+
+        by_text = self._get(client, q='Деталь 0').get_json()
+        assert [p['part_id'] for p in by_text['parts']] == ['PG-004']
+
+    def test_invalid_sort_returns_400(self, client, many_parts):
+        """Тест: Недопустимое поле сортировки отклоняется."""
+        assert self._get(client, sort='password_hash').status_code == 400
+
+    def test_filter_values_are_validated_and_escaped(self, client, many_parts):
+        """Тест: Некорректный ответственный дает понятную ошибку, % и _ в поиске не работают как шаблон."""
+        response = self._get(client, responsible='abc')
+        assert response.status_code == 400
+        assert response.get_json()['error'] == "Некорректный фильтр ответственного: 'abc'."
+        assert self._get(client, q='%').get_json()['parts'] == []
+        assert self._get(client, q='PG_0').get_json()['parts'] == []
+        assert self._get(client, q='pg-00').get_json()['total'] == 5
+
+    def test_malformed_cursor_returns_400(self, client, many_parts):
+        """Тест: Курсор, который не распаковывается в пару значений, отклоняется, а не роняет API."""
+        assert self._get(client, cursor='NQ==').status_code == 400  # base64 от '5'
+        assert self._get(client, cursor=query_service.encode_cursor([1, 2, 3])).status_code == 400
+
+    @pytest.mark.parametrize('order', ['asc', 'desc'])
+    def test_pages_through_null_sort_values(self, client, many_parts, order):
+        """Тест: Детали без значения поля сортировки не теряются и идут в конце в обоих направлениях."""
+        for i in range(5, 8):
+            db.session.add(Part(part_id=f'PG-{i:03d}', product_designation='Пагинация', name=f'Деталь {i}',
+                                material='Ст3'))
+        db.session.commit()
+        # Значение по умолчанию у current_status подставляется при вставке, поэтому NULL — отдельным UPDATE
+        Part.query.filter(Part.part_id.in_(['PG-005', 'PG-006', 'PG-007'])).update({'current_status': None})
+        db.session.commit()
+
+        seen, cursor = [], None
+        while True:
+            params = {'cursor': cursor} if cursor else {}
+            page = self._get(client, sort='status', order=order, limit=2, **params)
+            assert page.status_code == 200
+            data = page.get_json()
+            seen.extend(p['part_id'] for p in data['parts'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        assert sorted(seen) == [f'PG-{i:03d}' for i in range(8)]
+        assert seen[-3:] == (['PG-005', 'PG-006', 'PG-007'] if order == 'asc' else ['PG-007', 'PG-006', 'PG-005'])
+
+
+class TestPartHistoryPagination:
+    """Тесты keyset-пагинации ленты истории детали и API подгрузки."""
+
+    @pytest.fixture
+    def long_history(self, database):
+        part = db.session.get(Part, 'TEST-001')
+        user = User.query.filter_by(username='admin').first()
+        base = datetime(2025, 1, 1, 12, 0, 0)
+        # Записи разных типов с одинаковыми временами проверяют разрешение равенств по (type, id)
+        for i in range(6):
+            moment = base + timedelta(minutes=i // 2)
+            db.session.add(StatusHistory(part_id=part.part_id, status=f'Этап {i}', operator_name='Иванов',
+                                         quantity=1, timestamp=moment))
+            db.session.add(AuditLog(part_id=part.part_id, user_id=user.id, action=f'Действие {i}',
+                                    category='part', timestamp=moment))
+        db.session.add(PartNote(part_id=part.part_id, user_id=user.id, text='Примечание', timestamp=base))
+        db.session.add(ResponsibleHistory(part_id=part.part_id, user_id=user.id, timestamp=base))
+        db.session.commit()
+        return part
+
+    def test_pages_cover_history_in_order(self, client, long_history):
+        """Тест: Страницы по курсору отдают всю историю от новых записей к старым без повторов."""
+        expected, _ = query_service.get_history_page('TEST-001', limit=query_service.HISTORY_PAGE_MAX_LIMIT)
+        assert len(expected) == 14
+
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 3} | ({'cursor': cursor} if cursor else {})
+            page = client.get(url_for('main.api_part_history', part_id='TEST-001', **params)).get_json()
+            assert len(page['entries']) <= 3
+            seen.extend((entry['type'], entry['id']) for entry in page['entries'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        assert seen == [(entry['type'], entry['id']) for entry in expected]
+        keys = [(entry['timestamp'], entry['type'], entry['id']) for entry in expected]
+        assert keys == sorted(keys, reverse=True)
+
+    def test_history_page_renders_first_page_only(self, client, long_history, monkeypatch):
+        """Тест: Страница истории выводит только первую страницу ленты и маркер подгрузки."""
+        monkeypatch.setattr(query_service, 'HISTORY_PAGE_DEFAULT_LIMIT', 4)
+        html = client.get(url_for('main.history', part_id='TEST-001')).data.decode('utf-8')
+        assert html.count('Выполнено: 1 шт.') + html.count('⚙ Действие') == 4
+        assert 'id="history-more"' in html
+
+        page = client.get(url_for('main.api_part_history', part_id='TEST-001', limit=2)).get_json()
+        assert 'Этап 5' in page['html'] and page['entries'][0]['status'] == 'Этап 5'
+        # Обозначение изделия, оканчивающееся на /history, открывает список деталей, а не ленту
+        assert 'parts' in client.get(url_for('main.api_parts_for_product', product_designation='ИЗД/history')).get_json()
+
+    def test_invalid_cursor_returns_400(self, client, long_history):
+        """Тест: Поврежденный курсор отклоняется."""
+        response = client.get(url_for('main.api_part_history', part_id='TEST-001', cursor='bm90LWpzb24'))
+        assert response.status_code == 400
@@ -2,11 +2,16 @@
 
 import pytest
 import io
+import os
+import time
+from datetime import timedelta
 import openpyxl
 from docx import Document
 
 from app.services import document_service
 from app.services import graph_service
+from app.services import qr_service
+from app.services import qr_engine
 
 
 class TestDocumentService:
@@ -112,4 +117,107 @@ class TestGraphService:
             graph_service.read_row_from_excel_bytes(excel_bytes, row_number=3)
         
         with pytest.raises(IndexError):
-            graph_service.read_row_from_excel_bytes(excel_bytes, row_number=1) # Строка 1 - это заголовки
\ No newline at end of file
+            graph_service.read_row_from_excel_bytes(excel_bytes, row_number=1) # Строка 1 - это заголовки
+
+
+class TestQRService:
+    """Тесты для кэша QR-кодов."""
+
+    def test_repeat_requests_do_not_re_encode(self, monkeypatch, tmp_path):
+        """
+        Тест: Повторный запрос берется из кэша, параметры отрисовки входят в ключ,
+        а дисковый кэш переживает сброс памяти.
+        """
+        cache = qr_service.QRCache(max_entries=2, folder=str(tmp_path))
+        monkeypatch.setattr(qr_service, '_default_cache', cache)
+        calls = []
+        original_render = qr_engine.render
+        monkeypatch.setattr(qr_engine, 'render', lambda *a, **kw: calls.append(a) or original_render(*a, **kw))
+
+        first = qr_service.get_qr('QR-1')
+        assert first.data.startswith(b'\x89PNG')
+        assert first.etag == qr_service.etag_for('QR-1')
+        assert qr_service.get_qr('QR-1') == first
+        assert len(calls) == 1
+
+        assert qr_service.get_qr('QR-1', box_size=4).etag != first.etag
+        assert len(calls) == 2
+
+        cache.clear()
+        assert qr_service.get_qr('QR-1').data == first.data
+        assert len(calls) == 2
+
+    def test_purge_removes_disk_entries_unused_for_max_age(self, app, tmp_path):
+        """Тест: Уборка удаляет коды, не использованные дольше срока; чтение с диска продлевает срок."""
+        cache = qr_service.QRCache(folder=str(tmp_path))
+        cache.put('old', b'1')
+        cache.put('used', b'2')
+        cache.put('fresh', b'3')
+        week_ago = time.time() - 7 * 86400
+        os.utime(tmp_path / 'old.bin', (week_ago, week_ago))
+        os.utime(tmp_path / 'used.bin', (week_ago, week_ago))
+        cache.clear()
+        assert cache.get('used') == b'2'
+
+        assert qr_service.purge_disk_cache(str(tmp_path), timedelta(days=1)) == 1
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['fresh.bin', 'used.bin']
+
+        app.config['QR_CACHE_FOLDER'] = str(tmp_path)
+        result = app.test_cli_runner().invoke(args=['purge-qr-cache'])
+        assert 'Удалено файлов кэша QR-кодов: 2' in result.output
+        assert list(tmp_path.iterdir()) == []
+
+    def test_lru_evicts_oldest_entry(self):
+        """Тест: При переполнении из памяти вытесняется самый давно использованный код."""
+        cache = qr_service.QRCache(max_entries=2)
+        cache.put('a', b'1')
+        cache.put('b', b'2')
+        cache.get('a')
+        cache.put('c', b'3')
+        assert cache.get('b') is None
+        assert cache.get('a') == b'1' and len(cache) == 2
+
+    def test_prewarm_renders_missing_codes_in_process_pool(self, monkeypatch):
+        """Тест: prewarm рисует в пуле процессов только отсутствующие в кэше коды."""
+        cache = qr_service.QRCache()
+        monkeypatch.setattr(qr_service, '_default_cache', cache)
+        qr_service.get_qr('POOL-1')
+
+        assert qr_service.prewarm(['POOL-1', 'POOL-2', 'POOL-3', 'POOL-2'], workers=2) == 2
+        assert len(cache) == 3
+        assert qr_service.get_qr('POOL-3').data == qr_engine.render(qr_service.scan_url('POOL-3'))
+        assert qr_service.prewarm(['POOL-1', 'POOL-3'], workers=2) == 0
+
+
+class TestQREngine:
+    """Тесты для движка отрисовки QR-кодов."""
+
+    def test_compact_url_uses_alphanumeric_mode(self):
+        """Тест: Компактный URL обратим, целиком алфавитно-цифровой и дает версию не выше полного."""
+        part_id = 'Корпус-001.2/a'
+        assert qr_engine.decode_token(qr_engine.compact_token(part_id)) == part_id
+        assert qr_engine.decode_token(qr_engine.compact_token(part_id).lower()) == part_id
+
+        base_url = 'http://192.168.1.10:5000'
+        compact_url = qr_engine.build_url(base_url, part_id, compact=True)
+        assert set(compact_url) <= set('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:')
+        full_url = qr_engine.build_url(base_url, part_id)
+        assert qr_engine.make_qr(compact_url).version <= qr_engine.make_qr(full_url).version
+
+        with pytest.raises(ValueError):
+            qr_engine.decode_token('0000')
+
+    def test_options_and_svg_output(self):
+        """Тест: Параметры проверяются, SVG рисуется в координатах модулей, уровень коррекции влияет на код."""
+        assert qr_engine.normalize_options({'error_correction': 'h'})['error_correction'] == 'H'
+        for bad in ({'format': 'gif'}, {'error_correction': 'X'}, {'box_size': 0}):
+            with pytest.raises(ValueError):
+                qr_engine.normalize_options(bad)
+        assert qr_engine.parse_options({'ec': 'q', 'compact': '1'}) == {'error_correction': 'Q', 'compact': True}
+
+        url = 'http://127.0.0.1:5000/scan/SVG-1'
+        svg = qr_engine.render(url, format='svg', box_size=4, border=2)
+        modules = len(qr_engine.make_qr(url, border=2).get_matrix())
+        assert svg.startswith(b'<svg') and f'viewBox="0 0 {modules} {modules}"'.encode() in svg
+        assert f'width="{modules * 4}"'.encode() in svg
+        assert qr_engine.render(url, error_correction='L') != qr_engine.render(url, error_correction='H')